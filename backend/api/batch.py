@@ -2,10 +2,7 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Dict
 
-from ml.inference import load_model, recommend
-
-# load once at startup
-model, vocab, device = load_model()
+from ml import serving
 
 router = APIRouter()
 
@@ -22,6 +19,40 @@ class BatchRecommendResponse(BaseModel):
     failed_users: List[str]
 
 
+def recommend_users(model, vocab, device, user_histories: Dict[str, List[str]], top_k: int):
+    """
+    ({user_id: recommendations}, failed user ids). Users without a single
+    known movie fail up front (a pad-only sequence isn't a recommendation).
+    Everyone else goes through one bucketed recommend_batch; if that
+    raises, users are retried one by one so only the bad ones fail.
+    """
+    from ml.inference import recommend_batch
+
+    # one pass; a membership test against the failed list would be O(n^2)
+    users, failed_users = {}, []
+    for user_id, history in user_histories.items():
+        if len(vocab.to_indices(history)):
+            users[user_id] = history
+        else:
+            failed_users.append(user_id)
+
+    # all users at once, bucketed by history length
+    try:
+        recs = recommend_batch(model, vocab, device, list(users.values()), top_k=top_k)
+        return dict(zip(users, recs)), failed_users
+    except Exception as e:
+        print(f"Batch of {len(users)} users failed ({e}); retrying one by one")
+
+    results = {}
+    for user_id, history in users.items():
+        try:
+            results[user_id] = recommend_batch(model, vocab, device, [history], top_k=top_k)[0]
+        except Exception as e:
+            print(f"Failed for user {user_id}: {e}")
+            failed_users.append(user_id)
+    return results, failed_users
+
+
 @router.post("/batch/recommend", response_model=BatchRecommendResponse)
 async def batch_recommend_movies(req: BatchRecommendRequest):
     """
@@ -33,28 +64,8 @@ async def batch_recommend_movies(req: BatchRecommendRequest):
     - Trending content for all users
     """
     
-    results = {}
-    failed_users = []
-    
-    for user_id, history in req.user_histories.items():
-        try:
-            if len(history) == 0:
-                failed_users.append(user_id)
-                continue
-            
-            recs = recommend(
-                model=model,
-                vocab=vocab,
-                device=device,
-                user_history=history,
-                top_k=req.top_k
-            )
-            
-            results[user_id] = recs
-            
-        except Exception as e:
-            print(f"Failed to generate recommendations for user {user_id}: {e}")
-            failed_users.append(user_id)
+    model, vocab, device = serving.model()   # 503 until loaded
+    results, failed_users = recommend_users(model, vocab, device, req.user_histories, req.top_k)
     
     return BatchRecommendResponse(
         results=results,
@@ -75,6 +86,7 @@ async def batch_recommend_and_cache(req: BatchRecommendRequest):
     3. Returns summary stats
     """
     
+    model, vocab, device = serving.model()   # 503 until loaded
     from ml.inference import REDIS_ENABLED, redis_client
     import json
     
@@ -83,22 +95,10 @@ async def batch_recommend_and_cache(req: BatchRecommendRequest):
     
     results = {}
     cached_count = 0
-    failed_users = []
-    
-    for user_id, history in req.user_histories.items():
+    all_recs, failed_users = recommend_users(model, vocab, device, req.user_histories, req.top_k)
+
+    for user_id, recs in all_recs.items():
         try:
-            if len(history) == 0:
-                failed_users.append(user_id)
-                continue
-            
-            recs = recommend(
-                model=model,
-                vocab=vocab,
-                device=device,
-                user_history=history,
-                top_k=req.top_k
-            )
-            
             # Cache in Redis with 24h TTL
             cache_key = f"recs:user:{user_id}"
             redis_client.setex(
@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from ml import serving
+
+router = APIRouter(prefix="/health", tags=["Health"])
+
+STARTED_AT = time.time()
+REDIS_PING_TIMEOUT = 0.5   # seconds
+
+
+async def cache_status() -> str:
+    """Redis (embedding / taste caches): ok, unavailable, or pending until the model is loaded."""
+    if not serving.is_ready("model"):
+        return "pending"
+    from ml.embedding_cache import get_redis
+
+    try:
+        redis = await get_redis()
+        await asyncio.wait_for(redis.ping(), REDIS_PING_TIMEOUT)
+        return "ok"
+    except Exception:
+        return "unavailable"
+
+
+@router.get("/live")
+async def live():
+    """The process is up and serving; never touches the model."""
+    return {"status": "alive", "uptime_seconds": round(time.time() - STARTED_AT, 2)}
+
+
+@router.get("/ready")
+async def ready():
+    """200 once the model and catalog are loaded, 503 before (or if loading failed)."""
+    components = serving.status()
+    components["cache"] = {"status": await cache_status()}
+    body = {"ready": serving.ready(), "components": components}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
@@ -3,20 +3,46 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from datetime import datetime
+from pydantic import ValidationError
+from datetime import datetime, timezone
 
 from db.database import get_db
 from db.models import User, Movie, UserMovieEvent
-from db.schemas import EventCreate, EventResponse
+from db.schemas import (
+    EventCreate, EventResponse,
+    BulkEventRow, BulkEventRequest, BulkEventResponse, BulkRowError,
+)
+from db.user_state import apply_events_to_state
+from db.queries import (
+    existing_movie_ids, upsert_movie_stubs, bulk_insert_events, sync_movie_genres,
+)
 from utils.jwt_handler import get_current_user_id
 from services.omdb_service import fetch_movie_from_omdb
+from utils.data_loader import loaded_movie_title
 
-# Redis cache updater (we'll implement it soon)
-from ml.embedding_cache import update_user_embedding_cache
+from ml import serving
 
 
 router = APIRouter(prefix="/interactions", tags=["Interactions"])
 
+MAX_BULK_EVENTS = 10_000
+EVENT_TYPES = ("watched", "rated")
+
+
+# ---------------------------
+# Redis cache updater (user embedding + incremental taste aggregate)
+# ---------------------------
+async def update_user_embedding_cache(user_id: int, db: AsyncSession, moved):
+    # Until the model has loaded the event is stored but the cached embedding
+    # is left as is; the taste cache notices the length change and resyncs
+    # on the user's next refresh
+    if not serving.is_ready("model"):
+        print(f"Model still loading: embedding cache not refreshed for user {user_id}")
+        return
+
+    from ml.embedding_cache import update_user_embedding_cache as refresh
+    await refresh(user_id, db, moved)
+
 
 # ---------------------------
 # Ensure movie exists locally
@@ -42,6 +68,8 @@ async def ensure_movie_in_db(movie_id: int, db: AsyncSession):
     )
 
     db.add(new_movie)
+    await db.flush()
+    await sync_movie_genres([{"movie_id": movie_id, "genres": new_movie.genres}], db)
     await db.commit()
     await db.refresh(new_movie)
 
@@ -71,11 +99,13 @@ async def log_watched(
     )
 
     db.add(new_event)
+    await db.flush()
+    moved = await apply_events_to_state(user_id, [(new_event.movie_id, new_event.watched_at)], db)
     await db.commit()
     await db.refresh(new_event)
 
     # Update Redis embedding cache
-    await update_user_embedding_cache(user_id, db)
+    await update_user_embedding_cache(user_id, db, moved)
 
     return new_event
 
@@ -101,11 +131,13 @@ async def log_past_watch(
     )
 
     db.add(new_event)
+    await db.flush()
+    moved = await apply_events_to_state(user_id, [(new_event.movie_id, None)], db)
     await db.commit()
     await db.refresh(new_event)
 
     # Update Redis embedding cache
-    await update_user_embedding_cache(user_id, db)
+    await update_user_embedding_cache(user_id, db, moved)
 
     return new_event
 
@@ -130,15 +162,118 @@ async def rate_movie(
     )
 
     db.add(new_event)
+    await db.flush()
+    moved = await apply_events_to_state(user_id, [(new_event.movie_id, None)], db)
     await db.commit()
     await db.refresh(new_event)
 
     # Update Redis embedding cache
-    await update_user_embedding_cache(user_id, db)
+    await update_user_embedding_cache(user_id, db, moved)
 
     return new_event
 
 
+# ---------------------------
+# Bulk import (Letterboxd / MovieLens exports)
+# ---------------------------
+def _validate_bulk_row(raw: dict):
+    """Returns (row, None) for a usable row or (None, error message)."""
+    try:
+        row = BulkEventRow(**raw)
+    except ValidationError as e:
+        return None, "; ".join(err["msg"] for err in e.errors())
+
+    if row.event_type not in EVENT_TYPES:
+        return None, f"event_type must be one of {EVENT_TYPES}"
+    if row.event_type == "rated" and row.rating is None:
+        return None, "rated events need a rating"
+
+    # column is TIMESTAMP WITHOUT TIME ZONE: store aware datetimes as naive UTC
+    if row.watched_at is not None and row.watched_at.tzinfo is not None:
+        row.watched_at = row.watched_at.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return row, None
+
+
+@router.post("/bulk", response_model=BulkEventResponse)
+async def bulk_import(
+    req: BulkEventRequest,
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Import a whole watch history in one request.
+
+    Same semantics as the single-event endpoints: "watched" with a timestamp
+    goes into the sequence, "watched" without one is a past watch, "rated"
+    never affects the sequence. Missing movies are created as stubs (no OMDb
+    call), events go in with one INSERT, the user's sequence state is
+    updated once, and everything commits once.
+    Invalid rows are reported in `errors` and skipped.
+    """
+    if len(req.events) > MAX_BULK_EVENTS:
+        raise HTTPException(413, f"At most {MAX_BULK_EVENTS} events per request")
+
+    rows = []
+    errors = []
+    for i, raw in enumerate(req.events):
+        row, error = _validate_bulk_row(raw)
+        if error:
+            movie_id = raw.get("movie_id")
+            errors.append(BulkRowError(
+                index=i,
+                movie_id=movie_id if isinstance(movie_id, int) else None,
+                error=error,
+            ))
+            continue
+        rows.append(row)
+
+    # Create any movies we have never seen, in one statement
+    known = await existing_movie_ids({r.movie_id for r in rows}, db)
+    stubs = {}
+    for r in rows:
+        if r.movie_id in known or r.movie_id in stubs:
+            continue
+        stubs[r.movie_id] = {
+            "movie_id": r.movie_id,
+            "title": r.title or loaded_movie_title(r.movie_id),   # no blocking CSV read here
+            "genres": r.genres,
+            "release_year": r.release_year,
+        }
+    movies_created = await upsert_movie_stubs(list(stubs.values()), db)
+    await sync_movie_genres(list(stubs.values()), db)
+
+    now = datetime.utcnow()
+    events = [
+        {
+            "user_id": user_id,
+            "movie_id": r.movie_id,
+            "event_type": r.event_type,
+            "rating": r.rating,
+            "watched_at": r.watched_at if r.event_type == "watched" else None,
+            "created_at": now,
+        }
+        for r in rows
+    ]
+    inserted = await bulk_insert_events(events, db)
+    if inserted:
+        moved = await apply_events_to_state(
+            user_id, [(e["movie_id"], e["watched_at"]) for e in events], db
+        )
+    await db.commit()
+
+    # One state update and one cache refresh for the whole batch
+    if inserted:
+        await update_user_embedding_cache(user_id, db, moved)
+
+    return BulkEventResponse(
+        received=len(req.events),
+        inserted=inserted,
+        movies_created=movies_created,
+        errors=errors,
+    )
+
+
 # ---------------------------
 # Get user history (full timeline)
 # ---------------------------
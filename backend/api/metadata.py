@@ -1,15 +1,12 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel
 from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
-from ml.inference import load_model, recommend
 from db.database import get_db
 from db.models import Movie
-
-# load once at startup
-model, vocab, device = load_model()
+from ml import serving
 
 router = APIRouter()
 
@@ -17,7 +14,7 @@ router = APIRouter()
 class MetadataFilterRequest(BaseModel):
     user_id: int
     history: List[str]     # list of movie_ids watched in order
-    top_k: int = 50        # get more initially, then filter
+    top_k: Optional[int] = None   # deprecated, ignored: filters apply before top-K now
     genres: Optional[List[str]] = None
     min_year: Optional[int] = None
     max_year: Optional[int] = None
@@ -35,60 +32,54 @@ async def recommend_with_filters(req: MetadataFilterRequest, db: AsyncSession =
     if len(req.history) == 0:
         raise HTTPException(400, "User history is empty")
 
-    # Get initial recommendations (more than needed)
-    recs = recommend(
-        model=model,
-        vocab=vocab,
-        device=device,
-        user_history=req.history,
-        top_k=req.top_k
-    )
+    # shared with the other routers; 503 until loaded
+    model, vocab, device = serving.model()
+    item_meta = serving.catalog()
+    from ml.inference import recommend
 
-    # Extract movie IDs from recommendations
-    movie_ids = [r["movie_id"] for r in recs]
+    if req.genres:
+        # Genre filter: only score the items in the genres' posting lists
+        candidates = item_meta.genre_candidates(req.genres, req.min_year, req.max_year)
+        recs = recommend(
+            model=model,
+            vocab=vocab,
+            device=device,
+            user_history=req.history,
+            top_k=req.final_k,
+            candidate_items=candidates,
+        )
+    else:
+        # Year-only filter: mask over the catalog, applied before top-K
+        item_mask = item_meta.filter_mask(min_year=req.min_year, max_year=req.max_year)
+        recs = recommend(
+            model=model,
+            vocab=vocab,
+            device=device,
+            user_history=req.history,
+            top_k=req.final_k,
+            item_mask=item_mask,
+        )
 
-    # Fetch metadata from database
-    result = await db.execute(
-        select(Movie).where(Movie.movie_id.in_(movie_ids))
-    )
-    movies = {str(m.movie_id): m for m in result.scalars().all()}
+    # Add metadata from the in-memory catalog; only posters come from the
+    # DB, one primary-key lookup for the final_k results
+    rec_idx = vocab.to_indices([rec["movie_id"] for rec in recs]).tolist()
+    posters = {}
+    if recs:
+        result = await db.execute(
+            select(Movie.movie_id, Movie.poster_url).where(Movie.movie_id.in_([rec["movie_id"] for rec in recs]))
+        )
+        posters = dict(result.all())
 
-    # Apply filters
     filtered_recs = []
-    for rec in recs:
-        movie_id = rec["movie_id"]
-        
-        # Skip if movie not in DB
-        if movie_id not in movies:
-            continue
-            
-        movie = movies[movie_id]
-        
-        # Genre filter
-        if req.genres:
-            movie_genres = movie.genres if movie.genres else []
-            if not any(g in movie_genres for g in req.genres):
-                continue
-        
-        # Year filter
-        if req.min_year and movie.year and movie.year < req.min_year:
-            continue
-        if req.max_year and movie.year and movie.year > req.max_year:
-            continue
-        
-        # Add metadata to recommendation
+    for rec, idx in zip(recs, rec_idx):
         filtered_recs.append({
-            "movie_id": movie_id,
+            "movie_id": rec["movie_id"],
             "score": rec["score"],
-            "title": movie.title,
-            "genres": movie.genres,
-            "year": movie.year,
-            "poster_url": movie.poster_url
+            "title": item_meta.titles[idx],
+            "genres": item_meta.genres_of(idx),
+            "year": item_meta.year_of(idx),
+            "poster_url": posters.get(rec["movie_id"]),
         })
-        
-        # Stop when we have enough
-        if len(filtered_recs) >= req.final_k:
-            break
 
     filters_applied = {
         "genres": req.genres,
@@ -101,3 +92,38 @@ async def recommend_with_filters(req: MetadataFilterRequest, db: AsyncSession =
         recommendations=filtered_recs,
         filters_applied=filters_applied
     )
+
+
+# ---------------------------
+# Genre browsing (in-memory posting lists)
+# ---------------------------
+@router.get("/genres")
+async def list_genres():
+    item_meta = serving.catalog()   # 503 until loaded
+    return {
+        "genres": [
+            {"name": g, "count": int(item_meta.genre_postings[g].numel())}
+            for g in item_meta.genre_names
+        ]
+    }
+
+
+@router.get("/genres/{genre}/movies")
+async def browse_genre(genre: str, offset: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=500)):
+    model, vocab, device = serving.model()   # 503 until loaded
+    item_meta = serving.catalog()
+    posting = item_meta.posting(genre)
+    if posting is None:
+        raise HTTPException(404, f"Unknown genre: {genre}")
+
+    page = posting[offset: offset + limit]
+    movies = [
+        {
+            "movie_id": movie_id,
+            "title": item_meta.titles[idx],
+            "year": item_meta.year_of(idx),
+        }
+        for idx, movie_id in zip(page.tolist(), vocab.to_ids(page).tolist())
+    ]
+
+    return {"genre": genre, "total": int(posting.numel()), "offset": offset, "movies": movies}
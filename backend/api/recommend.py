@@ -1,20 +1,12 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
-from ml.inference import recommend, load_model
+from ml import serving
 from services.tmdb import tmdb_service
 import asyncio
 
 router = APIRouter()
 
-# Load model on startup
-try:
-    model, vocab, user_embeddings = load_model()
-    print("Model loaded successfully in API")
-except Exception as e:
-    print(f"Failed to load model: {e}")
-    model = None
-
 class RecommendRequest(BaseModel):
     user_id: int
     history: List[str]  # List of movie IDs
@@ -35,11 +27,11 @@ class RecommendResponse(BaseModel):
 
 @router.post("/recommend", response_model=RecommendResponse)
 async def get_recommendations(request: RecommendRequest):
-    if model is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
+    # loaded in the background at startup; 503 until then (main.py)
+    model, vocab, device = serving.model()
+    from ml.inference import recommend
 
     # Get raw recommendations (IDs and scores)
-    device = model.item_embedding.weight.device
     recs = recommend(
         model=model,
         vocab=vocab,
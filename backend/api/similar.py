@@ -1,21 +1,17 @@
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 
-import torch
-import torch.nn.functional as F
-
-from ml.inference import load_model
-
-# load the same model + vocab at startup
-model, vocab, device = load_model()
+from ml import serving
 
 router = APIRouter()
 
+MAX_SEEDS = 50
+
 
 class SimilarRequest(BaseModel):
     movie_id: str
-    top_k: int = 20
+    top_k: int = Field(20, gt=0)
 
 
 class SimilarResponse(BaseModel):
@@ -26,43 +22,82 @@ class SimilarResponse(BaseModel):
 @router.post("/similar", response_model=SimilarResponse)
 async def similar_items(req: SimilarRequest):
     movie_id = req.movie_id
+    model, vocab, device = serving.model()   # 503 until loaded
+    from ml.neighbors import similar_live
 
-    movie_to_idx = vocab["movie_id_to_index"]
-    idx_to_movie = vocab["index_to_movie_id"]
-
-    if movie_id not in movie_to_idx:
+    # get index
+    idx = vocab.index_of(movie_id)
+    if idx is None:
         raise HTTPException(404, f"Movie {movie_id} not found in vocab.")
 
-    # get index
-    idx = movie_to_idx[movie_id]
+    # stored neighbours: one row slice; deeper requests (or no table yet) scan live
+    table = serving.neighbors()   # None until loaded: live
+    if table is not None and req.top_k <= table.depth:
+        top_indices, top_scores = table.lookup(idx, req.top_k)
+    else:
+        top_scores, top_indices = similar_live(model, vocab.pad_index, idx, req.top_k)
 
-    # get embedding for this movie
-    with torch.no_grad():
-        item_emb = model.item_embedding.weight.detach()    # [num_items, d]
-        query_vec = item_emb[idx].unsqueeze(0)             # [1, d]
+    results = [
+        {"movie_id": movie_id_out, "similarity": float(score)}
+        for movie_id_out, score in zip(vocab.to_ids(top_indices).tolist(), top_scores.tolist())
+    ]
 
-        # L2 normalize for cosine similarity
-        item_norm = F.normalize(item_emb, dim=1)
-        query_norm = F.normalize(query_vec, dim=1)
+    return SimilarResponse(
+        movie_id=movie_id,
+        similar=results
+    )
 
-        # similarity scores (cosine similarity)
-        scores = torch.matmul(item_norm, query_norm.T).squeeze(1)   # [num_items]
 
-        # remove itself
-        scores[idx] = -999
+class MultiSimilarRequest(BaseModel):
+    seed_movie_ids: List[str]             # e.g. the movies of a "because you watched" row
+    exclude_movie_ids: List[str] = []     # e.g. the user's history; seeds are always excluded
+    top_k: int = Field(20, gt=0)
+    aggregate: Optional[Literal["mean", "max"]] = None   # None: one list per seed
 
-        # top-K
-        top_scores, top_indices = torch.topk(scores, req.top_k)
 
-    results = []
-    for score, movie_idx in zip(top_scores.tolist(), top_indices.tolist()):
-        movie_id_out = idx_to_movie[str(movie_idx)]
-        results.append({
-            "movie_id": movie_id_out,
-            "similarity": float(score)
-        })
+class MultiSimilarResponse(BaseModel):
+    per_seed: Optional[List[SimilarResponse]] = None
+    similar: Optional[List[dict]] = None   # aggregated ranking
+    unknown_seeds: List[str] = []
 
-    return SimilarResponse(
-        movie_id=movie_id,
-        similar=results
+
+@router.post("/similar/multi", response_model=MultiSimilarResponse)
+async def similar_items_multi(req: MultiSimilarRequest):
+    if len(req.seed_movie_ids) > MAX_SEEDS:
+        raise HTTPException(400, f"At most {MAX_SEEDS} seed movies per request.")
+
+    model, vocab, device = serving.model()   # 503 until loaded
+    from ml.neighbors import similar_multi
+
+    # unknown seeds are reported, not fatal: a row can still be built from the rest
+    seed_idx = vocab.to_indices(req.seed_movie_ids, drop_unknown=False)
+    known = seed_idx != vocab.pad_index
+    seeds = [m for m, ok in zip(req.seed_movie_ids, known) if ok]
+    unknown = [m for m, ok in zip(req.seed_movie_ids, known) if not ok]
+    if not seeds:
+        raise HTTPException(404, "None of the seed movies are in the vocab.")
+
+    # one [S, d] x [d, N] matmul for all seeds; exclusions applied before topk
+    top_scores, top_indices = similar_multi(
+        model,
+        vocab.pad_index,
+        seed_idx[known],
+        req.top_k,
+        exclude_idx=vocab.to_indices(req.exclude_movie_ids),
+        aggregate=req.aggregate,
+    )
+
+    rows = [
+        [
+            {"movie_id": movie_id_out, "similarity": score}
+            for movie_id_out, score in zip(ids_row, scores_row)
+        ]
+        for ids_row, scores_row in zip(vocab.to_ids(top_indices.cpu()).tolist(), top_scores.tolist())
+    ]
+
+    if req.aggregate is not None:
+        return MultiSimilarResponse(similar=rows[0], unknown_seeds=unknown)
+    return MultiSimilarResponse(
+        per_seed=[SimilarResponse(movie_id=m, similar=r) for m, r in zip(seeds, rows)],
+        unknown_seeds=unknown,
     )
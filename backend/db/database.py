@@ -8,6 +8,8 @@ from sqlalchemy.ext.asyncio import (
 from sqlalchemy.orm import DeclarativeBase
 import os
 
+from db.instrumentation import InstrumentedQueuePool, instrument_engine
+
 
 # ------------------------------
 # Base class for all ORM models
@@ -29,11 +31,17 @@ DATABASE_URL = os.getenv(
 # ------------------------------
 # Async Engine
 # ------------------------------
+# SQL_ECHO=1 logs every statement (slow; local debugging only).
+# Per-request timing is collected by db/instrumentation.py instead.
 engine = create_async_engine(
     DATABASE_URL,
-    echo=True,           # Turn off in production
+    echo=os.getenv("SQL_ECHO", "0") == "1",
+    poolclass=InstrumentedQueuePool,
+    pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
     future=True
 )
+instrument_engine(engine)
 
 
 # ------------------------------
@@ -0,0 +1,179 @@
+# backend/db/instrumentation.py
+
+import logging
+import os
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+logger = logging.getLogger("db.sql")
+
+
+# ------------------------------
+# Config
+# ------------------------------
+SQL_DEBUG = os.getenv("SQL_DEBUG", "0") == "1"                 # add X-DB-* response headers
+SQL_QUERY_BUDGET = int(os.getenv("SQL_QUERY_BUDGET", "20"))     # warn above this many queries per request
+STATEMENT_PREVIEW_CHARS = 200
+
+
+# ------------------------------
+# Per-request stats
+# ------------------------------
+class RequestDBStats:
+    """SQL activity for one HTTP request (lives in a ContextVar)."""
+
+    def __init__(self):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+        self.pool_wait = 0.0
+        self.checkouts = 0
+
+    def record_query(self, statement: str, elapsed: float):
+        self.query_count += 1
+        self.db_time += elapsed
+        if elapsed > self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+    def headers(self, pool_status: dict) -> Dict[str, str]:
+        return {
+            "X-DB-Queries": str(self.query_count),
+            "X-DB-Time-Ms": f"{self.db_time * 1000:.2f}",
+            "X-DB-Slowest-Ms": f"{self.slowest_time * 1000:.2f}",
+            "X-DB-Pool-Wait-Ms": f"{self.pool_wait * 1000:.2f}",
+            "X-DB-Pool-Checked-Out": f"{pool_status['checked_out']}/{pool_status['capacity']}",
+        }
+
+
+_current_stats: ContextVar[Optional[RequestDBStats]] = ContextVar("db_request_stats", default=None)
+
+
+def start_request_stats() -> RequestDBStats:
+    stats = RequestDBStats()
+    _current_stats.set(stats)
+    return stats
+
+
+# ------------------------------
+# Aggregate metrics (per route)
+# ------------------------------
+class RouteDBMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0          # responses >= 500, including unhandled exceptions
+        self.queries = 0
+        self.max_queries = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        self.over_budget = 0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+
+    def as_dict(self) -> dict:
+        n = max(self.requests, 1)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_queries": round(self.queries / n, 2),
+            "max_queries": self.max_queries,
+            "avg_db_ms": round(self.db_time * 1000 / n, 2),
+            "avg_pool_wait_ms": round(self.pool_wait * 1000 / n, 2),
+            "over_budget": self.over_budget,
+            "slowest_ms": round(self.slowest_time * 1000, 2),
+            "slowest_statement": self.slowest_statement,
+        }
+
+
+_route_metrics: Dict[str, RouteDBMetrics] = defaultdict(RouteDBMetrics)
+
+
+def finish_request_stats(stats: RequestDBStats, route: str, status_code: int = 200):
+    m = _route_metrics[route]
+    m.requests += 1
+    if status_code >= 500:
+        m.errors += 1
+    m.queries += stats.query_count
+    m.max_queries = max(m.max_queries, stats.query_count)
+    m.db_time += stats.db_time
+    m.pool_wait += stats.pool_wait
+    if stats.slowest_time > m.slowest_time:
+        m.slowest_time = stats.slowest_time
+        m.slowest_statement = stats.slowest_statement
+
+    if stats.query_count > SQL_QUERY_BUDGET:
+        m.over_budget += 1
+        logger.warning(
+            "query budget exceeded route=%s queries=%d budget=%d db_ms=%.1f slowest_ms=%.1f slowest=%r",
+            route, stats.query_count, SQL_QUERY_BUDGET,
+            stats.db_time * 1000, stats.slowest_time * 1000, stats.slowest_statement,
+        )
+
+
+def pool_status(engine) -> dict:
+    pool = engine.pool
+    size = pool.size()
+    max_overflow = getattr(pool, "_max_overflow", 0)
+    checked_out = pool.checkedout()
+    capacity = size + max(max_overflow, 0)
+    return {
+        "size": size,
+        "checked_out": checked_out,
+        "overflow": pool.overflow(),
+        "capacity": capacity,
+        "utilization": round(checked_out / capacity, 3) if capacity else None,
+    }
+
+
+def db_metrics_snapshot(engine) -> dict:
+    return {
+        "query_budget": SQL_QUERY_BUDGET,
+        "pool": pool_status(engine),
+        "routes": {route: m.as_dict() for route, m in sorted(_route_metrics.items())},
+    }
+
+
+# ------------------------------
+# Engine hooks
+# ------------------------------
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that charges checkout wait time to the current request."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            stats = _current_stats.get()
+            if stats is not None:
+                stats.pool_wait += time.perf_counter() - start
+                stats.checkouts += 1
+
+
+def instrument_engine(engine):
+    """Time every statement on `engine` (an AsyncEngine) into the current request's stats."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.record_query(" ".join(statement.split())[:STATEMENT_PREVIEW_CHARS], elapsed)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
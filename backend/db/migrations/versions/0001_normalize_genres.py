@@ -0,0 +1,60 @@
+"""normalize movie genres into genre + movie_genre
+
+Revision ID: 0001_normalize_genres
+Revises:
+Create Date: 2026-10-19 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001_normalize_genres"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# movie.genres is "Action, Adventure" from OMDb or "Action|Adventure" from MovieLens
+SPLIT_GENRES = "CROSS JOIN LATERAL regexp_split_to_table(m.genres, '[,|]') AS g"
+
+
+def upgrade():
+    op.create_table(
+        "genre",
+        sa.Column("genre_id", sa.Integer, primary_key=True),
+        sa.Column("name", sa.String, nullable=False),
+    )
+    op.create_index("ix_genre_genre_id", "genre", ["genre_id"])
+    op.create_index("ix_genre_name", "genre", ["name"], unique=True)
+
+    op.create_table(
+        "movie_genre",
+        sa.Column("movie_id", sa.Integer, sa.ForeignKey("movie.movie_id"), primary_key=True),
+        sa.Column("genre_id", sa.Integer, sa.ForeignKey("genre.genre_id"), primary_key=True),
+    )
+    op.create_index("ix_movie_genre_genre_id", "movie_genre", ["genre_id"])
+
+    # Backfill from the existing free-text column
+    op.execute(f"""
+        INSERT INTO genre (name)
+        SELECT DISTINCT trim(g)
+        FROM movie m {SPLIT_GENRES}
+        WHERE trim(g) NOT IN ('', '(no genres listed)')
+        ON CONFLICT (name) DO NOTHING
+    """)
+    op.execute(f"""
+        INSERT INTO movie_genre (movie_id, genre_id)
+        SELECT DISTINCT m.movie_id, ge.genre_id
+        FROM movie m {SPLIT_GENRES}
+        JOIN genre ge ON ge.name = trim(g)
+        ON CONFLICT DO NOTHING
+    """)
+
+
+def downgrade():
+    op.drop_index("ix_movie_genre_genre_id", table_name="movie_genre")
+    op.drop_table("movie_genre")
+    op.drop_index("ix_genre_name", table_name="genre")
+    op.drop_index("ix_genre_genre_id", table_name="genre")
+    op.drop_table("genre")
@@ -0,0 +1,33 @@
+"""per-user sequence state table
+
+Revision ID: 0002_user_sequence_state
+Revises: 0001_normalize_genres
+Create Date: 2026-10-19 11:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0002_user_sequence_state"
+down_revision = "0001_normalize_genres"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "user_sequence_state",
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user.user_id"), primary_key=True),
+        sa.Column("recent_movie_ids", postgresql.ARRAY(sa.Integer), nullable=False, server_default="{}"),
+        sa.Column("taste_movie_ids", postgresql.ARRAY(sa.Integer), nullable=False, server_default="{}"),
+        sa.Column("last_watched_at", sa.TIMESTAMP, nullable=True),
+        sa.Column("event_count", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.TIMESTAMP, nullable=True),
+    )
+    # Rows are filled by `python -m db.user_state backfill`
+
+
+def downgrade():
+    op.drop_table("user_sequence_state")
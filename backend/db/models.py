@@ -1,8 +1,9 @@
 from sqlalchemy.orm import relationship, DeclarativeBase
 from sqlalchemy import (
     Column, Integer, String, Float, Text,
-    TIMESTAMP, ForeignKey, JSON
+    TIMESTAMP, ForeignKey, JSON, Table
 )
+from sqlalchemy.dialects.postgresql import ARRAY
 from datetime import datetime
 
 
@@ -25,6 +26,30 @@ class User(Base):
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
 
     events = relationship("UserMovieEvent", back_populates="user")
+    sequence_state = relationship("UserSequenceState", back_populates="user", uselist=False)
+
+
+# ---------------------------
+# Movie <-> Genre Association
+# ---------------------------
+movie_genre = Table(
+    "movie_genre",
+    Base.metadata,
+    Column("movie_id", Integer, ForeignKey("movie.movie_id"), primary_key=True),
+    Column("genre_id", Integer, ForeignKey("genre.genre_id"), primary_key=True, index=True),
+)
+
+
+# ---------------------------
+# Genre Table
+# ---------------------------
+class Genre(Base):
+    __tablename__ = "genre"
+
+    genre_id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False, index=True)
+
+    movies = relationship("Movie", secondary=movie_genre, back_populates="genre_list")
 
 
 # ---------------------------
@@ -35,13 +60,14 @@ class Movie(Base):
 
     movie_id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
-    genres = Column(String, nullable=True)         # simple comma-separated string
+    genres = Column(String, nullable=True)         # raw string from source; normalized in movie_genre
     poster_url = Column(String, nullable=True)
     description = Column(Text, nullable=True)
     release_year = Column(Integer, nullable=True)
     metadata_json = Column(JSON, nullable=True)     # TMDB full metadata (JSONB)
 
     events = relationship("UserMovieEvent", back_populates="movie")
+    genre_list = relationship("Genre", secondary=movie_genre, back_populates="movies")
 
 
 # ---------------------------
@@ -62,3 +88,21 @@ class UserMovieEvent(Base):
 
     user = relationship("User", back_populates="events")
     movie = relationship("Movie", back_populates="events")
+
+
+# ---------------------------
+# Per-User Sequence State
+# (denormalized from user_movie_event, maintained by db/user_state.py)
+# ---------------------------
+class UserSequenceState(Base):
+    __tablename__ = "user_sequence_state"
+
+    user_id = Column(Integer, ForeignKey("user.user_id"), primary_key=True)
+
+    recent_movie_ids = Column(ARRAY(Integer), nullable=False, default=list)  # last MAX_SEQ_LEN + 1 timed watches, oldest first
+    taste_movie_ids = Column(ARRAY(Integer), nullable=False, default=list)   # past watches, ratings, and items that left the window
+    last_watched_at = Column(TIMESTAMP, nullable=True)                       # newest watched_at in recent_movie_ids
+    event_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    user = relationship("User", back_populates="sequence_state")
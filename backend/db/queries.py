@@ -0,0 +1,145 @@
+# backend/db/queries.py
+
+from typing import Iterable, List, Dict, Any, Set
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models import Movie
+
+
+# ---------------------------
+# Movie lookups
+# ---------------------------
+async def existing_movie_ids(movie_ids: Iterable[int], db: AsyncSession) -> Set[int]:
+    """Return the subset of `movie_ids` that already has a row in `movie`."""
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return set()
+
+    result = await db.execute(select(Movie.movie_id).where(Movie.movie_id.in_(movie_ids)))
+    return set(result.scalars().all())
+
+
+# ---------------------------
+# Bulk movie upsert
+# ---------------------------
+# unnest() over array parameters keeps this a single statement with 4 bind
+# params no matter how many rows we send (a VALUES list would hit the
+# 32k bind-parameter limit of the Postgres wire protocol).
+UPSERT_MOVIE_STUBS_SQL = text("""
+    INSERT INTO movie (movie_id, title, genres, release_year)
+    SELECT * FROM unnest(
+        CAST(:movie_ids AS INTEGER[]),
+        CAST(:titles AS VARCHAR[]),
+        CAST(:genres AS VARCHAR[]),
+        CAST(:release_years AS INTEGER[])
+    )
+    ON CONFLICT (movie_id) DO NOTHING
+    RETURNING movie_id
+""")
+
+
+async def upsert_movie_stubs(movies: List[Dict[str, Any]], db: AsyncSession) -> int:
+    """
+    Insert minimal movie rows (id, title, genres, year) in one statement.
+    Rows that already exist are left untouched. Returns the number created.
+    """
+    if not movies:
+        return 0
+
+    result = await db.execute(
+        UPSERT_MOVIE_STUBS_SQL,
+        {
+            "movie_ids": [m["movie_id"] for m in movies],
+            "titles": [m["title"] for m in movies],
+            "genres": [m.get("genres") for m in movies],
+            "release_years": [m.get("release_year") for m in movies],
+        },
+    )
+    return len(result.scalars().all())
+
+
+# ---------------------------
+# Bulk event insert
+# ---------------------------
+INSERT_EVENTS_SQL = text("""
+    INSERT INTO user_movie_event (user_id, movie_id, event_type, rating, watched_at, created_at)
+    SELECT * FROM unnest(
+        CAST(:user_ids AS INTEGER[]),
+        CAST(:movie_ids AS INTEGER[]),
+        CAST(:event_types AS VARCHAR[]),
+        CAST(:ratings AS FLOAT[]),
+        CAST(:watched_ats AS TIMESTAMP[]),
+        CAST(:created_ats AS TIMESTAMP[])
+    )
+""")
+
+
+async def bulk_insert_events(events: List[Dict[str, Any]], db: AsyncSession) -> int:
+    """
+    Insert many user_movie_event rows with a single multi-row INSERT.
+    Does not commit. Returns the number of rows inserted.
+    """
+    if not events:
+        return 0
+
+    await db.execute(
+        INSERT_EVENTS_SQL,
+        {
+            "user_ids": [e["user_id"] for e in events],
+            "movie_ids": [e["movie_id"] for e in events],
+            "event_types": [e["event_type"] for e in events],
+            "ratings": [e.get("rating") for e in events],
+            "watched_ats": [e.get("watched_at") for e in events],
+            "created_ats": [e["created_at"] for e in events],
+        },
+    )
+    return len(events)
+
+
+# ---------------------------
+# Genre normalization
+# ---------------------------
+# Splits each movie's raw genres string ("A, B" from OMDb, "A|B" from
+# MovieLens), creates any new genre rows and links movie_genre, all in one
+# statement. Every genre id, new or existing, comes back through RETURNING:
+# the outer INSERT cannot see rows written by the CTE, and the no-op DO UPDATE
+# also returns a row inserted concurrently by another transaction (DO NOTHING
+# would return nothing for it, and that snapshot can't see it either).
+SYNC_MOVIE_GENRES_SQL = text("""
+    WITH pairs AS (
+        SELECT DISTINCT p.movie_id, trim(g) AS name
+        FROM unnest(
+            CAST(:movie_ids AS INTEGER[]),
+            CAST(:genres AS VARCHAR[])
+        ) AS p(movie_id, genres)
+        CROSS JOIN LATERAL regexp_split_to_table(p.genres, '[,|]') AS g
+        WHERE trim(g) NOT IN ('', '(no genres listed)')
+    ),
+    genre_ids AS (
+        INSERT INTO genre (name)
+        SELECT DISTINCT name FROM pairs
+        ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+        RETURNING genre_id, name
+    )
+    INSERT INTO movie_genre (movie_id, genre_id)
+    SELECT pairs.movie_id, g.genre_id
+    FROM pairs
+    JOIN genre_ids g ON g.name = pairs.name
+    ON CONFLICT DO NOTHING
+""")
+
+
+async def sync_movie_genres(movies: List[Dict[str, Any]], db: AsyncSession):
+    """Link movies (dicts with movie_id + genres) to normalized genre rows. Does not commit."""
+    movies = [m for m in movies if m.get("genres")]
+    if not movies:
+        return
+
+    await db.execute(
+        SYNC_MOVIE_GENRES_SQL,
+        {
+            "movie_ids": [m["movie_id"] for m in movies],
+            "genres": [m["genres"] for m in movies],
+        },
+    )
@@ -1,7 +1,7 @@
 # backend/db/schemas.py
 
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 
@@ -78,6 +78,33 @@ class EventResponse(BaseModel):
         from_attributes = True
 
 
+# ---------------------------
+# Bulk Import Schemas
+# ---------------------------
+class BulkEventRow(EventCreate):
+    # optional metadata from the export, used when the movie is not in the DB yet
+    title: Optional[str] = None
+    genres: Optional[str] = None
+    release_year: Optional[int] = None
+
+
+class BulkEventRequest(BaseModel):
+    events: List[Dict[str, Any]]   # raw rows, validated one by one as BulkEventRow
+
+
+class BulkRowError(BaseModel):
+    index: int                     # position in the request's `events` list
+    movie_id: Optional[int] = None
+    error: str
+
+
+class BulkEventResponse(BaseModel):
+    received: int
+    inserted: int
+    movies_created: int
+    errors: List[BulkRowError]
+
+
 # ---------------------------
 # User History Response
 # ---------------------------
@@ -0,0 +1,250 @@
+# backend/db/user_state.py
+
+import argparse
+import asyncio
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.database import AsyncSessionLocal
+from db.models import User, UserMovieEvent, UserSequenceState
+
+
+# ------------------------------
+# Config
+# ------------------------------
+MAX_SEQ_LEN = 50                 # keep in sync with ml/inference.py
+STATE_WINDOW = MAX_SEQ_LEN + 1   # recent items kept in order; older ones count as taste
+STATE_LOCK_CLASS = 0x5E05        # pg_advisory_xact_lock(class, user_id) namespace for state updates
+
+# (movie_id, watched_at) — watched_at is None for past watches and ratings
+EventTuple = Tuple[int, Optional[datetime]]
+
+
+# ------------------------------
+# Pure state building
+# ------------------------------
+def build_state(events: Iterable[EventTuple]):
+    """
+    Build (recent, taste, last_watched_at) from ALL of a user's events.
+    Same split as inference and preprocessing: timed watches in order, the
+    last STATE_WINDOW of them are the sequence, everything else is taste.
+    """
+    events = list(events)
+    timed = sorted((e for e in events if e[1] is not None), key=lambda e: e[1])
+    untimed = [movie_id for movie_id, watched_at in events if watched_at is None]
+
+    timed_ids = [movie_id for movie_id, _ in timed]
+    recent = timed_ids[-STATE_WINDOW:]
+    taste = timed_ids[:-STATE_WINDOW] + untimed
+    last_watched_at = timed[-1][1] if timed else None
+
+    return recent, taste, last_watched_at
+
+
+def advance_state(recent: List[int], taste: List[int], new_events: List[EventTuple]):
+    """
+    Apply new events (all newer than the current state) to (recent, taste).
+    Returns (recent, taste, moved) where `moved` are the ids that entered taste.
+    """
+    timed = sorted((e for e in new_events if e[1] is not None), key=lambda e: e[1])
+    untimed = [movie_id for movie_id, watched_at in new_events if watched_at is None]
+
+    recent = recent + [movie_id for movie_id, _ in timed]
+    overflow = recent[:-STATE_WINDOW]
+    recent = recent[-STATE_WINDOW:]
+
+    moved = overflow + untimed
+    return recent, taste + moved, moved
+
+
+# ------------------------------
+# DB helpers
+# ------------------------------
+async def _load_events(user_ids: List[int], db: AsyncSession) -> Dict[int, List[EventTuple]]:
+    result = await db.execute(
+        select(UserMovieEvent.user_id, UserMovieEvent.movie_id, UserMovieEvent.watched_at)
+        .where(UserMovieEvent.user_id.in_(user_ids))
+        .order_by(UserMovieEvent.user_id, UserMovieEvent.created_at, UserMovieEvent.event_id)
+    )
+    events = defaultdict(list)
+    for user_id, movie_id, watched_at in result.all():
+        events[user_id].append((movie_id, watched_at))
+    return events
+
+
+async def _write_state(db: AsyncSession, user_id: int, recent, taste, last_watched_at, event_count: int):
+    values = {
+        "user_id": user_id,
+        "recent_movie_ids": recent,
+        "taste_movie_ids": taste,
+        "last_watched_at": last_watched_at,
+        "event_count": event_count,
+        "updated_at": datetime.utcnow(),
+    }
+    stmt = pg_insert(UserSequenceState).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserSequenceState.user_id],
+        set_={k: stmt.excluded[k] for k in values if k != "user_id"},
+    )
+    await db.execute(stmt)
+
+
+async def get_user_state(user_id: int, db: AsyncSession) -> Optional[UserSequenceState]:
+    """Everything inference needs for a user, in one primary-key lookup."""
+    # populate_existing: sessions don't expire on commit, and the state is
+    # written with Core upserts that bypass the identity map
+    return await db.get(UserSequenceState, user_id, populate_existing=True)
+
+
+async def rebuild_user_state(user_id: int, db: AsyncSession):
+    """Recompute a user's state from user_movie_event. Does not commit."""
+    events = (await _load_events([user_id], db)).get(user_id, [])
+    recent, taste, last_watched_at = build_state(events)
+    await _write_state(db, user_id, recent, taste, last_watched_at, len(events))
+    return recent, taste
+
+
+async def apply_events_to_state(user_id: int, new_events: List[EventTuple], db: AsyncSession):
+    """
+    Fold newly inserted events into the user's state, in the caller's
+    transaction (call after the events are flushed, before commit).
+
+    Concurrent requests for the same user serialize on a transaction-level
+    advisory lock on the user id (FOR UPDATE alone locks nothing while the
+    user has no row yet, so two first writes would both rebuild, each
+    without the other's events, and the later upsert would win). Once the
+    lock is held, the statements below see every committed event. Falls
+    back to a full rebuild when there is no row yet or a timed event is
+    older than the newest one already in the window.
+
+    Returns the movie ids that entered the taste set (None after a rebuild).
+    """
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(:lock_class, :user_id)"),
+        {"lock_class": STATE_LOCK_CLASS, "user_id": user_id},
+    )
+    result = await db.execute(
+        select(UserSequenceState)
+        .where(UserSequenceState.user_id == user_id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    state = result.scalar_one_or_none()
+
+    timestamps = [watched_at for _, watched_at in new_events if watched_at is not None]
+    out_of_order = (
+        state is not None
+        and state.last_watched_at is not None
+        and timestamps
+        and min(timestamps) < state.last_watched_at
+    )
+
+    if state is None or out_of_order:
+        await rebuild_user_state(user_id, db)
+        return None
+
+    recent, taste, moved = advance_state(
+        list(state.recent_movie_ids), list(state.taste_movie_ids), new_events
+    )
+    last_watched_at = max(timestamps) if timestamps else state.last_watched_at
+    await _write_state(
+        db, user_id, recent, taste, last_watched_at, state.event_count + len(new_events)
+    )
+    return moved
+
+
+# ------------------------------
+# Backfill + consistency check
+# ------------------------------
+def _same_state(stored: Optional[UserSequenceState], recent, taste) -> bool:
+    if stored is None:
+        return False
+    # taste is an unordered set; the order items arrived in may differ
+    return (
+        list(stored.recent_movie_ids) == recent
+        and Counter(stored.taste_movie_ids) == Counter(taste)
+    )
+
+
+async def _user_id_batches(db: AsyncSession, batch_size: int):
+    result = await db.execute(select(User.user_id).order_by(User.user_id))
+    user_ids = list(result.scalars().all())
+    for i in range(0, len(user_ids), batch_size):
+        yield user_ids[i: i + batch_size]
+
+
+async def backfill(batch_size: int = 500):
+    """Rebuild every user's state from user_movie_event, one commit per batch."""
+    n_users = 0
+    async with AsyncSessionLocal() as db:
+        async for user_ids in _user_id_batches(db, batch_size):
+            events = await _load_events(user_ids, db)
+            for user_id in user_ids:
+                user_events = events.get(user_id, [])
+                recent, taste, last_watched_at = build_state(user_events)
+                await _write_state(db, user_id, recent, taste, last_watched_at, len(user_events))
+            await db.commit()
+            n_users += len(user_ids)
+            print(f"Backfilled {n_users} users")
+
+
+async def check(batch_size: int = 500, fix: bool = False):
+    """Compare stored state with a rebuild from events; optionally repair mismatches."""
+    n_users = 0
+    bad = []
+    async with AsyncSessionLocal() as db:
+        async for user_ids in _user_id_batches(db, batch_size):
+            events = await _load_events(user_ids, db)
+            result = await db.execute(
+                select(UserSequenceState).where(UserSequenceState.user_id.in_(user_ids))
+            )
+            stored = {s.user_id: s for s in result.scalars().all()}
+
+            for user_id in user_ids:
+                user_events = events.get(user_id, [])
+                recent, taste, last_watched_at = build_state(user_events)
+                if _same_state(stored.get(user_id), recent, taste):
+                    continue
+                bad.append(user_id)
+                if fix:
+                    await _write_state(db, user_id, recent, taste, last_watched_at, len(user_events))
+
+            if fix:
+                await db.commit()
+            n_users += len(user_ids)
+
+    print(f"Checked {n_users} users, {len(bad)} inconsistent")
+    if bad:
+        print(f"First inconsistent users: {bad[:20]}")
+        if fix:
+            print("Repaired.")
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain user_sequence_state")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_backfill = sub.add_parser("backfill", help="rebuild state for every user")
+    p_backfill.add_argument("--batch-size", type=int, default=500)
+
+    p_check = sub.add_parser("check", help="verify state against user_movie_event")
+    p_check.add_argument("--batch-size", type=int, default=500)
+    p_check.add_argument("--fix", action="store_true", help="rewrite inconsistent rows")
+
+    args = parser.parse_args()
+    if args.command == "backfill":
+        asyncio.run(backfill(args.batch_size))
+    else:
+        bad = asyncio.run(check(args.batch_size, args.fix))
+        if bad and not args.fix:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
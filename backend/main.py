@@ -1,8 +1,25 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from api import auth, movies, interactions, recommend, similar, metadata, batch
+from fastapi.responses import JSONResponse
+from api import auth, movies, interactions, recommend, similar, metadata, batch, health
+from db.database import engine
+from db.instrumentation import (
+    SQL_DEBUG, start_request_stats, finish_request_stats, pool_status, db_metrics_snapshot,
+)
+from ml import serving
+
+
+# Model, catalog and neighbour table load on a background thread, so the
+# app serves routes that don't need them right away (see /health/ready)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    serving.start_background_load()
+    yield
 
-app = FastAPI(title="Movie Recommender API")
+
+app = FastAPI(title="Movie Recommender API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -12,6 +29,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# Per-request SQL stats: query count, DB time, slowest statement, pool wait.
+# Requests that raise are recorded too (as 500s): they are often the slow ones
+@app.middleware("http")
+async def sql_instrumentation(request: Request, call_next):
+    stats = start_request_stats()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        route = request.scope.get("route")
+        finish_request_stats(stats, route.path if route else request.url.path, status_code)
+
+    if SQL_DEBUG:
+        response.headers.update(stats.headers(pool_status(engine)))
+    return response
+
+
+# Model-backed routes called before loading finished
+@app.exception_handler(serving.NotReady)
+async def not_ready(request: Request, exc: serving.NotReady):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Model not ready: {exc}"},
+        headers={"Retry-After": "5"},
+    )
+
+
+app.include_router(health.router)
 app.include_router(auth.router)
 app.include_router(movies.router)
 app.include_router(interactions.router)
@@ -22,4 +69,9 @@ app.include_router(batch.router)
 
 @app.get("/")
 async def root():
-    return {"message": "Welcome to the Movie Recommendation API"}
\ No newline at end of file
+    return {"message": "Welcome to the Movie Recommendation API"}
+
+
+@app.get("/metrics/db")
+async def db_metrics():
+    return db_metrics_snapshot(engine)
@@ -0,0 +1,100 @@
+"""
+Memory per uvicorn-style worker with and without MODEL_MMAP. Starts N
+fresh processes per mode; each loads the checkpoint on CPU, serves a few
+recommendations and reports its RSS and PSS (resident pages, with shared
+pages split across the processes mapping them), read from
+/proc/self/smaps_rollup while all workers are still alive.
+
+    cd backend
+    python -m ml.bench_memory --workers 4
+    python -m ml.bench_memory --checkpoint ../model_checkpoints/transformer_epoch3.pt
+"""
+
+import argparse
+import multiprocessing as mp
+from pathlib import Path
+from typing import Dict
+
+from ml.inference import CHECKPOINT_PATH, resolve_checkpoint
+
+
+# -----------------------------
+# Config
+# -----------------------------
+NUM_WORKERS = 4
+WARMUP_REQUESTS = 20
+
+
+# -----------------------------
+# Worker
+# -----------------------------
+def memory_mb() -> Dict[str, float]:
+    """RSS and PSS (total, anonymous, file-backed) of this process in MiB (Linux)."""
+    out = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss", "Pss_Anon", "Pss_File"):
+                out[key.lower()] = int(rest.split()[0]) / 1024
+    return out
+
+
+def worker(checkpoint_path, mmap: bool, loaded, done, results):
+    import torch
+    from ml.inference import load_model, recommend
+
+    torch.set_num_threads(1)
+    model, vocab, device = load_model(torch.device("cpu"), checkpoint_path=checkpoint_path, mmap=mmap)
+    history = vocab.to_ids(list(range(1, min(vocab.num_items, 40)))).tolist()
+    for i in range(WARMUP_REQUESTS):
+        recommend(model, vocab, device, history[i:], top_k=20)
+
+    # measure once every worker is up, so PSS splits the shared pages N ways
+    loaded.wait()
+    results.put(memory_mb())
+    done.wait()
+
+
+def measure(checkpoint_path: Path, mmap: bool, num_workers: int):
+    ctx = mp.get_context("spawn")   # fresh interpreters, like separate uvicorn workers
+    loaded, done = ctx.Barrier(num_workers + 1), ctx.Event()
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=worker, args=(checkpoint_path, mmap, loaded, done, results))
+        for _ in range(num_workers)
+    ]
+    for p in procs:
+        p.start()
+    loaded.wait()
+    per_worker = [results.get() for _ in procs]
+    done.set()
+    for p in procs:
+        p.join()
+    return per_worker
+
+
+# -----------------------------
+# Main
+# -----------------------------
+def main():
+    parser = argparse.ArgumentParser(description="RSS/PSS per worker with and without MODEL_MMAP")
+    parser.add_argument("--checkpoint", type=Path, default=CHECKPOINT_PATH)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    args = parser.parse_args()
+    args.checkpoint = resolve_checkpoint(args.checkpoint)
+
+    size_mb = args.checkpoint.stat().st_size / 2**20
+    print(f"Checkpoint: {args.checkpoint} ({size_mb:.1f} MiB), {args.workers} workers\n")
+    # per-worker means in MiB; anon = private heap (a full weight copy in
+    # "copy" mode), file = the worker's share of mapped files (libs, checkpoint)
+    columns = ("rss", "pss", "pss_anon", "pss_file")
+    print(f"{'mode':<8}" + "".join(f"{c:>11}" for c in columns) + f"{'pss total':>11}")
+    for mmap in (False, True):
+        per_worker = measure(args.checkpoint, mmap, args.workers)
+        means = [sum(r[c] for r in per_worker) / len(per_worker) for c in columns]
+        total = sum(r["pss"] for r in per_worker)
+        print(f"{'mmap' if mmap else 'copy':<8}" + "".join(f"{m:>11.1f}" for m in means) + f"{total:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Training throughput benchmark on a fixed synthetic dataset.
+
+Compares the default fp32 eager loop with the opt-in fast mode of
+ml/train.py (bf16 autocast, fused/foreach Adam, optional torch.compile,
+gradient accumulation). Reports steps/s and samples/s per configuration.
+
+    cd backend
+    python -m ml.bench_train                      # baseline vs fast
+    python -m ml.bench_train --compile --accum-steps 4
+"""
+
+import argparse
+import time
+
+import torch
+
+from ml.model import TransformerRecModel
+from ml.train import (
+    BATCH_SIZE,
+    MAX_SEQ_LEN,
+    NUM_NEGATIVES,
+    make_collate_fn,
+    make_optimizer,
+    train_step,
+)
+
+
+# -----------------------------
+# Synthetic data
+# -----------------------------
+def synthetic_batches(num_batches: int, batch_size: int, num_items: int, taste_len: int, seed: int = 0):
+    """Pre-collated batches, so the timing covers the training step only."""
+    g = torch.Generator().manual_seed(seed)
+    collate_fn = make_collate_fn(pad_idx=0, num_items=num_items, num_negatives=NUM_NEGATIVES)
+
+    torch.manual_seed(seed)   # collate draws the uniform negatives from the global RNG
+    batches = []
+    for _ in range(num_batches):
+        samples = [
+            {
+                "sequence": torch.randint(1, num_items, (MAX_SEQ_LEN,), generator=g),
+                "attention_mask": torch.ones(MAX_SEQ_LEN, dtype=torch.long),
+                "taste": torch.randint(1, num_items, (taste_len,), generator=g),
+                "target": torch.randint(1, num_items, (), generator=g),
+            }
+            for _ in range(batch_size)
+        ]
+        batches.append(collate_fn(samples))
+    return batches
+
+
+# -----------------------------
+# Benchmark
+# -----------------------------
+def run_config(name, batches, num_items, device, fast, compile_model, accum_steps, warmup, seed=0):
+    torch.manual_seed(seed)
+    model = TransformerRecModel(num_items=num_items, max_seq_len=MAX_SEQ_LEN, pad_idx=0).to(device)
+    model.train()
+    optimizer = make_optimizer(model, device, fast)
+    step_model = torch.compile(model, dynamic=True) if compile_model else model
+
+    def one_pass(batch_list):
+        for i, batch in enumerate(batch_list, start=1):
+            train_step(step_model, batch, device, amp=fast, loss_scale=1.0 / accum_steps)
+            if i % accum_steps == 0:
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+
+    # warmup (compilation, allocator, thread pools)
+    one_pass(batches[:warmup])
+    optimizer.zero_grad(set_to_none=True)
+
+    timed = batches[warmup:]
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    one_pass(timed)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+
+    steps = len(timed)
+    samples = sum(b["target"].size(0) for b in timed)
+    return {
+        "name": name,
+        "steps_per_s": steps / elapsed,
+        "samples_per_s": samples / elapsed,
+        "optimizer_steps": steps // accum_steps,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the training step")
+    parser.add_argument("--num-items", type=int, default=27_279)   # MovieLens 25M catalogue + padding
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--taste-len", type=int, default=100)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--accum-steps", type=int, default=1)
+    parser.add_argument("--compile", action="store_true", help="also benchmark fast + torch.compile")
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    print(f"Device: {device}, threads: {torch.get_num_threads()}")
+    print(f"Synthetic data: {args.steps} steps x batch {args.batch_size}, {args.num_items} items, taste {args.taste_len}")
+    batches = synthetic_batches(args.warmup + args.steps, args.batch_size, args.num_items, args.taste_len)
+
+    configs = [("baseline (fp32, eager)", False, False, 1)]
+    configs.append((f"fast (bf16, fused, accum {args.accum_steps})", True, False, args.accum_steps))
+    if args.compile:
+        configs.append((f"fast + compile (accum {args.accum_steps})", True, True, args.accum_steps))
+
+    results = []
+    for name, fast, compile_model, accum_steps in configs:
+        r = run_config(name, batches, args.num_items, device, fast, compile_model, accum_steps, args.warmup)
+        results.append(r)
+        print(f"  {name:<36} {r['steps_per_s']:7.2f} steps/s  {r['samples_per_s']:9.1f} samples/s")
+
+    base = results[0]["samples_per_s"]
+    print("\nSpeedup vs baseline:")
+    for r in results[1:]:
+        print(f"  {r['name']:<36} {r['samples_per_s'] / base:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# backend/ml/checkpoint.py
+
+import os
+import random
+import re
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+import torch
+
+
+# -----------------------------
+# Config
+# -----------------------------
+STEP_CKPT_FORMAT = "train-state-v1"
+STEP_CKPT_PATTERN = re.compile(r"^step_(\d+)\.pt$")
+
+
+# -----------------------------
+# RNG state
+# -----------------------------
+def capture_rng_state() -> dict:
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+
+
+def restore_rng_state(state: dict):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if state.get("cuda") is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+# -----------------------------
+# Snapshot helpers
+# -----------------------------
+def _cpu_snapshot(obj: Any) -> Any:
+    """Deep-copy every tensor to CPU so training can keep mutating the originals."""
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _cpu_snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_cpu_snapshot(v) for v in obj)
+    return obj
+
+
+def step_checkpoints(ckpt_dir: Path):
+    """[(global_step, path)] of complete step checkpoints, oldest first."""
+    if not ckpt_dir.exists():
+        return []
+    found = []
+    for path in ckpt_dir.iterdir():
+        m = STEP_CKPT_PATTERN.match(path.name)
+        if m:
+            found.append((int(m.group(1)), path))
+    return sorted(found)
+
+
+def latest_step_checkpoint(ckpt_dir: Path) -> Optional[Path]:
+    found = step_checkpoints(ckpt_dir)
+    return found[-1][1] if found else None
+
+
+def load_step_checkpoint(path: Path) -> dict:
+    state = torch.load(path, map_location="cpu", weights_only=False)
+    if state.get("format") != STEP_CKPT_FORMAT:
+        raise ValueError(f"{path} is not a {STEP_CKPT_FORMAT} checkpoint")
+    return state
+
+
+# -----------------------------
+# Async writer
+# -----------------------------
+class AsyncCheckpointer:
+    """
+    Writes step checkpoints from a background thread.
+
+    save() takes a CPU copy of the state on the calling thread (the only
+    part that blocks training), then torch.save runs in the background.
+    Files are written as .tmp and renamed into place, so a crash mid-write
+    never leaves a truncated step_N.pt; only the newest `keep_last` are kept.
+    At most one write is in flight: a save() waits for the previous one.
+    """
+
+    def __init__(self, ckpt_dir: Path, keep_last: int = 3):
+        self.ckpt_dir = Path(ckpt_dir)
+        self.ckpt_dir.mkdir(parents=True, exist_ok=True)
+        self.keep_last = keep_last
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    def save(self, state: dict, global_step: int):
+        self.wait()
+        snapshot = _cpu_snapshot(state)
+        snapshot["format"] = STEP_CKPT_FORMAT
+        path = self.ckpt_dir / f"step_{global_step}.pt"
+        self._thread = threading.Thread(target=self._write, args=(snapshot, path), daemon=True)
+        self._thread.start()
+
+    def _write(self, snapshot: dict, path: Path):
+        tmp = path.with_suffix(".pt.tmp")
+        try:
+            torch.save(snapshot, tmp)
+            os.replace(tmp, path)
+            self._rotate()
+        except BaseException as e:   # surfaced on the training thread by wait()
+            self._error = e
+
+    def _rotate(self):
+        for _, old in step_checkpoints(self.ckpt_dir)[:-self.keep_last]:
+            old.unlink(missing_ok=True)
+
+    def wait(self):
+        """Block until the in-flight write is done; re-raise its error, if any."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("async checkpoint write failed") from error
@@ -2,18 +2,34 @@
 
 import json
 from pathlib import Path
+import numpy as np
 from torch.utils.data import Dataset
+from torch.utils.data.distributed import DistributedSampler
 import torch
 
+from ml.vocab import Vocab
+
+
+def sample_taste_positions(taste_len: int, max_taste_len: int = None) -> np.ndarray:
+    """
+    Positions of the taste items to use: all of them, or a uniform random
+    subset of max_taste_len (in order). The subset mean is an unbiased
+    estimate of the full taste mean, and a fresh subset is drawn every
+    time, so over epochs training sees the whole history.
+    """
+    if max_taste_len is None or taste_len <= max_taste_len:
+        return np.arange(taste_len)
+    return np.sort(np.random.choice(taste_len, max_taste_len, replace=False))
+
 
 class MovieLensDataset(Dataset):
-    def __init__(self, jsonl_path: str, vocab_path: str, max_seq_len: int = 50):
+    def __init__(self, jsonl_path: str, vocab_path: str, max_seq_len: int = 50, max_taste_len: int = None):
         self.max_seq_len = max_seq_len
+        self.max_taste_len = max_taste_len
 
         # Load vocab
-        vocab = json.loads(Path(vocab_path).read_text())
-        self.movie_to_idx = vocab["movie_id_to_index"]
-        self.pad_idx = vocab["pad_index"]
+        self.vocab = Vocab.from_dict(json.loads(Path(vocab_path).read_text()))
+        self.pad_idx = self.vocab.pad_index
 
         # Load JSONL lines (lazy enough for 20M)
         with open(jsonl_path, "r") as f:
@@ -32,15 +48,16 @@ class MovieLensDataset(Dataset):
 
     def _to_idx(self, movie_ids):
         """Map movie IDs → vocab indices (ignore IDs not found)."""
-        return [self.movie_to_idx[str(mid)] for mid in movie_ids if str(mid) in self.movie_to_idx]
+        return self.vocab.to_indices(movie_ids).tolist()
 
     def __getitem__(self, idx):
         sample = self.samples[idx]
 
         # Convert IDs → indices
         seq = self._to_idx(sample["sequence"])
-        target = self.movie_to_idx[str(sample["target"])]
+        target = self.vocab.index_of(sample["target"])
         taste = self._to_idx(sample["taste"])
+        taste = [taste[i] for i in sample_taste_positions(len(taste), self.max_taste_len)]
 
         # Left-pad sequence
         seq_padded = self._pad_left(seq)
@@ -54,3 +71,107 @@ class MovieLensDataset(Dataset):
             "taste": torch.tensor(taste, dtype=torch.long),  # variable length
             "target": torch.tensor(target, dtype=torch.long)
         }
+
+    def target_counts(self, num_items: int) -> torch.Tensor:
+        """How often each vocab index is a training target: LongTensor [num_items]."""
+        targets = torch.from_numpy(self.vocab.to_indices([s["target"] for s in self.samples]))
+        return torch.bincount(targets, minlength=num_items)
+
+
+class MovieLensPackedDataset(Dataset):
+    """
+    Reads the format written by ml/preprocess.py: every user's sequence
+    stored once as vocab indices, plus a (user, end_position) sample index.
+    Sliding windows are cut on the fly, so the data on disk is O(events)
+    instead of O(L^2) per user with the taste list repeated per sample.
+
+    The arrays are memory-mapped lazily in each process, so DataLoader
+    workers map the same pages instead of receiving pickled copies.
+    """
+
+    ARRAYS = ("items", "user_offsets", "taste_len", "sample_user", "sample_end")
+
+    def __init__(self, packed_dir: str, max_seq_len: int = 50, max_taste_len: int = None):
+        self.packed_dir = Path(packed_dir)
+        self.max_seq_len = max_seq_len
+        self.max_taste_len = max_taste_len
+
+        meta = json.loads((self.packed_dir / "meta.json").read_text())
+        self.pad_idx = meta["pad_index"]
+        self.num_samples = meta["num_samples"]
+        self._arrays = None
+
+    def _open(self):
+        if self._arrays is None:
+            self._arrays = {
+                name: np.load(self.packed_dir / f"{name}.npy", mmap_mode="r")
+                for name in self.ARRAYS
+            }
+        return self._arrays
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_arrays"] = None   # re-open the memmaps in the worker
+        return state
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, idx):
+        a = self._open()
+
+        u = a["sample_user"][idx]
+        base = a["user_offsets"][u]
+        taste_len = a["taste_len"][u]
+        end = a["sample_end"][idx]
+
+        # prefix of the recent window before the target, at most max_seq_len long
+        start = max(taste_len, end - self.max_seq_len)
+        seq = a["items"][base + start: base + end]
+
+        # Left-pad sequence
+        seq_padded = np.full(self.max_seq_len, self.pad_idx, dtype=np.int64)
+        if len(seq):
+            seq_padded[-len(seq):] = seq
+
+        # only the sampled taste positions are read from the memmap
+        taste = np.asarray(a["items"][base + sample_taste_positions(taste_len, self.max_taste_len)], dtype=np.int64)
+
+        sequence = torch.from_numpy(seq_padded)
+        return {
+            "sequence": sequence,
+            "attention_mask": (sequence != self.pad_idx).long(),
+            "taste": torch.from_numpy(taste),  # variable length
+            "target": torch.tensor(int(a["items"][base + end]), dtype=torch.long)
+        }
+
+    def target_counts(self, num_items: int) -> torch.Tensor:
+        """How often each vocab index is a training target: LongTensor [num_items]."""
+        a = self._open()
+        targets = a["items"][a["user_offsets"][a["sample_user"]] + a["sample_end"]]
+        counts = np.bincount(targets, minlength=num_items)
+        return torch.from_numpy(counts.astype(np.int64))
+
+
+class ResumableSampler(DistributedSampler):
+    """
+    DistributedSampler that can start an epoch part-way through, so a run
+    resumed from a step checkpoint sees exactly the samples it had not seen.
+    Also used single-process (num_replicas=1): the order depends only on
+    (seed, epoch), not on RNG state.
+    """
+
+    def __init__(self, dataset, num_replicas: int = 1, rank: int = 0, seed: int = 0):
+        super().__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=True, seed=seed)
+        self.start_index = 0
+
+    def set_start_index(self, start_index: int):
+        """Skip the first `start_index` samples of this rank's next epoch."""
+        self.start_index = start_index
+
+    def __iter__(self):
+        indices = list(super().__iter__())
+        return iter(indices[self.start_index:])
+
+    def __len__(self):
+        return max(self.num_samples - self.start_index, 0)
@@ -0,0 +1,167 @@
+"""
+Compare a distilled student (`python -m ml.train --distill-from ...`) with
+its teacher for serving: model size, single-request latency, batch
+throughput and how often the student returns the teacher's top-K. With
+--eval, both are also scored on the held-out split (ml/evaluate.py).
+
+    cd backend
+    python -m ml.distill_report \
+        --teacher ../model_checkpoints/transformer_epoch3.pt \
+        --student ../model_checkpoints/student_epoch3.pt
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import torch
+
+from ml.inference import load_model, recommend, recommend_batch
+from ml.train import PACKED_DIR
+
+
+# -----------------------------
+# Config
+# -----------------------------
+NUM_USERS = 500          # histories sampled from the packed training data
+LATENCY_REQUESTS = 200   # single-user requests timed per model
+TOP_K = 20
+
+
+# -----------------------------
+# Measurements
+# -----------------------------
+def sample_histories(packed_dir: Path, vocab, n: int, seed: int = 0) -> List[List[int]]:
+    """Movie-id histories of n random users from the packed arrays."""
+    items = np.load(packed_dir / "items.npy", mmap_mode="r")
+    user_offsets = np.load(packed_dir / "user_offsets.npy")
+    rng = np.random.default_rng(seed)
+    users = rng.choice(len(user_offsets) - 1, min(n, len(user_offsets) - 1), replace=False)
+    return [vocab.to_ids(items[user_offsets[u]: user_offsets[u + 1]]).tolist() for u in users]
+
+
+def model_size(model, checkpoint_path: Path) -> Dict[str, float]:
+    n_params = sum(p.numel() for p in model.parameters())
+    n_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+    return {
+        "params": n_params,
+        "param_mb": n_bytes / 2**20,
+        "checkpoint_mb": Path(checkpoint_path).stat().st_size / 2**20,
+    }
+
+
+def latency(model, vocab, device, histories, top_k: int, requests: int) -> Dict[str, float]:
+    """Single-request latency (recommend) and batch throughput (recommend_batch)."""
+    recommend(model, vocab, device, histories[0], top_k)   # warm-up
+    times = []
+    for h in histories[:requests]:
+        t0 = time.perf_counter()
+        recommend(model, vocab, device, h, top_k)
+        times.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    recommend_batch(model, vocab, device, histories, top_k)
+    batch_seconds = time.perf_counter() - t0
+
+    times = np.array(times) * 1000
+    return {
+        "p50_ms": float(np.percentile(times, 50)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "batch_users_per_s": len(histories) / batch_seconds,
+    }
+
+
+def agreement(teacher_recs, student_recs, ks) -> Dict[str, float]:
+    """Mean |teacher top-k ∩ student top-k| / k, and how often the #1 item matches."""
+    out = {}
+    for k in ks:
+        overlap = [
+            len({r["movie_id"] for r in t[:k]} & {r["movie_id"] for r in s[:k]}) / k
+            for t, s in zip(teacher_recs, student_recs)
+        ]
+        out[f"overlap@{k}"] = float(np.mean(overlap))
+    out["top1_match"] = float(np.mean([t[0]["movie_id"] == s[0]["movie_id"] for t, s in zip(teacher_recs, student_recs)]))
+    return out
+
+
+def report(
+    teacher_path: Path,
+    student_path: Path,
+    packed_dir: Path = PACKED_DIR,
+    num_users: int = NUM_USERS,
+    top_k: int = TOP_K,
+    device=None,
+    run_eval: bool = False,
+) -> Dict[str, Dict]:
+    device = device or torch.device("cpu")
+    teacher, vocab, _ = load_model(device, checkpoint_path=teacher_path)
+    student, _, _ = load_model(device, checkpoint_path=student_path)
+    histories = sample_histories(packed_dir, vocab, num_users)
+
+    results = {}
+    for name, model, path in (("teacher", teacher, teacher_path), ("student", student, student_path)):
+        results[name] = {
+            **model_size(model, path),
+            **latency(model, vocab, device, histories, top_k, LATENCY_REQUESTS),
+        }
+
+    ks = sorted({10, top_k})
+    results["agreement"] = agreement(
+        recommend_batch(teacher, vocab, device, histories, top_k),
+        recommend_batch(student, vocab, device, histories, top_k),
+        ks,
+    )
+
+    if run_eval:
+        from ml.evaluate import evaluate
+
+        metrics = evaluate([teacher_path, student_path], packed_dir=packed_dir, device=device)
+        results["teacher"].update(metrics[str(teacher_path)])
+        results["student"].update(metrics[str(student_path)])
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare a distilled student with its teacher")
+    parser.add_argument("--teacher", type=Path, required=True)
+    parser.add_argument("--student", type=Path, required=True)
+    parser.add_argument("--packed-dir", type=Path, default=PACKED_DIR)
+    parser.add_argument("--users", type=int, default=NUM_USERS)
+    parser.add_argument("--k", type=int, default=TOP_K)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--eval", action="store_true", help="also run ml.evaluate on the held-out split")
+    parser.add_argument("--json", type=Path, default=None, help="also write the results here")
+    args = parser.parse_args()
+
+    results = report(
+        args.teacher,
+        args.student,
+        packed_dir=args.packed_dir,
+        num_users=args.users,
+        top_k=args.k,
+        device=torch.device(args.device),
+        run_eval=args.eval,
+    )
+
+    teacher, student = results["teacher"], results["student"]
+    print(f"\n{'':<20}{'teacher':>12}{'student':>12}{'ratio':>9}")
+    for key in teacher:
+        if key in ("users", "users_per_s", "mlp_scorer"):
+            continue
+        ratio = student[key] / teacher[key] if teacher[key] else float("nan")
+        print(f"  {key:<18}{teacher[key]:>12.4g}{student[key]:>12.4g}{ratio:>8.2f}x")
+    print("\nRanking agreement (student vs teacher):")
+    for key, value in results["agreement"].items():
+        print(f"  {key:<18}{value:.3f}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"\nSaved results to: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,19 +2,25 @@
 
 import os
 import json
+from typing import List, Optional
+
+import numpy as np
 import redis.asyncio as redis_async
+import torch
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 
-from db.models import UserMovieEvent
+from db.user_state import get_user_state, rebuild_user_state
+from ml.inference import compute_user_embedding as encode_user, get_model, taste_aggregate
 
 
 # ------------------------------
 # Redis Connection
 # ------------------------------
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+TASTE_CACHE_TTL = 30 * 24 * 3600   # seconds; keys of replaced checkpoints age out
 
 redis_client = None
+binary_client = None   # taste aggregates are raw float64 bytes
 
 
 async def get_redis():
@@ -24,46 +30,115 @@ async def get_redis():
     return redis_client
 
 
+async def get_binary_redis():
+    global binary_client
+    if binary_client is None:
+        binary_client = await redis_async.from_url(REDIS_URL, decode_responses=False)
+    return binary_client
+
+
+# ------------------------------
+# Taste Aggregate Cache
+# ------------------------------
+# Per user and checkpoint, a hash with the sum of the taste item embeddings
+# (float64), the number of known items in it, and `n`, the length of the
+# taste list it covers. Taste only grows by appending (advance_state), so
+# `n` identifies which prefix of the stored taste list the sum is over:
+#   n == len(taste)                 -> up to date
+#   n == len(taste) - len(moved)    -> add just the moved items
+#   anything else (lost update, rebuild, new checkpoint) -> one full gather
+def taste_key(version: str, user_id: int) -> str:
+    return f"taste:{version}:{user_id}"
+
+
+async def _read_taste(redis, key: str):
+    data = await redis.hgetall(key)
+    if not data:
+        return None
+    taste_sum = torch.from_numpy(np.frombuffer(data[b"sum"], dtype=np.float64).copy())
+    return taste_sum, int(data[b"count"]), int(data[b"n"])
+
+
+async def _write_taste(redis, key: str, taste_sum: torch.Tensor, count: int, n: int):
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={"sum": taste_sum.numpy().tobytes(), "count": count, "n": n})
+        pipe.expire(key, TASTE_CACHE_TTL)
+        await pipe.execute()
+
+
+async def get_taste_aggregate(user_id: int, taste_ids: List[int], moved: Optional[List[int]] = ()):
+    """
+    (taste_sum [d], taste_count) for the user's stored taste list, from the
+    cache when possible.
+
+    moved: ids just appended to taste by apply_events_to_state, or None when
+           the state was rebuilt (the cached sum can't be trusted then)
+    """
+    model, vocab, device = get_model()
+    redis = await get_binary_redis()
+    key = taste_key(model.version, user_id)
+    n = len(taste_ids)
+
+    cached = await _read_taste(redis, key) if moved is not None else None
+    if cached is not None:
+        taste_sum, count, cached_n = cached
+        if cached_n == n:
+            return taste_sum, count
+        if moved and cached_n == n - len(moved):
+            delta_sum, delta_count = taste_aggregate(model, vocab, device, moved)
+            taste_sum, count = taste_sum + delta_sum, count + delta_count
+            await _write_taste(redis, key, taste_sum, count, n)
+            return taste_sum, count
+
+    taste_sum, count = taste_aggregate(model, vocab, device, taste_ids)
+    await _write_taste(redis, key, taste_sum, count, n)
+    return taste_sum, count
+
+
 # ------------------------------
-# Compute User Embedding (TEMP)
-# Later: call Transformer + taste model
+# Compute User Embedding
 # ------------------------------
-async def compute_user_embedding(user_id: int, db: AsyncSession):
+async def compute_user_embedding(user_id: int, db: AsyncSession, moved: Optional[List[int]] = ()):
     """
-    TEMPORARY PLACEHOLDER:
-    This will be replaced with real:
-    - sequence embedding
-    - taste embedding
-    - Transformer encoding
+    Transformer user embedding from the stored sequence state. The taste
+    part comes from the aggregate cache, so the cost is one MAX_SEQ_LEN
+    encoder pass however long the history is.
     """
-    # Fetch events
-    result = await db.execute(
-        select(UserMovieEvent)
-        .where(UserMovieEvent.user_id == user_id)
-        .order_by(UserMovieEvent.watched_at.asc().nulls_last())
-    )
-    events = result.scalars().all()
-
-    # Debug placeholder embedding
-    # Later: replace with real vectors from your model
-    seq_ids = [e.movie_id for e in events if e.watched_at is not None]
-    taste_ids = [e.movie_id for e in events if e.watched_at is None]
-
-    fake_embedding = {
+    # Model input is one primary-key lookup on the denormalized state
+    state = await get_user_state(user_id, db)
+    if state is not None:
+        seq_ids = list(state.recent_movie_ids)
+        taste_ids = list(state.taste_movie_ids)
+    else:
+        # no row yet (e.g. before the backfill ran): build it from events
+        seq_ids, taste_ids = await rebuild_user_state(user_id, db)
+        await db.commit()
+        moved = None
+
+    model, vocab, device = get_model()
+    taste_sum, taste_count = await get_taste_aggregate(user_id, taste_ids, moved)
+
+    # recent holds at most MAX_SEQ_LEN + 1 ids, so all of it is the sequence
+    vector = encode_user(model, vocab, device, seq_ids, taste_sum=taste_sum, taste_count=taste_count)
+
+    return {
         "sequence_ids": seq_ids,
-        "taste_ids": taste_ids,
-        "vector": [0.0] * 128  # placeholder for real embedding
+        "taste_count": taste_count,
+        "model_version": model.version,
+        "vector": vector.cpu().tolist(),
     }
 
-    return fake_embedding
-
 
 # ------------------------------
 # Update Redis Cache
 # ------------------------------
-async def update_user_embedding_cache(user_id: int, db: AsyncSession):
+async def update_user_embedding_cache(user_id: int, db: AsyncSession, moved: Optional[List[int]] = None):
+    """
+    moved: what apply_events_to_state returned for the events just written
+           (ids that entered taste; None after a rebuild, the default)
+    """
     redis = await get_redis()
-    embedding = await compute_user_embedding(user_id, db)
+    embedding = await compute_user_embedding(user_id, db, moved)
     await redis.set(f"user_emb:{user_id}", json.dumps(embedding))
 
 
@@ -73,7 +148,7 @@ async def update_user_embedding_cache(user_id: int, db: AsyncSession):
 async def get_user_embedding(user_id: int):
     redis = await get_redis()
     data = await redis.get(f"user_emb:{user_id}")
-    
+
     if data:
         return json.loads(data)
     return None
@@ -0,0 +1,256 @@
+"""
+Offline evaluation on the held-out split written by `ml.preprocess --holdout`.
+
+For every user, the model sees the stored (training) sequence and ranks the
+full catalogue; the user's held-out newest item is the target. Users are
+encoded in batches, scored with one [B, D] x [D, N] GEMM and ranked with
+topk. Reports Hit@K, NDCG@K, MRR and users/s. Several checkpoints share
+one pass over the data.
+
+MLP-scorer checkpoints are ranked the way /recommend serves them
+(retrieve RETRIEVAL_K by dot product, rerank with the MLP), so their MRR
+only counts targets inside the retrieved set.
+
+    cd backend
+    python -m ml.evaluate                                   # inference checkpoint
+    python -m ml.evaluate --checkpoints ../model_checkpoints/transformer_epoch*.pt
+"""
+
+import argparse
+import json
+import math
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from ml.inference import CHECKPOINT_PATH, RETRIEVAL_K, load_model, select_top_k
+from ml.train import PACKED_DIR
+
+
+# -----------------------------
+# Config
+# -----------------------------
+EVAL_BATCH_SIZE = 1024
+DEFAULT_KS = (10, 20)
+
+
+# -----------------------------
+# Held-out data
+# -----------------------------
+class HoldoutSet:
+    """Per-user training history (vocab indices) + held-out next item."""
+
+    def __init__(self, packed_dir: Path):
+        meta = json.loads((packed_dir / "meta.json").read_text())
+        if not meta.get("holdout"):
+            raise ValueError(f"{packed_dir} has no held-out targets; run `python -m ml.preprocess --holdout`")
+
+        self.max_seq_len = meta["max_seq_len"]
+        self.pad_idx = meta["pad_index"]
+        self.items = np.load(packed_dir / "items.npy", mmap_mode="r")
+        self.user_offsets = np.load(packed_dir / "user_offsets.npy")
+        self.targets = np.load(packed_dir / "holdout_targets.npy")
+        self.num_users = len(self.targets)
+
+    def batch(self, users: np.ndarray):
+        """
+        Model inputs for predicting each user's held-out item, cut exactly
+        like a training sample whose target follows the stored sequence:
+        the last max_seq_len items are the sequence, everything older is taste.
+        Taste is returned flat with per-user offsets (for embedding_bag),
+        so one long history doesn't pad the whole batch. Also returns the
+        full history (padded) to exclude from the ranking.
+        """
+        L = self.max_seq_len
+        histories = [np.asarray(self.items[self.user_offsets[u]: self.user_offsets[u + 1]]) for u in users]
+
+        B = len(users)
+        max_hist = max(len(h) for h in histories)
+        sequence = np.full((B, L), self.pad_idx, dtype=np.int64)
+        history = np.full((B, max_hist), self.pad_idx, dtype=np.int64)
+        tastes = []
+
+        for i, h in enumerate(histories):
+            recent = h[-L:]
+            sequence[i, L - len(recent):] = recent
+            tastes.append(h[:-L] if len(h) > L else h[:0])
+            history[i, :len(h)] = h
+
+        taste_count = np.array([len(t) for t in tastes], dtype=np.int64)
+        sequence = torch.from_numpy(sequence)
+        return {
+            "sequence": sequence,
+            "attention_mask": (sequence != self.pad_idx).long(),
+            "taste_flat": torch.from_numpy(np.concatenate(tastes).astype(np.int64)),
+            "taste_offsets": torch.from_numpy(np.r_[0, np.cumsum(taste_count)[:-1]]),
+            "taste_count": torch.from_numpy(taste_count),
+            "history": torch.from_numpy(history),
+            "target": torch.from_numpy(self.targets[users].astype(np.int64)),
+        }
+
+
+# -----------------------------
+# Metrics
+# -----------------------------
+class RankingMetrics:
+    def __init__(self, ks):
+        self.ks = sorted(ks)
+        self.users = 0
+        self.hits = {k: 0.0 for k in self.ks}
+        self.ndcg = {k: 0.0 for k in self.ks}
+        self.rr = 0.0
+        self.seconds = 0.0
+
+    def update(self, topk_idx: torch.Tensor, target_rank: torch.Tensor, target: torch.Tensor):
+        """topk_idx: [B, max K]; target_rank: [B] 0-based rank of the target in the full catalogue."""
+        self.users += target.size(0)
+
+        # position of the target inside the served top-K list (-1 if absent)
+        match = topk_idx == target.unsqueeze(1)
+        pos = torch.where(match.any(dim=1), match.float().argmax(dim=1), torch.full_like(target, -1))
+        for k in self.ks:
+            in_k = (pos >= 0) & (pos < k)
+            self.hits[k] += in_k.sum().item()
+            self.ndcg[k] += (in_k.float() / torch.log2(pos.clamp(min=0).float() + 2)).sum().item()
+
+        self.rr += (1.0 / (target_rank.float() + 1)).sum().item()
+
+    def as_dict(self) -> Dict[str, float]:
+        n = max(self.users, 1)
+        out = {}
+        for k in self.ks:
+            out[f"hit@{k}"] = self.hits[k] / n
+            out[f"ndcg@{k}"] = self.ndcg[k] / n
+        out["mrr"] = self.rr / n
+        out["users"] = self.users
+        out["users_per_s"] = self.users / self.seconds if self.seconds else math.nan
+        return out
+
+
+@torch.no_grad()
+def score_batch(model, device, batch, exclude_seen: bool, max_k: int):
+    """Full-catalogue scores for a batch → (topk indices [B, max_k], full rank of the target [B])."""
+    # exact taste sums without a padded [B, T, D] gather
+    taste_sum = F.embedding_bag(
+        batch["taste_flat"].to(device),
+        model.item_embedding.weight,
+        batch["taste_offsets"].to(device),
+        mode="sum",
+    )                                                          # [B, D]
+    user_emb = model.encode_user(
+        batch["sequence"].to(device),
+        batch["attention_mask"].to(device),
+        taste_sum=taste_sum,
+        taste_count=batch["taste_count"].to(device),
+    )                                                          # [B, D]
+    scores = user_emb @ model.item_embedding.weight.T          # [B, N]
+    scores[:, model.pad_idx] = float("-inf")
+
+    target = batch["target"].to(device)
+    if exclude_seen:
+        # already-watched items can't be recommended; pad entries hit pad_idx
+        scores.scatter_(1, batch["history"].to(device), float("-inf"))
+
+    if model.scorer is None:
+        target_score = scores.gather(1, target.unsqueeze(1))   # [B, 1]
+        target_rank = (scores > target_score).sum(dim=1)       # [B]
+        topk_idx = scores.topk(max_k, dim=1).indices           # [B, max_k]
+        return topk_idx.cpu(), target_rank.cpu()
+
+    # MLP scorer: rank exactly as served (select_top_k: dot-product retrieval,
+    # MLP rerank). Items outside the retrieved set are never served, so the
+    # target's rank is its position in the reranked list, or inf (RR 0)
+    item_idx = torch.arange(scores.size(1), device=device)
+    ranked_scores, ranked = select_top_k(model, user_emb, scores, item_idx, max(max_k, RETRIEVAL_K))
+    ranked = ranked.masked_fill(ranked_scores == float("-inf"), -1)   # filtered items never match
+    match = ranked == target.unsqueeze(1)
+    not_found = torch.full(target.shape, math.inf, device=device)
+    target_rank = torch.where(match.any(dim=1), match.float().argmax(dim=1), not_found)
+    return ranked[:, :max_k].cpu(), target_rank.cpu()
+
+
+# -----------------------------
+# Driver
+# -----------------------------
+def evaluate(
+    checkpoints: List[Path],
+    packed_dir: Path = PACKED_DIR,
+    ks=DEFAULT_KS,
+    batch_size: int = EVAL_BATCH_SIZE,
+    max_users: int = None,
+    exclude_seen: bool = True,
+    device=None,
+    seed: int = 0,
+) -> Dict[str, Dict[str, float]]:
+    data = HoldoutSet(packed_dir)
+
+    models = []
+    for path in checkpoints:
+        model, _, device = load_model(device, checkpoint_path=path)
+        if int(data.targets.max()) >= model.num_items:
+            raise ValueError(f"{path} has {model.num_items} items; the held-out data needs more")
+        models.append((str(model.checkpoint_path), model))
+
+    users = np.arange(data.num_users)
+    if max_users is not None and max_users < len(users):
+        users = np.sort(np.random.default_rng(seed).choice(users, max_users, replace=False))
+
+    max_k = max(ks)
+    metrics = {name: RankingMetrics(ks) for name, _ in models}
+
+    # one pass over the users; every checkpoint scores the same batches
+    for start in range(0, len(users), batch_size):
+        batch = data.batch(users[start: start + batch_size])
+        for name, model in models:
+            t0 = time.perf_counter()
+            topk_idx, target_rank = score_batch(model, device, batch, exclude_seen, max_k)
+            metrics[name].seconds += time.perf_counter() - t0
+            metrics[name].update(topk_idx, target_rank, batch["target"])
+
+    scorers = {name: model.scorer is not None for name, model in models}
+    return {name: {**m.as_dict(), "mlp_scorer": scorers[name]} for name, m in metrics.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate checkpoints on the held-out split")
+    parser.add_argument("--checkpoints", nargs="+", type=Path, default=[CHECKPOINT_PATH])
+    parser.add_argument("--packed-dir", type=Path, default=PACKED_DIR)
+    parser.add_argument("--k", nargs="+", type=int, default=list(DEFAULT_KS))
+    parser.add_argument("--batch-size", type=int, default=EVAL_BATCH_SIZE)
+    parser.add_argument("--max-users", type=int, default=None, help="evaluate a random subset of users")
+    parser.add_argument("--include-seen", action="store_true", help="don't exclude watched items from the ranking")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--json", type=Path, default=None, help="also write the results here")
+    args = parser.parse_args()
+
+    results = evaluate(
+        args.checkpoints,
+        packed_dir=args.packed_dir,
+        ks=args.k,
+        batch_size=args.batch_size,
+        max_users=args.max_users,
+        exclude_seen=not args.include_seen,
+        device=torch.device(args.device) if args.device else None,
+    )
+
+    for name, r in results.items():
+        print(f"\n{name}")
+        for key, value in r.items():
+            if key in ("users", "users_per_s", "mlp_scorer"):
+                continue
+            print(f"  {key:<10} {value:.4f}")
+        print(f"  users      {r['users']}  ({r['users_per_s']:.0f} users/s)")
+        if r.get("mlp_scorer"):
+            print(f"  (MLP rerank of the top {RETRIEVAL_K}; MRR counts only targets retrieved)")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"\nSaved results to: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
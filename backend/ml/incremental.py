@@ -0,0 +1,498 @@
+"""
+Incremental refresh: fold new interactions into the packed dataset and
+fine-tune the latest checkpoint on them, instead of re-running
+ml/preprocess.py over the full ratings CSV and training from scratch.
+
+    cd backend
+    python -m ml.incremental --ratings new_ratings.csv [more.csv ...]
+    python -m ml.incremental --from-db              # user_movie_event since the last watermark
+    python -m ml.incremental --from-db --no-train   # update the data only
+
+Existing vocab indices never change: new movies are appended to the vocab
+and the checkpoint's embedding table grows to match. The updated data is
+exactly what preprocess would have produced for the combined history
+(up to the order of the new indices), as long as each user's new events
+are newer than the ones already stored. Each (user, movie) pair is kept
+once, at its earliest event.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from sqlalchemy import select
+from torch.utils.data import Subset
+
+from ml.dataset import MovieLensPackedDataset
+from ml.inference import latest_checkpoint
+from ml.model import TransformerRecModel
+from ml.vocab import Vocab, vocab_path_for
+from ml.preprocess import (
+    MAX_SEQ_LEN,
+    MIN_HISTORY_LEN,
+    PACKED_DIR,
+    RATING_THRESHOLD,
+    VOCAB_PATH,
+    build_sample_index,
+    hold_out_last,
+    load_positive_ratings,
+    save_pending,
+    save_user_sequences,
+)
+from ml.train import (
+    CHECKPOINT_DIR,
+    LOG_EVERY,
+    MAX_TASTE_LEN,
+    NUM_NEGATIVES,
+    get_device,
+    make_collate_fn,
+    make_dataloader,
+    make_optimizer,
+    seed_everything,
+    train_step,
+)
+
+
+# -----------------------------
+# Config
+# -----------------------------
+FINETUNE_LR = 1e-4
+FINETUNE_EPOCHS = 1
+REPLAY_FRACTION = 0.25        # old samples mixed in per new sample, against forgetting
+DB_USER_ID_OFFSET = 1_000_000_000   # app users live next to MovieLens users in the packed data
+STATE_FILE = "incremental_state.json"
+# --from-db re-reads events created this long before the watermark: created_at
+# is set at insert, so a transaction committing late can land behind it.
+# Event ids seen in that window are skipped.
+DB_LOOKBACK = timedelta(minutes=30)
+
+
+# -----------------------------
+# New interactions
+# -----------------------------
+def load_state(packed_dir: Path) -> dict:
+    path = packed_dir / STATE_FILE
+    if path.exists():
+        return json.loads(path.read_text())
+    return {"db_watermark": None, "db_seen_event_ids": [], "ratings_files": []}
+
+
+def save_state(packed_dir: Path, state: dict):
+    """Write the state file under a temporary name and rename, like save_vocab."""
+    path = packed_dir / STATE_FILE
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(state))
+    os.replace(tmp, path)
+
+
+def load_pending(packed_dir: Path):
+    path = packed_dir / "pending.npz"
+    if not path.exists():
+        empty = np.empty(0, dtype=np.int32)
+        return empty, empty, np.empty(0, dtype=np.int64)
+    d = np.load(path)
+    return d["users"], d["movies"], d["timestamps"]
+
+
+async def load_db_events(watermark: Optional[str], seen_event_ids: List[int]):
+    """
+    Positive user_movie_event rows created after `watermark - DB_LOOKBACK`
+    and not in `seen_event_ids` (see positive_db_events).
+    Returns (users, movies, timestamps, new watermark, new seen ids).
+    """
+    from db.database import AsyncSessionLocal
+    from db.models import UserMovieEvent
+
+    query = select(
+        UserMovieEvent.event_id,
+        UserMovieEvent.user_id,
+        UserMovieEvent.movie_id,
+        UserMovieEvent.event_type,
+        UserMovieEvent.rating,
+        UserMovieEvent.watched_at,
+        UserMovieEvent.created_at,
+    ).order_by(UserMovieEvent.created_at)
+    if watermark is not None:
+        query = query.where(UserMovieEvent.created_at > datetime.fromisoformat(watermark) - DB_LOOKBACK)
+
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(query)).all()
+
+    users, movies, timestamps = positive_db_events(rows, seen_event_ids)
+    if not rows:
+        return users, movies, timestamps, watermark, seen_event_ids
+
+    # every row of the next run's overlap window was read here
+    new_watermark = rows[-1].created_at
+    new_seen = [row.event_id for row in rows if row.created_at > new_watermark - DB_LOOKBACK]
+    return users, movies, timestamps, new_watermark.isoformat(), new_seen
+
+
+def positive_db_events(rows, seen_event_ids: List[int]):
+    """
+    (event_id, user_id, movie_id, event_type, rating, watched_at, created_at)
+    rows -> (users, movies, timestamps) of the timed positives: watches at
+    watched_at, and ratings >= RATING_THRESHOLD at created_at.
+
+    Past watches (watched_at NULL) are skipped: they have no place in the
+    sequence and only feed the user's taste (db/user_state.py).
+    """
+    seen = set(seen_event_ids)
+    users, movies, timestamps = [], [], []
+    for event_id, user_id, movie_id, event_type, rating, watched_at, created_at in rows:
+        if event_id in seen:
+            continue
+        if event_type == "rated":
+            if rating is None or rating < RATING_THRESHOLD:
+                continue
+            ts = created_at
+        elif watched_at is None:
+            continue
+        else:
+            ts = watched_at
+        users.append(user_id + DB_USER_ID_OFFSET)
+        movies.append(movie_id)
+        timestamps.append(int(ts.timestamp()))
+    return np.array(users, dtype=np.int32), np.array(movies, dtype=np.int32), np.array(timestamps, dtype=np.int64)
+
+
+# -----------------------------
+# Vocab
+# -----------------------------
+def extend_vocab(vocab: Dict, movie_ids: np.ndarray) -> List[int]:
+    """Append unseen movie ids to `vocab` (in place) with the next free indices."""
+    movie_to_idx = vocab["movie_id_to_index"]
+    idx_to_movie = vocab["index_to_movie_id"]
+    next_idx = max(movie_to_idx.values()) + 1 if movie_to_idx else 1
+
+    added = []
+    for mid in np.unique(movie_ids).tolist():
+        if str(mid) not in movie_to_idx:
+            movie_to_idx[str(mid)] = next_idx
+            idx_to_movie[str(next_idx)] = mid
+            added.append(mid)
+            next_idx += 1
+    return added
+
+
+def map_to_indices(vocab: Dict, movie_ids: np.ndarray) -> np.ndarray:
+    return Vocab.from_dict(vocab).to_indices(movie_ids, drop_unknown=False).astype(np.int32)
+
+
+def save_vocab(vocab: Dict, path: Optional[Path] = None):
+    """Write vocab.json under a temporary name and rename, so it's never half-written."""
+    path = path or VOCAB_PATH
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(vocab))
+    os.replace(tmp, path)
+
+
+# -----------------------------
+# Merge into the packed arrays
+# -----------------------------
+def merge_user_sequences(
+    items: np.ndarray,
+    user_offsets: np.ndarray,
+    user_ids: np.ndarray,
+    new_users: np.ndarray,
+    new_items: np.ndarray,
+    new_timestamps: np.ndarray,
+    holdout_targets: np.ndarray = None,
+):
+    """
+    Append new (user, item) events, in time order, after each user's stored
+    sequence. Vectorized; no loop over users.
+
+    With held-out targets, a user who gets new events has their old
+    target moved into training and their newest event held out instead.
+
+    Returns (items, user_offsets, user_ids, old_len, holdout_targets) where
+    old_len[u] is how many of user u's items were already trained on.
+    """
+    merged_ids = np.union1d(user_ids, new_users).astype(np.int32)
+    old_pos = np.searchsorted(merged_ids, user_ids)
+    old_len = np.zeros(len(merged_ids), dtype=np.int64)
+    old_len[old_pos] = np.diff(user_offsets)
+
+    new_pos = np.searchsorted(merged_ids, new_users)
+    order = np.lexsort((new_timestamps, new_pos))
+    new_pos, new_items = new_pos[order], new_items[order]
+
+    targets = None
+    if holdout_targets is not None:
+        targets = np.zeros(len(merged_ids), dtype=np.int32)
+        has_target = np.zeros(len(merged_ids), dtype=bool)
+        targets[old_pos] = holdout_targets
+        has_target[old_pos] = True
+        gets_new = np.zeros(len(merged_ids), dtype=bool)
+        gets_new[new_pos] = True
+
+        # the old target is older than every new event: it goes first
+        moved = np.flatnonzero(has_target & gets_new)
+        new_pos = np.r_[moved, new_pos]
+        new_items = np.r_[targets[moved], new_items].astype(np.int32)
+        order = np.argsort(new_pos, kind="stable")
+        new_pos, new_items = new_pos[order], new_items[order]
+
+    # old entries first, then new ones; a stable sort by user keeps both in order
+    all_pos = np.r_[np.repeat(old_pos, np.diff(user_offsets)), new_pos]
+    all_items = np.r_[items, new_items].astype(np.int32)
+    order = np.argsort(all_pos, kind="stable")
+    items = all_items[order]
+    lengths = np.bincount(all_pos, minlength=len(merged_ids))
+    user_offsets = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+
+    if targets is not None:
+        # re-split users that got new events: their newest event is the target
+        resplit = np.zeros(len(merged_ids), dtype=bool)
+        resplit[new_pos] = True
+        last = user_offsets[1:][resplit] - 1
+        targets[resplit] = items[last]
+        items = np.delete(items, last)
+        user_offsets = user_offsets - np.r_[0, np.cumsum(resplit)]
+
+    return items, user_offsets, merged_ids, old_len, targets
+
+
+def dedupe_events(users: np.ndarray, movies: np.ndarray, timestamps: np.ndarray):
+    """Keep each (user, movie) pair's earliest event, e.g. a watch and a later rating of it."""
+    order = np.lexsort((timestamps, movies, users))
+    u, m = users[order], movies[order]
+    first = np.r_[True, (u[1:] != u[:-1]) | (m[1:] != m[:-1])]
+    keep = np.sort(order[first])
+    return users[keep], movies[keep], timestamps[keep]
+
+
+def already_stored(
+    user_ids: np.ndarray,
+    user_offsets: np.ndarray,
+    items: np.ndarray,
+    holdout_targets: Optional[np.ndarray],
+    new_users: np.ndarray,
+    new_items: np.ndarray,
+) -> np.ndarray:
+    """Mask of new (user, item) pairs already in that user's stored sequence or target."""
+    stored_users = np.repeat(user_ids, np.diff(user_offsets)).astype(np.int64)
+    stored_items = items.astype(np.int64)
+    if holdout_targets is not None:
+        stored_users = np.r_[stored_users, user_ids]
+        stored_items = np.r_[stored_items, holdout_targets]
+    stored_keys = (stored_users << 32) | stored_items
+    new_keys = (new_users.astype(np.int64) << 32) | new_items.astype(np.int64)
+    return np.isin(new_keys, stored_keys)
+
+
+def new_sample_indices(user_offsets: np.ndarray, old_len: np.ndarray, max_seq_len: int) -> np.ndarray:
+    """Samples whose target is an item the model hasn't trained on."""
+    _, sample_user, sample_end = build_sample_index(user_offsets, max_seq_len)
+    return np.flatnonzero(sample_end >= old_len[sample_user])
+
+
+def update_packed(
+    packed_dir: Path,
+    vocab: Dict,
+    new_users: np.ndarray,
+    new_movies: np.ndarray,
+    new_timestamps: np.ndarray,
+    state: dict,
+):
+    """
+    Merge new interactions into the packed dataset. Writes a complete new
+    copy next to it and swaps directories, so readers never see a mix.
+
+    The extended vocab is saved before the swap. Indices are only ever
+    appended, so the old packed data is still valid against it if the
+    swap never happens (and a rerun assigns the same indices again).
+    Returns (indices of the new samples, number of new movies).
+    """
+    meta = json.loads((packed_dir / "meta.json").read_text())
+    items = np.load(packed_dir / "items.npy")
+    user_offsets = np.load(packed_dir / "user_offsets.npy")
+    user_ids = np.load(packed_dir / "user_ids.npy")
+    holdout_targets = np.load(packed_dir / "holdout_targets.npy") if meta.get("holdout") else None
+
+    # users still below MIN_HISTORY_LEN (and not already stored) wait in pending
+    p_users, p_movies, p_ts = load_pending(packed_dir)
+    users = np.r_[p_users, new_users].astype(np.int32)
+    movies = np.r_[p_movies, new_movies].astype(np.int32)
+    timestamps = np.r_[p_ts, new_timestamps].astype(np.int64)
+
+    # one event per (user, movie), and none the packed data already has
+    users, movies, timestamps = dedupe_events(users, movies, timestamps)
+    dup = already_stored(user_ids, user_offsets, items, holdout_targets, users, map_to_indices(vocab, movies))
+    users, movies, timestamps = users[~dup], movies[~dup], timestamps[~dup]
+
+    uniq, counts = np.unique(users, return_counts=True)
+    stored = np.isin(uniq, user_ids)
+    ready = uniq[stored | (counts >= MIN_HISTORY_LEN)]
+    take = np.isin(users, ready)
+
+    added = extend_vocab(vocab, movies[take])
+    items, user_offsets, user_ids, old_len, holdout_targets = merge_user_sequences(
+        items, user_offsets, user_ids,
+        users[take], map_to_indices(vocab, movies[take]), timestamps[take],
+        holdout_targets,
+    )
+
+    tmp_dir = packed_dir.with_name(packed_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    save_user_sequences(tmp_dir, items, user_offsets, user_ids, meta["max_seq_len"], meta["pad_index"], holdout_targets)
+    save_pending(tmp_dir, users[~take], movies[~take], timestamps[~take])
+    save_state(tmp_dir, state)
+    save_vocab(vocab)
+
+    old_dir = packed_dir.with_name(packed_dir.name + ".old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    packed_dir.rename(old_dir)
+    tmp_dir.rename(packed_dir)
+    shutil.rmtree(old_dir)
+
+    print(
+        f"Merged {int(take.sum())} events ({len(added)} new movies, {int(dup.sum())} duplicates dropped); "
+        f"{int((~take).sum())} events wait in pending; {len(user_ids)} users"
+    )
+    return new_sample_indices(user_offsets, old_len, meta["max_seq_len"]), len(added)
+
+
+# -----------------------------
+# Fine-tuning
+# -----------------------------
+def grow_item_embedding(state_dict: Dict, num_items: int):
+    """Extend item_embedding.weight to num_items rows; new rows ~ N(0, std of the trained rows)."""
+    weight = state_dict["item_embedding.weight"]
+    extra = num_items - weight.size(0)
+    if extra <= 0:
+        return
+    std = weight[1:].std().item()
+    new_rows = torch.randn(extra, weight.size(1), dtype=weight.dtype) * std
+    state_dict["item_embedding.weight"] = torch.cat([weight, new_rows], dim=0)
+
+
+def fine_tune(
+    checkpoint_path: Path,
+    vocab: Dict,
+    new_samples: np.ndarray,
+    epochs: int = FINETUNE_EPOCHS,
+    lr: float = FINETUNE_LR,
+    replay_fraction: float = REPLAY_FRACTION,
+) -> Path:
+    device = get_device()
+    seed_everything(int(time.time()))
+
+    ckpt = torch.load(checkpoint_path, map_location="cpu")
+    config = dict(ckpt["config"])
+    config["num_items"] = max(vocab["movie_id_to_index"].values()) + 1
+    state_dict = ckpt["model_state_dict"]
+    grow_item_embedding(state_dict, config["num_items"])
+
+    model = TransformerRecModel(
+        num_items=config["num_items"],
+        d_model=config["d_model"],
+        n_heads=config["n_heads"],
+        n_layers=config["n_layers"],
+        max_seq_len=config["max_seq_len"],
+        pad_idx=config["pad_idx"],
+        use_mlp_scorer=config.get("use_mlp_scorer", False),
+    )
+    model.load_state_dict(state_dict)
+    model.to(device)
+
+    dataset = MovieLensPackedDataset(str(PACKED_DIR), max_seq_len=config["max_seq_len"], max_taste_len=MAX_TASTE_LEN)
+    old_samples = np.setdiff1d(np.arange(len(dataset)), new_samples)
+    n_replay = min(len(old_samples), int(len(new_samples) * replay_fraction))
+    replay = np.random.choice(old_samples, n_replay, replace=False) if n_replay else old_samples[:0]
+    subset = Subset(dataset, np.r_[new_samples, replay].tolist())
+    print(f"Fine-tuning {checkpoint_path.name} on {len(new_samples)} new + {n_replay} replayed samples")
+
+    collate_fn = make_collate_fn(
+        pad_idx=config["pad_idx"],
+        num_items=config["num_items"],
+        num_negatives=NUM_NEGATIVES,
+    )
+    dataloader = make_dataloader(subset, collate_fn, device)
+    optimizer = make_optimizer(model, device, lr=lr)
+
+    model.train()
+    step = 0
+    for epoch in range(1, epochs + 1):
+        total_loss = 0.0
+        for batch in dataloader:
+            loss = train_step(model, batch, device)
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+            total_loss += loss.item()
+            step += 1
+            if step % LOG_EVERY == 0:
+                print(f"Fine-tune epoch {epoch} | Step {step} | Loss: {loss.item():.4f} | Avg: {total_loss / step:.4f}")
+
+    out_path = CHECKPOINT_DIR / f"transformer_incremental_{datetime.utcnow():%Y%m%d_%H%M%S}.pt"
+    torch.save({"model_state_dict": model.state_dict(), "vocab": vocab, "config": config}, out_path)
+    Vocab.from_dict(vocab).save(vocab_path_for(out_path))
+    print(f"Saved checkpoint: {out_path}")
+    return out_path
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally update the dataset and fine-tune")
+    parser.add_argument("--ratings", nargs="*", type=Path, default=[], help="new ratings CSVs (ratings.csv format)")
+    parser.add_argument("--from-db", action="store_true", help="user_movie_event rows since the last watermark")
+    parser.add_argument("--checkpoint", type=Path, default=None, help="default: newest transformer_*.pt")
+    parser.add_argument("--epochs", type=int, default=FINETUNE_EPOCHS)
+    parser.add_argument("--lr", type=float, default=FINETUNE_LR)
+    parser.add_argument("--replay-fraction", type=float, default=REPLAY_FRACTION)
+    parser.add_argument("--no-train", action="store_true", help="update the data and vocab only")
+    parser.add_argument("--force", action="store_true", help="re-ingest ratings files seen before")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    state = load_state(PACKED_DIR)
+    loaded_state = json.dumps(state)
+    parts: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+
+    for path in args.ratings:
+        key = str(path.resolve())
+        if key in state["ratings_files"] and not args.force:
+            print(f"Skipping {path}: already ingested (--force to re-ingest)")
+            continue
+        parts.append(load_positive_ratings(path, workers=1))
+        state["ratings_files"].append(key)
+
+    if args.from_db:
+        users, movies, timestamps, state["db_watermark"], state["db_seen_event_ids"] = asyncio.run(
+            load_db_events(state["db_watermark"], state.get("db_seen_event_ids", []))
+        )
+        parts.append((users, movies, timestamps))
+
+    if not parts or not sum(len(p[0]) for p in parts):
+        print("No new interactions.")
+        # the watermark or the list of ingested files may still have moved
+        if json.dumps(state) != loaded_state:
+            save_state(PACKED_DIR, state)
+        return
+
+    users, movies, timestamps = (np.concatenate([p[i] for p in parts]) for i in range(3))
+    print(f"New positive interactions: {len(users)}")
+
+    vocab = json.loads(VOCAB_PATH.read_text())
+    new_samples, n_new_movies = update_packed(PACKED_DIR, vocab, users, movies, timestamps, state)
+    print(f"Vocab: {len(vocab['movie_id_to_index'])} movies (+{n_new_movies}); {len(new_samples)} new samples")
+
+    if not args.no_train and len(new_samples):
+        fine_tune(args.checkpoint or latest_checkpoint(), vocab, new_samples, args.epochs, args.lr, args.replay_fraction)
+
+    print(f"Done in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 # backend/ml/inference.py
 
+import hashlib
 import json
+import os
 import torch
 import torch.nn.functional as F
 from pathlib import Path
@@ -8,14 +10,27 @@ import numpy as np
 import redis
 
 from ml.model import TransformerRecModel
+from ml.vocab import Vocab, vocab_path_for
 
 
 # ---------------------------------------------------------
 # CONFIG
 # ---------------------------------------------------------
-CHECKPOINT_PATH = Path(__file__).parent.parent.parent / "model_checkpoints" / "transformer_epoch1.pt"
+CHECKPOINT_DIR = Path(__file__).parent.parent.parent / "model_checkpoints"
+# MODEL_CHECKPOINT: the checkpoint to serve, as a path or "latest" (the newest
+# transformer_*.pt in CHECKPOINT_DIR, e.g. the last ml.incremental run).
+# Resolved when the model loads, so a restart picks up a new file.
+CHECKPOINT_PATH = Path(os.getenv("MODEL_CHECKPOINT", CHECKPOINT_DIR / "transformer_epoch1.pt"))
 VOCAB_PATH = Path(__file__).parent.parent.parent / "data" / "vocab.json"
 MAX_SEQ_LEN = 50
+LENGTH_BUCKETS = (4, 8, 16, 32, MAX_SEQ_LEN)   # recommend_batch pads each user only up to its bucket
+INFERENCE_BATCH_SIZE = 256
+RETRIEVAL_K = 300      # MLP-scorer checkpoints: dot-product candidates reranked per user
+# MODEL_MMAP=1: on CPU, parameters are read-only views of the memory-mapped
+# checkpoint file, so every uvicorn worker maps the same page-cache pages
+# instead of holding its own copy. Serve a checkpoint that is never rewritten
+# in place (copy it, or let training write a new epoch file).
+MODEL_MMAP = os.getenv("MODEL_MMAP", "0") == "1"
 REDIS_ENABLED = True   # Enabled for production speedup
 REDIS_HOST = "localhost"
 REDIS_PORT = 6379
@@ -32,7 +47,7 @@ if REDIS_ENABLED:
 # ---------------------------------------------------------
 # LOAD MODEL + VOCAB + CONFIG
 # ---------------------------------------------------------
-def load_model(device=None):
+def load_model(device=None, checkpoint_path=None, mmap=None):
     if device is None:
         if torch.backends.mps.is_available():
             device = torch.device("mps")
@@ -43,10 +58,12 @@ def load_model(device=None):
 
     print(f"Loading model on: {device}")
 
-    # load checkpoint
-    ckpt = torch.load(CHECKPOINT_PATH, map_location=device)
+    # load checkpoint (memory-mapped: tensors are attached, not read into memory)
+    checkpoint_path = resolve_checkpoint(checkpoint_path)
+    mmap = (MODEL_MMAP if mmap is None else mmap) and device.type == "cpu"
+    ckpt = torch.load(checkpoint_path, map_location=device, mmap=mmap)
 
-    vocab = ckpt["vocab"]
+    vocab = load_vocab(checkpoint_path, ckpt)
     config = ckpt["config"]
 
     num_items = config["num_items"]
@@ -56,52 +73,169 @@ def load_model(device=None):
     max_seq_len = config["max_seq_len"]
     pad_idx = config["pad_idx"]
 
-    model = TransformerRecModel(
-        num_items=num_items,
-        d_model=d_model,
-        n_heads=n_heads,
-        n_layers=n_layers,
-        max_seq_len=max_seq_len,
-        pad_idx=pad_idx,
-    ).to(device)
+    # with mmap, build on the meta device (no allocation, no init) and
+    # adopt the mapped tensors as the parameters themselves
+    with torch.device("meta" if mmap else device):
+        model = TransformerRecModel(
+            num_items=num_items,
+            d_model=d_model,
+            n_heads=n_heads,
+            n_layers=n_layers,
+            max_seq_len=max_seq_len,
+            pad_idx=pad_idx,
+            use_mlp_scorer=config.get("use_mlp_scorer", False),
+        )
 
-    model.load_state_dict(ckpt["model_state_dict"])
+    model.load_state_dict(ckpt["model_state_dict"], assign=mmap)
+    model.requires_grad_(False)   # inference only; also keeps mapped pages unwritten
     model.eval()
+    model.version = checkpoint_version(checkpoint_path)
+    model.checkpoint_path = Path(checkpoint_path)
 
     print("Model loaded successfully.")
     return model, vocab, device
 
 
+_loaded = None
+
+
+def get_model():
+    """The serving (model, vocab, device), loaded once per process and shared by every caller."""
+    global _loaded
+    if _loaded is None:
+        _loaded = load_model()
+    return _loaded
+
+
+def latest_checkpoint(ckpt_dir: Path = None) -> Path:
+    ckpt_dir = ckpt_dir or CHECKPOINT_DIR
+    ckpts = sorted(ckpt_dir.glob("transformer_*.pt"), key=lambda p: p.stat().st_mtime)
+    if not ckpts:
+        raise FileNotFoundError(f"no transformer_*.pt checkpoints in {ckpt_dir}")
+    return ckpts[-1]
+
+
+def resolve_checkpoint(checkpoint_path=None) -> Path:
+    """checkpoint_path (default CHECKPOINT_PATH), with "latest" replaced by latest_checkpoint()."""
+    path = Path(checkpoint_path or CHECKPOINT_PATH)
+    return latest_checkpoint() if str(path) == "latest" else path
+
+
+def checkpoint_version(checkpoint_path) -> str:
+    """
+    Short id of a checkpoint file (name + size + mtime). Anything cached
+    from model outputs is keyed by it, so a new checkpoint never reads
+    aggregates computed with the old embeddings.
+    """
+    stat = Path(checkpoint_path).stat()
+    raw = f"{Path(checkpoint_path).name}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+
+def load_vocab(checkpoint_path, ckpt) -> Vocab:
+    """
+    The binary vocab next to the checkpoint; older checkpoints only embed
+    the JSON dict, so build it from that once and try to save it alongside.
+    """
+    npz_path = vocab_path_for(checkpoint_path)
+    if npz_path.exists():
+        return Vocab.load(npz_path)
+
+    vocab = Vocab.from_dict(ckpt["vocab"])
+    try:
+        vocab.save(npz_path)
+    except OSError:
+        pass   # read-only checkpoint dir: rebuild next time
+    return vocab
+
+
 
 # ---------------------------------------------------------
 # UTILS: Convert movie IDs → indices with vocab
 # ---------------------------------------------------------
-def to_idx_list(movie_ids, movie_to_idx):
-    out = []
-    for m in movie_ids:
-        s = str(m)
-        if s in movie_to_idx:
-            out.append(movie_to_idx[s])
-    return out
+def to_idx_list(movie_ids, vocab: Vocab):
+    """Known movie ids → list of vocab indices (unknown ids dropped), in one vectorized call."""
+    return vocab.to_indices(movie_ids).tolist()
 
 
 
 # ---------------------------------------------------------
 # BUILD USER EMBEDDING
 # ---------------------------------------------------------
-def compute_user_embedding(model, vocab, device, user_history):
+def taste_sums(model, taste_lists, device):
+    """
+    Float64 sums [B, d] and counts [B] of the taste item embeddings, one row
+    per list of vocab indices. Every inference path (single request, batch,
+    the Redis aggregate) takes the taste mean from here over the whole taste
+    list: training averages a random subset whose mean estimates exactly
+    this, and the sum only costs a gather, not encoder positions.
+    """
+    counts = torch.tensor([len(t) for t in taste_lists], dtype=torch.long)
+    flat = torch.tensor([i for t in taste_lists for i in t], dtype=torch.long, device=device)
+    rows = torch.repeat_interleave(torch.arange(len(taste_lists), device=device), counts.to(device))
+
+    with torch.no_grad():
+        emb = model.item_embedding(flat).double()                            # [sum T, d]
+        sums = torch.zeros(len(taste_lists), emb.size(1), dtype=torch.float64, device=device)
+        return sums.index_add_(0, rows, emb), counts
+
+
+def taste_aggregate(model, vocab, device, taste_ids):
+    """
+    (float64 sum of item embeddings [d] on CPU, number of known items) over
+    all of `taste_ids`: what compute_user_embedding uses when no aggregate
+    is passed, so the cached and uncached paths agree. Adding the
+    aggregates of two id lists gives the aggregate of their concatenation.
+    """
+    idxs = vocab.to_indices(taste_ids).tolist()
+    sums, counts = taste_sums(model, [idxs], device)
+    return sums[0].cpu(), int(counts[0])
+
+
+def _taste_inputs(model, device, taste_sum, taste_count):
+    """(taste_sum [B, d], taste_count [B]) cast for model.encode_user."""
+    dtype = model.item_embedding.weight.dtype
+    return (
+        taste_sum.to(device=device, dtype=dtype).reshape(-1, model.d_model),
+        torch.as_tensor(taste_count, device=device).reshape(-1).to(dtype),
+    )
+
+
+def compute_user_embedding(model, vocab, device, user_history, taste_sum=None, taste_count=None):
     """
     user_history: list of movie_ids in chronological order
+    taste_sum / taste_count: optional precomputed aggregate (sum of taste
+        item embeddings [d], number of items) that replaces everything
+        older than the recent window, so long histories aren't gathered;
+        without it the same aggregate is computed here (taste_sums)
     returns: user_embedding [128]
     """
 
-    movie_to_idx = vocab["movie_id_to_index"]
-    pad_idx = vocab["pad_index"]
-
     # convert movie_ids → embedding indices
-    idxs = to_idx_list(user_history, movie_to_idx)
+    idxs = to_idx_list(user_history, vocab)
+    taste_items, seq = split_history(idxs, vocab.pad_index)
+
+    # no padding: the encoder runs over the real items only (positions are
+    # right-aligned inside the model, so this equals the padded encoding)
+    seq_tensor = torch.tensor([seq], dtype=torch.long, device=device)
+
+    if taste_sum is None:
+        taste_sum, taste_count = taste_sums(model, [taste_items], device)
+    taste_sum, taste_count = _taste_inputs(model, device, taste_sum, taste_count)
+
+    with torch.no_grad():
+        user_emb = model.encode_user(seq_tensor, None, taste_sum=taste_sum, taste_count=taste_count)  # [1, d]
+
+    return user_emb.squeeze(0)  # [d_model]
+
 
-    # split into taste (old) + recent (sequence)
+def split_history(idxs, pad_idx):
+    """
+    Vocab indices (oldest first) → (taste items, sequence): everything
+    older than the last MAX_SEQ_LEN + 1 items is taste, the sequence is
+    the recent items except the last (same as a training sample), unpadded.
+    An empty sequence becomes [pad_idx] so the encoder has one position.
+    """
     if len(idxs) > MAX_SEQ_LEN + 1:
         taste_items = idxs[: -(MAX_SEQ_LEN + 1)]
         recent_items = idxs[-(MAX_SEQ_LEN + 1) :]
@@ -109,105 +243,164 @@ def compute_user_embedding(model, vocab, device, user_history):
         taste_items = []
         recent_items = idxs
 
-    # build sequence and pad left
-    seq = recent_items[:-1]   # all except last → prefix
-    target = recent_items[-1] # not actually used here but consistent
+    seq = recent_items[:-1][-MAX_SEQ_LEN:]
+    return taste_items, seq or [pad_idx]
 
-    # pad left
-    if len(seq) >= MAX_SEQ_LEN:
-        seq = seq[-MAX_SEQ_LEN:]
-    else:
-        seq = [pad_idx] * (MAX_SEQ_LEN - len(seq)) + seq
 
-    # convert to tensor
-    seq_tensor = torch.tensor([seq], dtype=torch.long, device=device)
-    attn_mask = (seq_tensor != pad_idx).long()
+def length_bucket(n: int) -> int:
+    for bound in LENGTH_BUCKETS:
+        if n <= bound:
+            return bound
+    return MAX_SEQ_LEN
+
 
-    taste_tensor = torch.tensor([taste_items], dtype=torch.long, device=device)
+def encode_users_batch(model, vocab, device, user_histories, batch_size=INFERENCE_BATCH_SIZE):
+    """
+    User embeddings [U, d] for many histories at once. Users are grouped
+    by sequence length bucket and each group is left-padded only to its
+    own longest sequence, so a batch of new users runs the encoder over a
+    few positions instead of MAX_SEQ_LEN. Row i belongs to user_histories[i].
+    """
+    pad_idx = vocab.pad_index
+    splits = [split_history(to_idx_list(h, vocab), pad_idx) for h in user_histories]
 
-    # dummy candidate for forward pass
-    dummy_candidate = torch.tensor([[target]], dtype=torch.long, device=device)
+    buckets = {}
+    for i, (_, seq) in enumerate(splits):
+        buckets.setdefault(length_bucket(len(seq)), []).append(i)
 
-    # run the model to get user embedding BEFORE scoring
+    out = torch.empty(len(splits), model.d_model, device=device)
     with torch.no_grad():
-        # we modify model.forward temporarily to expose user vector
-        # or we call internal functions if we refactor
-        # easiest way: monkey patch the scoring call and extract the user vector
-        out = model(
-            sequence=seq_tensor,
-            attention_mask=attn_mask,
-            taste=taste_tensor,
-            candidate_items=dummy_candidate,
-        )
+        for bound in sorted(buckets):
+            users = buckets[bound]
+            for start in range(0, len(users), batch_size):
+                chunk = users[start: start + batch_size]
+                seqs = [splits[i][1] for i in chunk]
+                taste_sum, taste_count = _taste_inputs(
+                    model, device, *taste_sums(model, [splits[i][0] for i in chunk], device)
+                )
+
+                L = max(len(q) for q in seqs)
+                seq_tensor = torch.tensor([[pad_idx] * (L - len(q)) + q for q in seqs], dtype=torch.long, device=device)
+                padded = any(len(q) < L for q in seqs)
+                attn_mask = (seq_tensor != pad_idx).long() if padded else None
+
+                out[chunk] = model.encode_user(seq_tensor, attn_mask, taste_sum=taste_sum, taste_count=taste_count)
+    return out
 
-        # model internally computes:
-        # seq_user_emb + taste_user_emb → user_emb (before dot product)
-        # so extract it manually from model internals
 
-        # We replicate internal logic to compute user embedding cleanly:
 
-        # Recompute item embeddings
-        seq_emb = model.item_embedding(seq_tensor)
-        pos_ids = torch.arange(seq_tensor.size(1), device=device).unsqueeze(0)
-        pos_emb = model.position_embedding(pos_ids)
-        seq_emb = seq_emb + pos_emb
+# ---------------------------------------------------------
+# TOP-K RECOMMENDATION
+# ---------------------------------------------------------
+def recommend(model, vocab, device, user_history, top_k=20, item_mask=None, candidate_items=None):
+    """
+    user_history: list of movie_ids in chronological order
+    item_mask: optional BoolTensor [num_items] aligned to vocab index;
+               items where it is False are never returned
+    candidate_items: optional LongTensor of vocab indices; when given only
+               these are scored (e.g. a genre posting list)
+    returns: list of (movie_id, score)
+    """
+
+    user_emb = compute_user_embedding(model, vocab, device, user_history)  # [128]
 
-        src_key_padding_mask = (seq_tensor == pad_idx)
-        seq_out = model.transformer(seq_emb, src_key_padding_mask=src_key_padding_mask)
+    if candidate_items is not None:
+        return _recommend_from_candidates(model, vocab, user_emb, candidate_items, top_k)
 
-        seq_user_emb = seq_out[:, -1, :]  # [1, d]
+    num_items = vocab.num_items   # index 0 is padding
 
-        # taste embedding
-        if len(taste_items) == 0:
-            taste_user_emb = torch.zeros_like(seq_user_emb)
-        else:
-            t_emb = model.item_embedding(taste_tensor)  # [1, T, d]
-            taste_mask = (taste_tensor != pad_idx).float().unsqueeze(-1)
-            t_sum = (t_emb * taste_mask).sum(dim=1)
-            t_count = taste_mask.sum(dim=1).clamp(min=1.0)
-            taste_user_emb = t_sum / t_count  # [1, d]
+    with torch.no_grad():
+        # get all item embeddings
+        all_item_indices = torch.arange(1, num_items, device=device)
+        all_item_emb = model.item_embedding(all_item_indices)  # [N, 128]
 
-        # fuse
-        user_emb = model.user_proj(seq_user_emb + taste_user_emb)  # [1, d]
+        # compute scores via dot product
+        scores = torch.matmul(all_item_emb, user_emb)  # [N]
 
-        return user_emb.squeeze(0)  # [d_model]
+        # apply filters before top-K so we always get top_k matching items
+        if item_mask is not None:
+            keep = item_mask[1:num_items]
+            scores = scores.masked_fill(~keep, float("-inf"))
+            top_k = min(top_k, int(keep.sum()))
 
+        # get top-K (reranked by the MLP scorer when the model has one)
+        top_scores, top_indices = select_top_k(model, user_emb[None], scores[None], all_item_indices, top_k)
 
+    movie_ids = vocab.to_ids(top_indices[0].cpu()).tolist()
+    top_scores = top_scores[0]
+    return [
+        {"movie_id": movie_id, "score": score}
+        for movie_id, score in zip(movie_ids, top_scores.tolist())
+    ]
 
-# ---------------------------------------------------------
-# TOP-K RECOMMENDATION
-# ---------------------------------------------------------
-def recommend(model, vocab, device, user_history, top_k=20):
+
+
+def _recommend_from_candidates(model, vocab, user_emb, candidate_items, top_k):
+    """Score only `candidate_items` (vocab indices) and return the top-K of them."""
+    if candidate_items.numel() == 0:
+        return []
+
+    with torch.no_grad():
+        cand_emb = model.item_embedding(candidate_items)  # [C, 128]
+        scores = torch.matmul(cand_emb, user_emb)         # [C]
+        top_scores, top_indices = select_top_k(model, user_emb[None], scores[None], candidate_items, top_k)
+
+    movie_ids = vocab.to_ids(top_indices[0].cpu()).tolist()
+    return [
+        {"movie_id": movie_id, "score": score}
+        for movie_id, score in zip(movie_ids, top_scores[0].tolist())
+    ]
+
+
+def select_top_k(model, user_emb, scores, item_idx, top_k, retrieval_k=None):
     """
-    user_history: list of movie_ids in chronological order
-    returns: list of (movie_id, score)
+    user_emb [B, d]; scores [B, C] dot-product scores of the items
+    item_idx [C] (vocab indices), -inf for filtered-out items.
+    returns (top scores [B, k], top vocab indices [B, k])
+
+    Dot-product models: the top_k of `scores`. MLP-scorer models rank in
+    two stages: the retrieval_k (default RETRIEVAL_K) best by dot product,
+    then the MLP reranks only those, so the cost is bounded by retrieval_k
+    whatever the catalogue size.
     """
+    k = min(top_k, scores.size(1))
+    if model.scorer is None:
+        top_scores, top_pos = torch.topk(scores, k, dim=1)
+        return top_scores, item_idx[top_pos]
 
-    user_emb = compute_user_embedding(model, vocab, device, user_history)  # [128]
-
-    movie_to_idx = vocab["movie_id_to_index"]
-    idx_to_movie = vocab["index_to_movie_id"]
+    retrieval_k = RETRIEVAL_K if retrieval_k is None else retrieval_k
+    retrieved_scores, pos = torch.topk(scores, min(max(retrieval_k, k), scores.size(1)), dim=1)   # [B, R]
+    retrieved = item_idx[pos]                                                                     # [B, R]
 
-    num_items = len(movie_to_idx) + 1   # because index starts at 1
+    mlp = model.mlp_scores(user_emb, model.item_embedding(retrieved))                              # [B, R]
+    mlp = mlp.masked_fill(retrieved_scores == float("-inf"), float("-inf"))   # filtered items stay out
+    top_scores, top_pos = torch.topk(mlp, k, dim=1)
+    return top_scores, retrieved.gather(1, top_pos)
 
-    # get all item embeddings
-    all_item_indices = torch.arange(1, num_items, device=device)
-    all_item_emb = model.item_embedding(all_item_indices)  # [N, 128]
 
-    # compute scores via dot product
-    scores = torch.matmul(all_item_emb, user_emb)  # [N]
 
-    # get top-K
-    top_scores, top_indices = torch.topk(scores, top_k)
+def recommend_batch(model, vocab, device, user_histories, top_k=20, batch_size=INFERENCE_BATCH_SIZE):
+    """
+    recommend() for many users: length-bucketed encoding, then one
+    [B, d] x [d, N] GEMM + topk (+ MLP rerank) per batch of users.
+    returns: one list of {"movie_id", "score"} per history, in order
+    """
+    user_embs = encode_users_batch(model, vocab, device, user_histories, batch_size)
+    item_idx = torch.arange(1, vocab.num_items, device=device)
+    item_emb = model.item_embedding.weight[1:vocab.num_items]   # [N, d], no padding row
 
     results = []
-    for score, idx_pos in zip(top_scores.tolist(), top_indices.tolist()):
-        # idx_pos is the position in all_item_indices (0, 1, 2...)
-        # actual item index is idx_pos + 1 (since we started at 1)
-        actual_idx = idx_pos + 1
-        movie_id = idx_to_movie[str(actual_idx)]
-        results.append({"movie_id": movie_id, "score": score})
-
+    with torch.no_grad():
+        for start in range(0, user_embs.size(0), batch_size):
+            batch_embs = user_embs[start: start + batch_size]
+            scores = batch_embs @ item_emb.T     # [B, N]
+            top_scores, top_indices = select_top_k(model, batch_embs, scores, item_idx, top_k)
+            movie_ids = vocab.to_ids(top_indices.cpu()).tolist()
+            for ids_row, scores_row in zip(movie_ids, top_scores.tolist()):
+                results.append([
+                    {"movie_id": movie_id, "score": score}
+                    for movie_id, score in zip(ids_row, scores_row)
+                ])
     return results
 
 
@@ -0,0 +1,170 @@
+# backend/ml/item_metadata.py
+
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+import torch
+
+
+# ---------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------
+MOVIES_CSV_PATH = Path(__file__).parent.parent.parent / "data" / "movielens_raw" / "movies.csv"
+NO_GENRES = "(no genres listed)"
+YEAR_RE = re.compile(r"\((\d{4})\)\s*$")
+
+
+# ---------------------------------------------------------
+# ITEM METADATA (aligned to vocab index)
+# ---------------------------------------------------------
+class ItemMetadata:
+    """
+    Catalog metadata stored as arrays indexed by vocab index, so a filter
+    becomes a boolean mask over the score vector instead of a DB query.
+
+    genre_bits: LongTensor [num_items], bit g set if the item has genre g
+    years:      IntTensor  [num_items], 0 when unknown
+    titles:     list[str]  [num_items]
+    """
+
+    def __init__(self, genre_names: List[str], genre_bits: torch.Tensor, years: torch.Tensor, titles: List[str]):
+        if len(genre_names) > 63:
+            raise ValueError(f"Too many genres for an int64 bitset: {len(genre_names)}")
+
+        self.genre_names = genre_names
+        self.genre_to_bit = {g.lower(): i for i, g in enumerate(genre_names)}
+        self.genre_bits = genre_bits
+        self.years = years
+        self.titles = titles
+        self._postings = None
+
+    @property
+    def num_items(self) -> int:
+        return self.genre_bits.size(0)
+
+    @classmethod
+    def from_csv(cls, vocab, csv_path: Optional[Path] = None):
+        """Build from MovieLens movies.csv (movieId,title,genres with '|' separators)."""
+        csv_path = csv_path or MOVIES_CSV_PATH
+        num_items = vocab.num_items   # index 0 is padding
+
+        df = pd.read_csv(csv_path)
+        df["idx"] = vocab.to_indices(df["movieId"].to_numpy(), drop_unknown=False)
+        df = df[df["idx"] != vocab.pad_index]
+        idx = torch.tensor(df["idx"].to_numpy())
+
+        genre_lists = [
+            [] if not isinstance(g, str) or g == NO_GENRES else g.split("|")
+            for g in df["genres"]
+        ]
+        genre_names = sorted({g for gl in genre_lists for g in gl})
+        bit_of = {g: i for i, g in enumerate(genre_names)}
+
+        genre_bits = torch.zeros(num_items, dtype=torch.long)
+        genre_bits[idx] = torch.tensor(
+            [sum(1 << bit_of[g] for g in gl) for gl in genre_lists], dtype=torch.long
+        )
+
+        years = torch.zeros(num_items, dtype=torch.int32)
+        parsed = df["title"].str.extract(YEAR_RE, expand=False).fillna(0).astype("int32")
+        years[idx] = torch.tensor(parsed.to_numpy())
+
+        titles = [""] * num_items
+        for i, t in zip(idx.tolist(), df["title"].tolist()):
+            titles[i] = t
+
+        return cls(genre_names, genre_bits, years, titles)
+
+    def to(self, device):
+        self.genre_bits = self.genre_bits.to(device)
+        self.years = self.years.to(device)
+        self._postings = None
+        return self
+
+    @property
+    def genre_postings(self) -> Dict[str, torch.Tensor]:
+        """Inverted index: genre name -> sorted LongTensor of vocab indices. Built once."""
+        if self._postings is None:
+            self._postings = {
+                g: ((self.genre_bits >> bit) & 1).nonzero().squeeze(1)
+                for g, bit in ((g, self.genre_to_bit[g.lower()]) for g in self.genre_names)
+            }
+        return self._postings
+
+    def posting(self, genre: str) -> Optional[torch.Tensor]:
+        bit = self.genre_to_bit.get(genre.lower())
+        if bit is None:
+            return None
+        return self.genre_postings[self.genre_names[bit]]
+
+    def genre_candidates(
+        self,
+        genres: List[str],
+        min_year: Optional[int] = None,
+        max_year: Optional[int] = None,
+    ) -> torch.Tensor:
+        """
+        Sorted vocab indices having ANY of `genres` and passing the year
+        filters. Only touches the posting lists, not the whole catalog.
+        """
+        lists = [p for p in (self.posting(g) for g in genres) if p is not None]
+        if not lists:
+            return torch.empty(0, dtype=torch.long, device=self.genre_bits.device)
+
+        cands = lists[0] if len(lists) == 1 else torch.unique(torch.cat(lists))
+
+        years = self.years[cands]
+        keep = torch.ones_like(cands, dtype=torch.bool)
+        if min_year is not None:
+            keep &= (years == 0) | (years >= min_year)
+        if max_year is not None:
+            keep &= (years == 0) | (years <= max_year)
+        return cands[keep]
+
+    def genres_of(self, idx: int) -> List[str]:
+        bits = int(self.genre_bits[idx])
+        return [g for i, g in enumerate(self.genre_names) if bits >> i & 1]
+
+    def year_of(self, idx: int) -> Optional[int]:
+        year = int(self.years[idx])
+        return year or None
+
+    def filter_mask(
+        self,
+        genres: Optional[List[str]] = None,
+        min_year: Optional[int] = None,
+        max_year: Optional[int] = None,
+    ) -> torch.Tensor:
+        """
+        BoolTensor [num_items]: True where the item passes every filter.
+        Genres match if the item has ANY of them (case-insensitive); items
+        with an unknown year are kept by the year filters. Padding is never kept.
+        """
+        mask = torch.ones(self.num_items, dtype=torch.bool, device=self.genre_bits.device)
+        mask[0] = False
+
+        if genres:
+            wanted = 0
+            for g in genres:
+                bit = self.genre_to_bit.get(g.lower())
+                if bit is not None:
+                    wanted |= 1 << bit
+            mask &= (self.genre_bits & wanted) != 0
+
+        known_year = self.years > 0
+        if min_year is not None:
+            mask &= ~known_year | (self.years >= min_year)
+        if max_year is not None:
+            mask &= ~known_year | (self.years <= max_year)
+
+        return mask
+
+
+def load_item_metadata(vocab, device=None, csv_path: Optional[Path] = None) -> ItemMetadata:
+    meta = ItemMetadata.from_csv(vocab, csv_path)
+    if device is not None:
+        meta.to(device)
+    print(f"Loaded metadata for {meta.num_items - 1} items ({len(meta.genre_names)} genres)")
+    return meta
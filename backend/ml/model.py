@@ -73,33 +73,37 @@ class TransformerRecModel(nn.Module):
             # We will use dot product scoring:
             # score(user, item) = <user_emb, item_emb>
 
-    def forward(
+    def encode_user(
         self,
-        sequence: torch.Tensor,        # [B, L] item indices (left-padded)
-        attention_mask: torch.Tensor,  # [B, L] 1 for real, 0 for pad
-        taste: torch.Tensor,           # [B, T] item indices (padded with pad_idx)
-        candidate_items: torch.Tensor, # [B, K] candidate movie indices
-    ):
+        sequence: torch.Tensor,        # [B, L] item indices (left-padded), L <= max_seq_len
+        attention_mask: torch.Tensor,  # [B, L] 1 for real, 0 for pad; None: no padding at all
+        taste: torch.Tensor = None,    # [B, T] item indices (padded with pad_idx)
+        taste_sum: torch.Tensor = None,    # [B, D] precomputed sum of taste embeddings
+        taste_count: torch.Tensor = None,  # [B] or [B, 1] number of taste items
+    ) -> torch.Tensor:
         """
-        Forward pass.
-
-        sequence: LongTensor [B, L]
-        attention_mask: LongTensor [B, L]  (1 = real token, 0 = padding)
-        taste: LongTensor [B, T]
-        candidate_items: LongTensor [B, K]
-
-        Returns:
-            scores: FloatTensor [B, K] (higher = more relevant)
+        User embedding [B, D]: sequence encoding fused with the mean taste
+        embedding. Score items with `user_emb @ item_embedding.weight.T`.
+
+        Taste is either the padded index tensor, or a precomputed
+        (taste_sum, taste_count) aggregate so long histories never have to
+        be gathered. The aggregate path is for inference: no gradient flows
+        into the item embeddings through it.
+
+        Sequences shorter than max_seq_len take the last L positions, exactly
+        where they would sit after left-padding to max_seq_len, so inference
+        can skip the padding (attention_mask=None runs the encoder without a
+        key padding mask) and get the same embedding for L/max_seq_len of
+        the compute.
         """
-
         device = sequence.device
         B, L = sequence.shape
 
         # ---- 1. Embed sequence ----
         seq_emb = self.item_embedding(sequence)  # [B, L, D]
 
-        # Positional indices: 0..L-1 (we assume the rightmost is last position)
-        pos_ids = torch.arange(L, device=device).unsqueeze(0).expand(B, L)
+        # Positional indices: the last L of 0..max_seq_len-1 (rightmost is the newest item)
+        pos_ids = torch.arange(self.max_seq_len - L, self.max_seq_len, device=device).unsqueeze(0).expand(B, L)
         pos_emb = self.position_embedding(pos_ids)  # [B, L, D]
 
         # Add positional info
@@ -107,7 +111,14 @@ class TransformerRecModel(nn.Module):
 
         # ---- 2. Build Transformer padding mask ----
         # src_key_padding_mask: [B, L] with True for PAD positions
-        src_key_padding_mask = (sequence == self.pad_idx)  # bool
+        if attention_mask is None:
+            src_key_padding_mask = None
+        else:
+            src_key_padding_mask = (sequence == self.pad_idx)  # bool
+            # The last position is a real item whenever there is one; keep it
+            # unmasked so an empty sequence (only past watches / ratings) still
+            # has something to attend to instead of an all-masked row
+            src_key_padding_mask[:, -1] = False
 
         # ---- 3. Transformer encoder ----
         # batch_first=True, so input is [B, L, D]
@@ -121,37 +132,65 @@ class TransformerRecModel(nn.Module):
         seq_user_emb = seq_out[:, -1, :]  # [B, D]
 
         # ---- 5. Taste embedding (long-term) ----
-        # taste: [B, T], padded with pad_idx
+        if taste_sum is None:
+            taste_sum, taste_count = self.taste_aggregate(taste)  # [B, D], [B, 1]
+        taste_count = taste_count.reshape(-1, 1).to(taste_sum.dtype).clamp(min=1.0)
+        taste_user_emb = taste_sum / taste_count  # [B, D]
+
+        # ---- 6. Fuse sequence + taste ----
+        user_emb = seq_user_emb + taste_user_emb  # [B, D]
+        user_emb = self.user_proj(user_emb)       # [B, D]
+
+        return user_emb
+
+    def taste_aggregate(self, taste: torch.Tensor):
+        """(sum of taste embeddings [B, D], non-pad count [B, 1]) for padded taste [B, T]."""
         taste_emb = self.item_embedding(taste)  # [B, T, D]
 
         # mask out pad positions in taste
         taste_mask = (taste != self.pad_idx).float().unsqueeze(-1)  # [B, T, 1]
         masked_taste_emb = taste_emb * taste_mask  # zero out pad rows
 
-        # sum over T, then divide by count of non-pad tokens
-        taste_sum = masked_taste_emb.sum(dim=1)  # [B, D]
-        taste_count = taste_mask.sum(dim=1).clamp(min=1.0)  # [B, 1]
-        taste_user_emb = taste_sum / taste_count  # [B, D]
+        # sum over T; the caller divides by the count of non-pad tokens
+        return masked_taste_emb.sum(dim=1), taste_mask.sum(dim=1)
 
-        # ---- 6. Fuse sequence + taste ----
-        user_emb = seq_user_emb + taste_user_emb  # [B, D]
-        user_emb = self.user_proj(user_emb)       # [B, D]
+    def forward(
+        self,
+        sequence: torch.Tensor,        # [B, L] item indices (left-padded)
+        attention_mask: torch.Tensor,  # [B, L] 1 for real, 0 for pad
+        taste: torch.Tensor,           # [B, T] item indices (padded with pad_idx)
+        candidate_items: torch.Tensor, # [B, K] candidate movie indices, or [K] shared by the batch
+        taste_sum: torch.Tensor = None,    # optional [B, D] aggregate instead of `taste`
+        taste_count: torch.Tensor = None,  # optional [B] count for `taste_sum`
+    ):
+        """
+        Forward pass.
+
+        sequence: LongTensor [B, L]
+        attention_mask: LongTensor [B, L]  (1 = real token, 0 = padding)
+        taste: LongTensor [B, T]
+        candidate_items: LongTensor [B, K] per-row candidates,
+                         or [K] candidates scored against every row
+                         (in-batch / shared sampled negatives)
+
+        Returns:
+            scores: FloatTensor [B, K] (higher = more relevant)
+        """
+
+        # ---- 1-6. User embedding ----
+        user_emb = self.encode_user(sequence, attention_mask, taste, taste_sum, taste_count)  # [B, D]
 
         # ---- 7. Candidate item embeddings ----
-        # candidate_items: [B, K]
-        cand_emb = self.item_embedding(candidate_items)  # [B, K, D]
+        # candidate_items: [B, K] or shared [K]
+        cand_emb = self.item_embedding(candidate_items)  # [B, K, D] or [K, D]
 
         # ---- 8. Scoring ----
         if self.use_mlp_scorer:
             # MLP-based scoring (more expressive)
-            # Expand user_emb to match candidates: [B, K, D]
-            user_emb_expanded = user_emb.unsqueeze(1).expand(-1, cand_emb.size(1), -1)
-            
-            # Concatenate user and item embeddings: [B, K, 2*D]
-            combined = torch.cat([user_emb_expanded, cand_emb], dim=-1)
-            
-            # Pass through MLP scorer: [B, K, 1] -> [B, K]
-            scores = self.scorer(combined).squeeze(-1)
+            scores = self.mlp_scores(user_emb, cand_emb)  # [B, K]
+        elif candidate_items.dim() == 1:
+            # shared candidates: one [B, D] x [D, K] matmul, no per-row gather
+            scores = user_emb @ cand_emb.T  # [B, K]
         else:
             # Dot product scoring (original)
             # scores[b, k] = dot(user_emb[b], cand_emb[b, k])
@@ -160,3 +199,17 @@ class TransformerRecModel(nn.Module):
             scores = torch.bmm(cand_emb, user_emb_expanded).squeeze(-1)  # [B, K]
 
         return scores
+
+    def mlp_scores(self, user_emb: torch.Tensor, cand_emb: torch.Tensor) -> torch.Tensor:
+        """
+        MLP scores [B, K] for user_emb [B, D] and cand_emb [B, K, D] (or [K, D]
+        shared by every row). Same as scorer(cat([user, item])), but the first
+        Linear is split into its user and item halves, so the [B, K, 2D]
+        concatenation is never built and shared candidates are projected once.
+        """
+        first, rest = self.scorer[0], self.scorer[1:]
+        w_user, w_item = first.weight[:, :self.d_model], first.weight[:, self.d_model:]
+
+        user_part = F.linear(user_emb, w_user, first.bias).unsqueeze(1)   # [B, 1, H]
+        item_part = F.linear(cand_emb, w_item)                            # [B, K, H] or [K, H]
+        return rest(user_part + item_part).squeeze(-1)                    # [B, K]
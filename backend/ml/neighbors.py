@@ -0,0 +1,227 @@
+"""
+Precomputed item-to-item neighbours for /similar.
+
+Item embeddings are fixed per checkpoint, so the top-N cosine neighbours
+of every item are computed once, with blocked [B, d] x [d, N] GEMMs + topk,
+and stored next to the checkpoint as two .npy arrays (int32 vocab indices,
+float16 similarities, [num_items, depth]). Serving memory-maps them, so a
+lookup is one row slice and every worker shares the same pages.
+
+    cd backend
+    python -m ml.neighbors                                  # inference checkpoint
+    python -m ml.neighbors --checkpoint ../model_checkpoints/transformer_epoch3.pt --depth 200
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from ml.inference import CHECKPOINT_PATH, get_model, load_model
+
+
+# -----------------------------
+# Config
+# -----------------------------
+NEIGHBOR_DEPTH = 100     # neighbours stored per item; /similar computes larger top_k live
+BLOCK_SIZE = 1024        # query items per GEMM block ([BLOCK_SIZE, num_items] scores in memory)
+# off by default: every uvicorn worker runs its own loader, so each would
+# build (and write) the same table. Build it with `python -m ml.neighbors`;
+# until then /similar stays live. Set to 1 for single-worker dev servers.
+BUILD_ON_LOAD = os.getenv("NEIGHBORS_BUILD_ON_LOAD", "0") == "1"
+
+
+# -----------------------------
+# Table
+# -----------------------------
+def neighbors_paths_for(checkpoint_path, version: str) -> Tuple[Path, Path]:
+    """x.pt -> (x.<version>.nbr_idx.npy, x.<version>.nbr_score.npy); a new checkpoint never reads old tables."""
+    base = Path(checkpoint_path).with_suffix(f".{version}")
+    return base.with_name(base.name + ".nbr_idx.npy"), base.with_name(base.name + ".nbr_score.npy")
+
+
+class NeighborTable:
+    """
+    indices[i] / scores[i]: the `depth` nearest items of vocab index i by
+    cosine similarity, best first (never i itself or the padding index).
+    """
+
+    def __init__(self, indices: np.ndarray, scores: np.ndarray):
+        self.indices = indices
+        self.scores = scores
+
+    @property
+    def depth(self) -> int:
+        return self.indices.shape[1]
+
+    def lookup(self, idx: int, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.indices[idx, :top_k], self.scores[idx, :top_k].astype(np.float32)
+
+    @classmethod
+    def load(cls, checkpoint_path, version: str) -> Optional["NeighborTable"]:
+        idx_path, score_path = neighbors_paths_for(checkpoint_path, version)
+        if not (idx_path.exists() and score_path.exists()):
+            return None
+        return cls(np.load(idx_path, mmap_mode="r"), np.load(score_path, mmap_mode="r"))
+
+    def save(self, checkpoint_path, version: str):
+        # write under temporary names and rename, so a concurrent load
+        # never maps a half-written file
+        for path, array in zip(neighbors_paths_for(checkpoint_path, version), (self.indices, self.scores)):
+            tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp, path)
+
+
+# -----------------------------
+# Build
+# -----------------------------
+def normalized_items(model) -> torch.Tensor:
+    """L2-normalized item embeddings [num_items, d] (the padding row stays zero)."""
+    return F.normalize(model.item_embedding.weight.detach(), dim=1)
+
+
+def build_neighbors(model, pad_idx: int, depth: int = NEIGHBOR_DEPTH, block_size: int = BLOCK_SIZE) -> NeighborTable:
+    item_norm = normalized_items(model)   # [N, d]
+    num_items = item_norm.size(0)
+    depth = min(depth, num_items - 2)     # minus the item itself and padding
+
+    indices = np.empty((num_items, depth), dtype=np.int32)
+    scores = np.empty((num_items, depth), dtype=np.float16)
+    with torch.no_grad():
+        for start in range(0, num_items, block_size):
+            stop = min(start + block_size, num_items)
+            sims = item_norm[start:stop] @ item_norm.T                    # [B, N]
+            sims[:, pad_idx] = float("-inf")
+            rows = torch.arange(stop - start, device=sims.device)
+            sims[rows, rows + start] = float("-inf")                      # not its own neighbour
+            top_scores, top_idx = torch.topk(sims, depth, dim=1)
+            indices[start:stop] = top_idx.cpu().numpy()
+            scores[start:stop] = top_scores.cpu().numpy()
+
+    indices[pad_idx] = pad_idx   # the padding row is never looked up
+    scores[pad_idx] = 0
+    return NeighborTable(indices, scores)
+
+
+def ensure_neighbors(model, vocab, checkpoint_path, depth: int = NEIGHBOR_DEPTH) -> NeighborTable:
+    """The stored table for this checkpoint, built and saved if there is none."""
+    table = NeighborTable.load(checkpoint_path, model.version)
+    if table is not None:
+        return table
+
+    t0 = time.time()
+    table = build_neighbors(model, vocab.pad_index, depth)
+    print(f"Built {table.depth} neighbours for {vocab.num_items} items in {time.time() - t0:.1f}s")
+    try:
+        table.save(checkpoint_path, model.version)
+    except OSError:
+        pass   # read-only checkpoint dir: serve from memory, rebuild next time
+    return table
+
+
+_table = None
+
+
+def get_neighbor_table() -> Optional[NeighborTable]:
+    """The serving model's table (loaded once per process), or None to stay live."""
+    global _table
+    if _table is None:
+        model, vocab, device = get_model()
+        if BUILD_ON_LOAD:
+            _table = ensure_neighbors(model, vocab, model.checkpoint_path)
+        else:
+            _table = NeighborTable.load(model.checkpoint_path, model.version)
+    return _table
+
+
+# -----------------------------
+# Live (top_k beyond the stored depth, no table, multi-seed)
+# -----------------------------
+_inv_norms = {}
+
+
+def item_inv_norms(model) -> torch.Tensor:
+    """1 / ||item embedding|| [num_items], once per checkpoint (a vector, not a normalized copy of the table)."""
+    if model.version not in _inv_norms:
+        with torch.no_grad():
+            _inv_norms[model.version] = 1.0 / model.item_embedding.weight.norm(dim=1).clamp(min=1e-12)
+    return _inv_norms[model.version]
+
+
+def seed_scores(model, seed_idx: torch.Tensor) -> torch.Tensor:
+    """Cosine similarity [S, num_items] of the seed items (vocab indices [S]) to every item: one GEMM."""
+    with torch.no_grad():
+        item_emb = model.item_embedding.weight                  # [N, d]
+        seeds = F.normalize(item_emb[seed_idx], dim=1)          # [S, d]
+        return (seeds @ item_emb.T) * item_inv_norms(model)     # [S, N]
+
+
+def similar_live(model, pad_idx: int, idx: int, top_k: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    """(top cosine scores [k], vocab indices [k]) of item idx against the whole catalogue."""
+    top_scores, top_idx = similar_multi(model, pad_idx, [idx], top_k)
+    return top_scores[0], top_idx[0]
+
+
+def similar_multi(model, pad_idx: int, seed_idx, top_k: int, exclude_idx=(), aggregate: Optional[str] = None):
+    """
+    Neighbours of several seeds from one [S, d] x [d, N] matmul.
+
+    seed_idx: vocab indices of the seed items
+    exclude_idx: vocab indices never returned (e.g. the watch history);
+                 the seeds themselves and padding are always excluded
+    aggregate: None -> one ranking per seed; "mean" / "max" -> one ranking
+               over the per-seed similarities combined that way
+    returns (top scores [R, k], vocab indices [R, k]); R = S, or 1 when aggregated
+    """
+    device = model.item_embedding.weight.device
+    seed_idx = torch.as_tensor(seed_idx, dtype=torch.long, device=device)
+    excluded = torch.cat([
+        seed_idx,
+        torch.as_tensor(exclude_idx, dtype=torch.long, device=device).reshape(-1),
+        torch.tensor([pad_idx], device=device),
+    ])
+
+    with torch.no_grad():
+        scores = seed_scores(model, seed_idx)      # [S, N]
+        if aggregate == "mean":
+            scores = scores.mean(dim=0, keepdim=True)
+        elif aggregate == "max":
+            scores = scores.amax(dim=0, keepdim=True)
+        elif aggregate is not None:
+            raise ValueError(f"unknown aggregate: {aggregate}")
+
+        # exclusions before topk, so every row still has top_k real results
+        scores[:, excluded] = float("-inf")
+        k = min(top_k, scores.size(1) - int(torch.unique(excluded).numel()))
+        return torch.topk(scores, max(k, 0), dim=1)
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Precompute item-to-item neighbours for /similar")
+    parser.add_argument("--checkpoint", type=Path, default=CHECKPOINT_PATH)
+    parser.add_argument("--depth", type=int, default=NEIGHBOR_DEPTH)
+    parser.add_argument("--device", default=None)
+    args = parser.parse_args()
+
+    device = torch.device(args.device) if args.device else None
+    model, vocab, _ = load_model(device, checkpoint_path=args.checkpoint)
+
+    t0 = time.time()
+    table = build_neighbors(model, vocab.pad_index, args.depth)
+    table.save(model.checkpoint_path, model.version)   # "latest" resolved
+    idx_path, _ = neighbors_paths_for(model.checkpoint_path, model.version)
+    print(f"{vocab.num_items} items x {table.depth} neighbours in {time.time() - t0:.1f}s -> {idx_path.parent}")
+
+
+if __name__ == "__main__":
+    main()
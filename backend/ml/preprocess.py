@@ -1,9 +1,14 @@
 # backend/ml/preprocess.py
 
+import argparse
+import io
+import os
+import shutil
 import pandas as pd
+import numpy as np
+from multiprocessing import Pool
 from pathlib import Path
-from typing import List, Dict, Any
-from collections import Counter
+from typing import List, Dict, Any, Tuple
 import json
 from tqdm import tqdm
 
@@ -13,12 +18,17 @@ PROJECT_ROOT = Path(__file__).parent.parent.parent  # Go up from backend/ml/ to
 RAW_RATINGS_PATH = PROJECT_ROOT / "data/movielens_raw/ratings.csv"
 PROCESSED_DIR = PROJECT_ROOT / "data/movielens_processed"
 TRAIN_JSONL_PATH = PROCESSED_DIR / "train.jsonl"
+PACKED_DIR = PROCESSED_DIR / "packed"
+SPILL_DIR = PROCESSED_DIR / "spill"
 VOCAB_PATH = PROJECT_ROOT / "data/vocab.json"
 
 # Hyperparams / config
 RATING_THRESHOLD = 3.5
 MAX_SEQ_LEN = 50
 MIN_HISTORY_LEN = 3      # min events per user to be useful
+RANGE_BYTES = 64 << 20   # ratings.csv is parsed in ranges of this many bytes
+NUM_SHARDS = 16          # users are split into userId % NUM_SHARDS shards, grouped one at a time
+RATINGS_DTYPES = {"userId": np.int32, "movieId": np.int32, "rating": np.float32, "timestamp": np.int64}
 
 
 def build_vocab(movie_ids: List[int]) -> Dict[str, Any]:
@@ -82,69 +92,331 @@ def sliding_window_sequences(
     return samples
 
 
-def main():
-    print(f"Loading ratings from {RAW_RATINGS_PATH} ...")
-    df = pd.read_csv(RAW_RATINGS_PATH)
+# ---------------------------------------------------------
+# Stage 1: chunked, parallel CSV parsing
+# ---------------------------------------------------------
+def _byte_ranges(path: Path, range_bytes: int) -> List[Tuple[int, int]]:
+    size = path.stat().st_size
+    return [(start, min(start + range_bytes, size)) for start in range(0, size, range_bytes)]
+
 
-    # Expect columns: userId, movieId, rating, timestamp
-    # Filter implicit positives
+def _read_range(args) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parse the ratings lines that START inside [start, end) and keep the
+    implicit positives. Returns compact (user, movie, timestamp) arrays, so
+    peak memory per worker is one range, not the whole file.
+    """
+    path, start, end, columns = args
+    with open(path, "rb") as f:
+        if start == 0:
+            f.readline()                      # header
+        else:
+            f.seek(start - 1)
+            if f.read(1) != b"\n":
+                f.readline()                  # partial line: belongs to the previous range
+        pos = f.tell()
+        data = f.read(max(end - pos, 0))
+        if data and not data.endswith(b"\n"):
+            data += f.readline()              # finish the line that crosses `end`
+
+    if not data:
+        empty = np.empty(0, dtype=np.int32)
+        return empty, empty, np.empty(0, dtype=np.int64)
+
+    df = pd.read_csv(io.BytesIO(data), header=None, names=columns, dtype=RATINGS_DTYPES)
     df = df[df["rating"] >= RATING_THRESHOLD]
+    return (
+        df["userId"].to_numpy(np.int32),
+        df["movieId"].to_numpy(np.int32),
+        df["timestamp"].to_numpy(np.int64),
+    )
+
+
+def _range_tasks(path: Path, range_bytes: int):
+    with open(path, "r") as f:
+        columns = f.readline().strip().split(",")
+    return [(str(path), start, end, columns) for start, end in _byte_ranges(path, range_bytes)]
+
+
+def load_positive_ratings(path: Path, workers: int = 1, range_bytes: int = RANGE_BYTES):
+    """Read ratings.csv in byte ranges (optionally across processes); keep rating >= threshold."""
+    tasks = _range_tasks(path, range_bytes)
+
+    if workers > 1:
+        with Pool(workers) as pool:
+            parts = list(tqdm(pool.imap(_read_range, tasks), total=len(tasks), desc="Reading ratings"))
+    else:
+        parts = [_read_range(t) for t in tqdm(tasks, desc="Reading ratings")]
+
+    users = np.concatenate([p[0] for p in parts])
+    movies = np.concatenate([p[1] for p in parts])
+    timestamps = np.concatenate([p[2] for p in parts])
+    return users, movies, timestamps
+
+
+def _spill_range(args) -> int:
+    """_read_range, then write the positives to one spill file per user shard. Returns the row count."""
+    task, range_no, spill_dir, n_shards = args
+    users, movies, timestamps = _read_range(task)
+    shard = users % n_shards
+    for s in np.unique(shard).tolist():
+        m = shard == s
+        np.savez(
+            Path(spill_dir) / f"shard{s:03d}_range{range_no:05d}.npz",
+            users=users[m], movies=movies[m], timestamps=timestamps[m],
+        )
+    return len(users)
+
+
+def spill_positive_ratings(
+    path: Path, spill_dir: Path, n_shards: int = NUM_SHARDS, workers: int = 1, range_bytes: int = RANGE_BYTES
+) -> int:
+    """
+    Like load_positive_ratings, but nothing is gathered in the parent: each
+    range's positives go to spill_dir, split by userId % n_shards, so every
+    user's events end up in exactly one shard. Returns the number of positives.
+    """
+    spill_dir.mkdir(parents=True, exist_ok=True)
+    tasks = [(t, i, str(spill_dir), n_shards) for i, t in enumerate(_range_tasks(path, range_bytes))]
+
+    if workers > 1:
+        with Pool(workers) as pool:
+            counts = list(tqdm(pool.imap(_spill_range, tasks), total=len(tasks), desc="Reading ratings"))
+    else:
+        counts = [_spill_range(t) for t in tqdm(tasks, desc="Reading ratings")]
+    return sum(counts)
+
+
+def load_shard(spill_dir: Path, shard: int):
+    """One shard's spilled (users, movies, timestamps), in file order."""
+    parts = [np.load(p) for p in sorted(spill_dir.glob(f"shard{shard:03d}_range*.npz"))]
+    if not parts:
+        empty = np.empty(0, dtype=np.int32)
+        return empty, empty, np.empty(0, dtype=np.int64)
+    return tuple(np.concatenate([p[k] for p in parts]) for k in ("users", "movies", "timestamps"))
+
+
+# ---------------------------------------------------------
+# Stage 2: vectorized sort / group / split
+# ---------------------------------------------------------
+def group_user_sequences(users: np.ndarray, movies: np.ndarray, timestamps: np.ndarray, return_dropped: bool = False):
+    """
+    Sort by (user, timestamp), drop users below MIN_HISTORY_LEN and return
+    (user_ids, user_offsets, movies) with each user's movies chronological.
+    No Python loop over users.
 
-    # Sort by user + timestamp to ensure chronological order
-    df = df.sort_values(["userId", "timestamp"])
+    return_dropped: also return the dropped users' (users, movies, timestamps)
+    so ml/incremental.py can complete them once more events arrive.
+    """
+    order = np.lexsort((timestamps, users))   # stable, like sort_values(["userId", "timestamp"])
+    users = users[order]
+    movies = movies[order]
+    timestamps = timestamps[order]
 
-    # Group by user
-    user_groups = df.groupby("userId")
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]]) if len(users) else np.empty(0, dtype=np.int64)
+    lengths = np.diff(np.r_[starts, len(users)])
+
+    keep_user = lengths >= MIN_HISTORY_LEN
+    keep = np.repeat(keep_user, lengths)
+    user_ids = users[starts[keep_user]]
+    user_offsets = np.r_[0, np.cumsum(lengths[keep_user])].astype(np.int64)
+    if return_dropped:
+        dropped = (users[~keep], movies[~keep], timestamps[~keep])
+        return user_ids, user_offsets, movies[keep], dropped
+    return user_ids, user_offsets, movies[keep]
 
-    PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
 
-    all_movie_ids = []
-    n_users = user_groups.ngroups
-    print(f"Total users after filtering: {n_users}")
+def pack_shards(spill_dir: Path, n_shards: int, holdout: bool = False):
+    """
+    group_user_sequences one shard at a time, then write every shard's
+    sequences (as vocab indices) into one items array ordered by user id,
+    memory-mapped in spill_dir. Only one shard's events are in memory at
+    once, plus small per-user arrays and the movie ids seen so far.
 
-    # We'll write out JSONL incrementally to avoid huge memory usage
-    with TRAIN_JSONL_PATH.open("w", encoding="utf-8") as f_out:
+    Returns (user_ids, user_offsets, items, holdout_targets, unique_movie_ids,
+    dropped); the same arrays main() used to get from one global group.
+    """
+    ids, lengths, dropped = [], [], []
+    unique_ids = np.empty(0, dtype=np.int32)
+    for s in tqdm(range(n_shards), desc="Grouping shards"):
+        user_ids, user_offsets, movies, shard_dropped = group_user_sequences(*load_shard(spill_dir, s), return_dropped=True)
+        np.savez(spill_dir / f"grouped{s:03d}.npz", user_offsets=user_offsets, movies=movies)
+        ids.append(user_ids)
+        lengths.append(np.diff(user_offsets))
+        unique_ids = np.union1d(unique_ids, movies)   # vocab: movies of kept users
+        dropped.append(shard_dropped)
+
+    # global layout: users sorted by id; where each (shard-order) user starts
+    ids, lengths = np.concatenate(ids), np.concatenate(lengths)
+    if holdout:
+        lengths = lengths - 1
+    order = np.argsort(ids, kind="stable")
+    user_offsets = np.r_[0, np.cumsum(lengths[order])].astype(np.int64)
+    start = np.empty(len(ids), dtype=np.int64)
+    start[order] = user_offsets[:-1]
+
+    items = np.lib.format.open_memmap(spill_dir / "items.npy", mode="w+", dtype=np.int32, shape=(int(user_offsets[-1]),))
+    targets = np.empty(len(ids), dtype=np.int32) if holdout else None
+    first = 0
+    for s in tqdm(range(n_shards), desc="Packing shards"):
+        grouped = np.load(spill_dir / f"grouped{s:03d}.npz")
+        shard_offsets = grouped["user_offsets"]
+        shard_items = np.searchsorted(unique_ids, grouped["movies"]).astype(np.int32) + 1   # index 0 is padding
+        n = len(shard_offsets) - 1
+        if holdout:
+            shard_items, shard_offsets, targets[first:first + n] = hold_out_last(shard_items, shard_offsets)
+        shift = start[first:first + n] - shard_offsets[:-1]
+        items[np.repeat(shift, np.diff(shard_offsets)) + np.arange(len(shard_items))] = shard_items
+        first += n
+    items.flush()
+
+    d_users, d_movies, d_ts = (np.concatenate([d[i] for d in dropped]) for i in range(3))
+    d_order = np.lexsort((d_ts, d_users))
+    dropped = (d_users[d_order], d_movies[d_order], d_ts[d_order])
+    return ids[order], user_offsets, items, targets[order] if holdout else None, unique_ids, dropped
+
+
+def save_pending(out_dir: Path, users: np.ndarray, movies: np.ndarray, timestamps: np.ndarray):
+    """Interactions of users still below MIN_HISTORY_LEN (raw movie ids), kept for ml/incremental.py."""
+    np.savez(out_dir / "pending.npz", users=users, movies=movies, timestamps=timestamps)
+
+
+def build_sample_index(user_offsets: np.ndarray, max_seq_len: int):
+    """
+    Per user: everything before the last max_seq_len + 1 items is taste;
+    one sample per target inside that recent window (position taste_len+1 .. n-1).
+    """
+    lengths = np.diff(user_offsets)
+    taste_len = np.maximum(lengths - (max_seq_len + 1), 0).astype(np.int32)
 
-        for user_id, group in tqdm(user_groups, desc="Processing users"):
-            movie_seq = group["movieId"].tolist()
+    per_user = lengths - taste_len - 1
+    sample_user = np.repeat(np.arange(len(lengths), dtype=np.int32), per_user)
+    first = np.r_[0, np.cumsum(per_user)[:-1]]
+    sample_end = (
+        np.arange(per_user.sum()) - np.repeat(first, per_user) + np.repeat(taste_len + 1, per_user)
+    ).astype(np.int32)
+    return taste_len, sample_user, sample_end
 
-            # Need some minimum history length
-            if len(movie_seq) < MIN_HISTORY_LEN:
-                continue
 
-            # For taste vs sequence split:
-            # - Use up to last MAX_SEQ_LEN + 1 as "recent"
-            # - Everything before that is "taste"
-            if len(movie_seq) > (MAX_SEQ_LEN + 1):
-                taste_items = movie_seq[: -(MAX_SEQ_LEN + 1)]
-                recent_items = movie_seq[-(MAX_SEQ_LEN + 1) :]
-            else:
-                taste_items = []
-                recent_items = movie_seq
+def hold_out_last(items: np.ndarray, user_offsets: np.ndarray):
+    """
+    Time-based leave-one-out split: each user's newest item becomes their
+    evaluation target and is removed from the training sequence.
+    Returns (train_items, train_offsets, targets).
+    """
+    last = user_offsets[1:] - 1
+    targets = items[last]
+    train_items = np.delete(items, last)
+    train_offsets = user_offsets - np.arange(len(user_offsets), dtype=user_offsets.dtype)
+    return train_items, train_offsets, targets
+
+
+def save_user_sequences(
+    out_dir: Path,
+    items: np.ndarray,
+    user_offsets: np.ndarray,
+    user_ids: np.ndarray,
+    max_seq_len: int,
+    pad_index: int,
+    holdout_targets: np.ndarray = None,
+):
+    """
+    Stores each user's chronological sequence ONCE (as vocab indices) plus a
+    compact (user, end_position) sample index. Training windows are cut from
+    it on the fly by MovieLensPackedDataset, so nothing is repeated per sample.
 
-            # Build sliding window samples from recent_items
-            samples = sliding_window_sequences(recent_items, MAX_SEQ_LEN)
+    user u:   items[user_offsets[u]:user_offsets[u+1]]
+              the first taste_len[u] items are taste, the rest the recent window
+    sample i: target = position sample_end[i] of user sample_user[i]
+              sequence = up to max_seq_len recent items before it
 
-            for s in samples:
+    With `holdout_targets`, holdout_targets[u] is the item that follows
+    user u's stored sequence, for ml/evaluate.py.
+    """
+    taste_len, sample_user, sample_end = build_sample_index(user_offsets, max_seq_len)
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    np.save(out_dir / "items.npy", np.asarray(items, dtype=np.int32))   # no copy of a memmap
+    np.save(out_dir / "user_offsets.npy", user_offsets.astype(np.int64))
+    np.save(out_dir / "taste_len.npy", taste_len)
+    np.save(out_dir / "user_ids.npy", user_ids.astype(np.int32))
+    np.save(out_dir / "sample_user.npy", sample_user)
+    np.save(out_dir / "sample_end.npy", sample_end)
+    if holdout_targets is not None:
+        np.save(out_dir / "holdout_targets.npy", holdout_targets.astype(np.int32))
+
+    meta = {
+        "format": "user-sequences-v1",
+        "num_users": int(len(user_ids)),
+        "num_samples": int(len(sample_user)),
+        "max_seq_len": max_seq_len,
+        "pad_index": pad_index,
+        "holdout": holdout_targets is not None,
+    }
+    (out_dir / "meta.json").write_text(json.dumps(meta))
+    return meta
+
+
+def write_legacy_jsonl(path: Path, user_ids, user_offsets, items, index_to_id, max_seq_len: int):
+    """One JSON record per sliding window (the old train.jsonl format), in movie ids. Slow; optional."""
+    with path.open("w", encoding="utf-8") as f_out:
+        for u in tqdm(range(len(user_ids)), desc="Writing train.jsonl"):
+            movie_seq = index_to_id[items[user_offsets[u]: user_offsets[u + 1]]].tolist()
+            taste_items = movie_seq[: -(max_seq_len + 1)]
+            recent_items = movie_seq[-(max_seq_len + 1):]
+            for s in sliding_window_sequences(recent_items, max_seq_len):
                 record = {
-                    "user_id": int(user_id),
+                    "user_id": int(user_ids[u]),
                     "sequence": s["sequence"],       # list[int]
                     "target": int(s["target"]),      # next movie
                     "taste": taste_items,            # list[int], older movies
                 }
                 f_out.write(json.dumps(record) + "\n")
-                all_movie_ids.extend(s["sequence"])
-                all_movie_ids.append(s["target"])
-                all_movie_ids.extend(taste_items)
 
-    # Build vocab
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocess MovieLens ratings into training samples")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes used to parse ratings.csv")
+    parser.add_argument("--jsonl", action="store_true", help="also write the legacy train.jsonl")
+    parser.add_argument("--holdout", action="store_true",
+                        help="hold out each user's newest item for ml/evaluate.py")
+    parser.add_argument("--shards", type=int, default=NUM_SHARDS,
+                        help="user shards grouped one at a time (more = less memory)")
+    args = parser.parse_args()
+
+    print(f"Loading ratings from {RAW_RATINGS_PATH} ({args.workers} workers) ...")
+    shutil.rmtree(SPILL_DIR, ignore_errors=True)
+    n_positive = spill_positive_ratings(RAW_RATINGS_PATH, SPILL_DIR, args.shards, args.workers, RANGE_BYTES)
+    print(f"Positive ratings: {n_positive}")
+
+    # the vocab covers held-out items too, so they can be ranked
+    user_ids, user_offsets, items, holdout_targets, unique_ids, dropped = pack_shards(SPILL_DIR, args.shards, args.holdout)
+    print(f"Total users after filtering: {len(user_ids)}")
+    if args.holdout:
+        print(f"Held out the newest item of {len(holdout_targets)} users")
+
+    # Vocab from the unique movie ids; the packed format stores vocab indices
     print("Building vocab...")
-    vocab = build_vocab(all_movie_ids)
+    vocab = build_vocab(unique_ids.tolist())
+
+    PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
+
+    meta = save_user_sequences(
+        PACKED_DIR, items, user_offsets, user_ids, MAX_SEQ_LEN, vocab["pad_index"], holdout_targets
+    )
+    save_pending(PACKED_DIR, *dropped)
+    print(f"Saved {meta['num_samples']} training samples to: {PACKED_DIR}")
+
+    if args.jsonl:
+        write_legacy_jsonl(TRAIN_JSONL_PATH, user_ids, user_offsets, items, np.r_[0, unique_ids], MAX_SEQ_LEN)
+        print(f"Saved training data to: {TRAIN_JSONL_PATH}")
+    del items
+    shutil.rmtree(SPILL_DIR)
 
     with VOCAB_PATH.open("w", encoding="utf-8") as f_vocab:
         json.dump(vocab, f_vocab)
 
-    print(f"Saved training data to: {TRAIN_JSONL_PATH}")
     print(f"Saved vocab to: {VOCAB_PATH}")
 
 
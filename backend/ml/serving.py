@@ -0,0 +1,138 @@
+# backend/ml/serving.py
+
+"""
+What the model-backed routers need (model, catalog metadata, neighbour
+table), loaded in a background thread once the app has started, so the
+process answers /, /auth and /health within moments of starting instead
+of after torch, pandas and the checkpoint are in memory.
+
+Nothing heavy is imported at module level here; the routers import
+ml.inference & co. inside their handlers, after `model()` has succeeded.
+"""
+
+import threading
+import time
+from typing import Dict
+
+
+# ---------------------------------------------------------
+# STATE
+# ---------------------------------------------------------
+# pending -> loading -> ready | failed, in this order
+COMPONENTS = ("model", "catalog", "neighbors")
+REQUIRED = ("model", "catalog")   # /health/ready is 200 once these are ready
+
+_status = {name: "pending" for name in COMPONENTS}
+_errors: Dict[str, str] = {}
+_seconds: Dict[str, float] = {}
+_values = {}
+_thread = None
+
+
+class NotReady(Exception):
+    """A model-backed endpoint was called before its component loaded (main.py answers 503)."""
+
+    def __init__(self, component: str):
+        self.component = component
+        self.status = _status[component]
+        super().__init__(f"{component} is {self.status}")
+
+
+# ---------------------------------------------------------
+# LOADERS (run in order on the loader thread)
+# ---------------------------------------------------------
+def _load_model():
+    from ml.inference import get_model
+    return get_model()
+
+
+def _load_catalog():
+    from ml.item_metadata import load_item_metadata
+    from utils.data_loader import load_movie_titles
+
+    model, vocab, device = _values["model"]
+    load_movie_titles()   # title lookups for /movies and /interactions
+    return load_item_metadata(vocab, device)
+
+
+def _load_neighbors():
+    # optional: /similar scans live until the table is there
+    from ml.neighbors import get_neighbor_table
+    return get_neighbor_table()
+
+
+LOADERS = (("model", _load_model), ("catalog", _load_catalog), ("neighbors", _load_neighbors))
+
+
+def load_all():
+    for name, loader in LOADERS:
+        if name != "model" and _status["model"] != "ready":
+            _status[name] = "failed"
+            _errors[name] = "model not loaded"
+            continue
+
+        _status[name] = "loading"
+        t0 = time.time()
+        try:
+            _values[name] = loader()
+            _status[name] = "ready"
+        except Exception as e:
+            _status[name] = "failed"
+            _errors[name] = f"{type(e).__name__}: {e}"
+            print(f"Failed to load {name}: {e}")
+        _seconds[name] = round(time.time() - t0, 2)
+
+
+def start_background_load():
+    """Start loading on a daemon thread (once per process); returns immediately."""
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=load_all, name="serving-loader", daemon=True)
+        _thread.start()
+
+
+# ---------------------------------------------------------
+# ACCESS
+# ---------------------------------------------------------
+def is_ready(component: str) -> bool:
+    return _status[component] == "ready"
+
+
+def model():
+    """(model, vocab, device), or NotReady while loading."""
+    if not is_ready("model"):
+        raise NotReady("model")
+    return _values["model"]
+
+
+def catalog():
+    """ItemMetadata aligned to the vocab, or NotReady while loading."""
+    if not is_ready("catalog"):
+        raise NotReady("catalog")
+    return _values["catalog"]
+
+
+def neighbors():
+    """The neighbour table, or None (not loaded / not built) so /similar computes live."""
+    if not is_ready("neighbors"):
+        return None
+    from ml.neighbors import get_neighbor_table
+    return get_neighbor_table()   # picks up a table built by the CLI after startup
+
+
+def status() -> Dict[str, Dict]:
+    out = {
+        name: {
+            "status": _status[name],
+            **({"seconds": _seconds[name]} if name in _seconds else {}),
+            **({"error": _errors[name]} if name in _errors else {}),
+        }
+        for name in COMPONENTS
+    }
+    if is_ready("neighbors"):
+        out["neighbors"]["table"] = neighbors() is not None   # False: /similar is live
+    return out
+
+
+def ready() -> bool:
+    return all(is_ready(name) for name in REQUIRED)
@@ -1,209 +1,669 @@
+import argparse
+import contextlib
 import json
-from pathlib import Path
+import os
 import random
-from typing import Dict, List
+import time
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Optional
 
+import numpy as np
 import torch
+import torch.distributed as dist
 import torch.nn.functional as F
+from torch.nn.parallel import DistributedDataParallel
 from torch.utils.data import DataLoader
 
-from ml.dataset import MovieLensDataset
+from ml.checkpoint import (
+    AsyncCheckpointer,
+    capture_rng_state,
+    latest_step_checkpoint,
+    load_step_checkpoint,
+    restore_rng_state,
+)
+from ml.dataset import MovieLensDataset, MovieLensPackedDataset, ResumableSampler
+from ml.inference import load_model, select_top_k
 from ml.model import TransformerRecModel
+from ml.vocab import Vocab, vocab_path_for
 
 
 # -----------------------------
 # Config
 # -----------------------------
 MAX_SEQ_LEN = 50
+MAX_TASTE_LEN = 256     # taste items sampled per training sample (None = all), bounds the [B, T, D] gather
 BATCH_SIZE = 128  # Reduced from 256 to prevent MPS OOM
 NUM_EPOCHS = 3
-NUM_NEGATIVES = 20      # negatives per positive
+USE_MLP_SCORER = False  # MLP ranking head instead of dot product (served retrieve-then-rerank)
+NUM_NEGATIVES = 20      # negatives per positive (shared per batch for sampled_softmax)
+NEG_SAMPLING = "uniform"  # "uniform" | "in_batch" | "sampled_softmax"
+POP_ALPHA = 0.75        # sampled_softmax draws negatives ∝ count^alpha
 LR = 1e-3
+WARMUP_STEPS = 0        # linear LR warmup over this many optimizer steps (0 = constant LR)
+SEED = 42
+NUM_WORKERS = min(4, os.cpu_count() or 1)   # 0 = load batches on the training thread
+PREFETCH_FACTOR = 4     # batches prefetched per worker
+LOG_EVERY = 100         # steps between progress lines
+
+# Fast mode (opt-in, `python -m ml.train --fast`): bf16 autocast on CPU/CUDA
+# and fused (else foreach) Adam. --compile and --accum-steps stack on top.
+AMP_DTYPE = torch.bfloat16
+GRAD_ACCUM_STEPS = 1    # micro-batches per optimizer step (effective batch = BATCH_SIZE * this)
+
+# Distributed (CPU, gloo): torchrun --nproc_per_node N -m ml.train
+# BATCH_SIZE is per process; the global batch is BATCH_SIZE * world size.
+DIST_BACKEND = os.getenv("DIST_BACKEND", "gloo")
+
+NEG_SAMPLING_MODES = ("uniform", "in_batch", "sampled_softmax")
 
 DATA_DIR = Path(__file__).parent.parent.parent / "data"
 TRAIN_JSONL_PATH = DATA_DIR / "movielens_processed" / "train.jsonl"
+PACKED_DIR = DATA_DIR / "movielens_processed" / "packed"
 VOCAB_PATH = DATA_DIR / "vocab.json"
 CHECKPOINT_DIR = Path(__file__).parent.parent.parent / "model_checkpoints"
 CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
 
+# Step checkpoints (full training state, for resuming); epoch checkpoints
+# above stay the weights + vocab files that inference loads
+STEP_CKPT_DIR = CHECKPOINT_DIR / "steps"
+CKPT_EVERY_STEPS = 1000   # batches between step checkpoints (0 = off)
+KEEP_STEP_CKPTS = 3
+
+# Distillation (`python -m ml.train --distill-from <teacher.pt>`): a smaller
+# student learns the teacher's top-K ranking; saved as student_epochN.pt
+STUDENT_CONFIG = {"d_model": 64, "n_heads": 2, "n_layers": 1}
+DISTILL_TOP_K = 50          # teacher items per sample the student's softmax is matched on
+DISTILL_TEMPERATURE = 2.0
+DISTILL_ALPHA = 0.2         # weight of the usual next-item loss; the rest is the KL to the teacher
+STUDENT_STEP_CKPT_DIR = CHECKPOINT_DIR / "steps_student"
+
 
 # -----------------------------
 # Collate function factory
 # -----------------------------
-def make_collate_fn(pad_idx: int, num_items: int, num_negatives: int):
+def make_collate_fn(
+    pad_idx: int,
+    num_items: int,
+    num_negatives: int,
+    neg_sampling: str = "uniform",
+    sampling_probs: Optional[torch.Tensor] = None,
+):
     """
     Returns a collate_fn that:
     - stacks sequences and masks
     - pads taste lists
-    - builds candidate_items with 1 positive + sampled negatives
+    - builds candidate_items for the chosen negative sampling mode:
+        uniform:         [B, 1 + num_negatives], positive first, negatives
+                         drawn uniformly per row
+        in_batch:        [B] — the batch's own targets, shared by every row
+        sampled_softmax: [B + num_negatives] — the batch's targets plus
+                         negatives drawn from `sampling_probs`, shared by every row
     """
+    if neg_sampling not in NEG_SAMPLING_MODES:
+        raise ValueError(f"neg_sampling must be one of {NEG_SAMPLING_MODES}")
+    if neg_sampling == "sampled_softmax" and sampling_probs is None:
+        raise ValueError("sampled_softmax needs sampling_probs")
+
+    # a partial of a module-level function (not a closure) so it pickles
+    # into DataLoader workers under the spawn start method (macOS default)
+    return partial(
+        collate_batch,
+        pad_idx=pad_idx,
+        num_items=num_items,
+        num_negatives=num_negatives,
+        neg_sampling=neg_sampling,
+        sampling_probs=sampling_probs,
+    )
 
-    def collate_fn(batch: List[Dict]):
-        # sequences and masks
-        sequences = torch.stack([b["sequence"] for b in batch], dim=0)        # [B, L]
-        attention_masks = torch.stack([b["attention_mask"] for b in batch], dim=0)  # [B, L]
-
-        # targets: [B]
-        targets = torch.stack([b["target"] for b in batch], dim=0)            # [B]
-
-        # taste: variable lengths → pad
-        tastes = [b["taste"] for b in batch]
-        max_taste_len = max((t.size(0) for t in tastes), default=1)
-        padded_tastes = []
-        for t in tastes:
-            if t.size(0) < max_taste_len:
-                pad = torch.full((max_taste_len - t.size(0),), pad_idx, dtype=torch.long)
-                padded_tastes.append(torch.cat([t, pad], dim=0))
-            else:
-                padded_tastes.append(t)
-        taste_tensor = torch.stack(padded_tastes, dim=0)   # [B, T]
-
-        # candidate_items: first column = positive target, rest = negatives
-        B = targets.size(0)
-        K = num_negatives + 1
 
+def collate_batch(
+    batch: List[Dict],
+    pad_idx: int,
+    num_items: int,
+    num_negatives: int,
+    neg_sampling: str,
+    sampling_probs: Optional[torch.Tensor],
+):
+    # sequences and masks
+    sequences = torch.stack([b["sequence"] for b in batch], dim=0)        # [B, L]
+    attention_masks = torch.stack([b["attention_mask"] for b in batch], dim=0)  # [B, L]
+
+    # targets: [B]
+    targets = torch.stack([b["target"] for b in batch], dim=0)            # [B]
+
+    # taste: variable lengths → pad
+    tastes = [b["taste"] for b in batch]
+    max_taste_len = max((t.size(0) for t in tastes), default=1)
+    padded_tastes = []
+    for t in tastes:
+        if t.size(0) < max_taste_len:
+            pad = torch.full((max_taste_len - t.size(0),), pad_idx, dtype=torch.long)
+            padded_tastes.append(torch.cat([t, pad], dim=0))
+        else:
+            padded_tastes.append(t)
+    taste_tensor = torch.stack(padded_tastes, dim=0)   # [B, T]
+
+    B = targets.size(0)
+
+    if neg_sampling == "uniform":
         # sample negatives uniformly from [1, num_items-1]
-        negs = torch.randint(
-            low=1,
-            high=num_items,
-            size=(B, num_negatives),
-            dtype=torch.long,
-        )
+        negs = torch.randint(1, num_items, (B, num_negatives), dtype=torch.long)
 
-        # ensure negatives ≠ target (simple resample where equal)
-        for i in range(B):
-            for j in range(num_negatives):
-                if negs[i, j].item() == targets[i].item():
-                    # resample
-                    new_val = random.randint(1, num_items - 1)
-                    while new_val == targets[i].item():
-                        new_val = random.randint(1, num_items - 1)
-                    negs[i, j] = new_val
+        # resample collisions with the target, all at once
+        collide = negs == targets.unsqueeze(1)
+        while collide.any():
+            negs[collide] = torch.randint(1, num_items, (int(collide.sum()),), dtype=torch.long)
+            collide = negs == targets.unsqueeze(1)
 
         # concat: [B, 1 + num_negatives]
-        candidate_items = torch.cat(
-            [targets.unsqueeze(1), negs],
-            dim=1
-        )
+        candidate_items = torch.cat([targets.unsqueeze(1), negs], dim=1)
+
+    elif neg_sampling == "in_batch":
+        candidate_items = targets                                          # [B]
+
+    else:  # sampled_softmax
+        negs = torch.multinomial(sampling_probs, num_negatives, replacement=True)
+        candidate_items = torch.cat([targets, negs], dim=0)                # [B + M]
+
+    batch_out = {
+        "sequence": sequences,
+        "attention_mask": attention_masks,
+        "taste": taste_tensor,
+        "target": targets,
+        "candidate_items": candidate_items,
+    }
+    return batch_out
+
+
+def popularity_sampling_probs(target_counts: torch.Tensor, alpha: float = POP_ALPHA) -> torch.Tensor:
+    """Sampling distribution ∝ (count + 1)^alpha over items 1..N-1 (padding gets 0)."""
+    probs = (target_counts.double() + 1.0).pow(alpha)
+    probs[0] = 0.0
+    return (probs / probs.sum()).float()
+
+
+def compute_loss(scores, candidate_items, targets, log_q=None):
+    """
+    Cross-entropy over the candidates.
+
+    Per-row candidates [B, K]: the positive is column 0.
+    Shared candidates [K]: row b's positive is column b. Other columns that
+    happen to hold row b's target (accidental hits) are masked out, and when
+    `log_q` is given the logits are corrected by the log sampling probability
+    so popular items are not over-penalized as negatives.
+    """
+    B = scores.size(0)
 
-        batch_out = {
-            "sequence": sequences,
-            "attention_mask": attention_masks,
-            "taste": taste_tensor,
-            "target": targets,
-            "candidate_items": candidate_items,
-        }
-        return batch_out
+    if candidate_items.dim() == 2:
+        labels = torch.zeros(B, dtype=torch.long, device=scores.device)
+        return F.cross_entropy(scores, labels)
 
-    return collate_fn
+    labels = torch.arange(B, device=scores.device)
+
+    if log_q is not None:
+        scores = scores - log_q[candidate_items].unsqueeze(0)
+
+    accidental = candidate_items.unsqueeze(0) == targets.unsqueeze(1)   # [B, K]
+    accidental[labels, labels] = False
+    scores = scores.masked_fill(accidental, float("-inf"))
+
+    return F.cross_entropy(scores, labels)
 
 
 # -----------------------------
-# Training loop
+# Reproducibility
+# -----------------------------
+def seed_everything(seed: int):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def seed_worker(worker_id: int):
+    """
+    DataLoader worker_init_fn. torch seeds each worker with base_seed +
+    worker_id, where base_seed comes from the loader's generator; derive
+    numpy/random from it so negative sampling replays exactly.
+    """
+    worker_seed = torch.initial_seed() % 2**32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+
+
+def make_dataloader(dataset, collate_fn, device, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, seed=SEED, sampler=None):
+    """With a (distributed) sampler, the sampler owns the shuffle order."""
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+
+    kwargs = {}
+    if num_workers > 0:
+        kwargs["persistent_workers"] = True
+        kwargs["prefetch_factor"] = PREFETCH_FACTOR
+
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=sampler is None,
+        sampler=sampler,
+        collate_fn=collate_fn,
+        num_workers=num_workers,
+        pin_memory=device.type == "cuda",   # only helps host→CUDA copies
+        worker_init_fn=seed_worker,
+        generator=generator,
+        **kwargs,
+    )
+
+
+# -----------------------------
+# Distributed setup
 # -----------------------------
-def train():
-    # Device
+def setup_distributed():
+    """
+    Join the process group when launched by torchrun (WORLD_SIZE > 1).
+    Returns (rank, world_size). Single-process runs return (0, 1) and
+    don't touch torch.distributed.
+    """
+    world_size = int(os.getenv("WORLD_SIZE", "1"))
+    if world_size <= 1:
+        return 0, 1
+
+    dist.init_process_group(backend=DIST_BACKEND)
+
+    # split this host's cores between its processes instead of oversubscribing
+    local_world_size = int(os.getenv("LOCAL_WORLD_SIZE", str(world_size)))
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+    return dist.get_rank(), world_size
+
+
+def is_main_process() -> bool:
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+
+def log(msg: str):
+    """print on rank 0 only."""
+    if is_main_process():
+        print(msg)
+
+
+# -----------------------------
+# Step building blocks (shared with ml/bench_train.py)
+# -----------------------------
+def get_device() -> torch.device:
     if torch.backends.mps.is_available():
-        device = torch.device("mps")
-    elif torch.cuda.is_available():
-        device = torch.device("cuda")
-    else:
-        device = torch.device("cpu")
-    print(f"Using device: {device}")
+        return torch.device("mps")
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    return torch.device("cpu")
+
+
+def make_scheduler(optimizer):
+    """Linear warmup to LR over WARMUP_STEPS optimizer steps; None when disabled."""
+    if WARMUP_STEPS <= 0:
+        return None
+    return torch.optim.lr_scheduler.LambdaLR(
+        optimizer, lambda step: min(1.0, (step + 1) / WARMUP_STEPS)
+    )
+
+
+def make_optimizer(model, device, fast: bool = False, lr: float = LR):
+    """Plain Adam, or with --fast the fused kernel (one op for all params), else foreach."""
+    if not fast:
+        return torch.optim.Adam(model.parameters(), lr=lr)
+    try:
+        return torch.optim.Adam(model.parameters(), lr=lr, fused=True)
+    except (RuntimeError, TypeError):
+        # fused Adam not available for this device/build
+        return torch.optim.Adam(model.parameters(), lr=lr, foreach=True)
+
+
+def autocast_context(device, enabled: bool):
+    """bf16 autocast where it is supported (CPU, CUDA); a no-op otherwise."""
+    if enabled and device.type in ("cpu", "cuda"):
+        return torch.autocast(device_type=device.type, dtype=AMP_DTYPE)
+    return contextlib.nullcontext()
+
+
+def train_step(model, batch, device, log_q=None, amp: bool = False, loss_scale: float = 1.0, teacher=None):
+    """
+    Forward + backward for one (micro-)batch. Gradients accumulate in the
+    parameters; the caller decides when to step the optimizer.
+    With a teacher, the loss also matches the teacher's top-K (distillation).
+    Returns the unscaled loss.
+    """
+    non_blocking = device.type == "cuda"
+    sequence = batch["sequence"].to(device, non_blocking=non_blocking)          # [B, L]
+    attention_mask = batch["attention_mask"].to(device, non_blocking=non_blocking)  # [B, L]
+    taste = batch["taste"].to(device, non_blocking=non_blocking)                # [B, T]
+    candidate_items = batch["candidate_items"].to(device, non_blocking=non_blocking)  # [B, K] or [K]
+    targets = batch["target"].to(device, non_blocking=non_blocking)             # [B]
+
+    if teacher is not None:
+        loss = distill_loss(model, teacher, sequence, attention_mask, taste, candidate_items, targets, log_q, amp)
+        (loss * loss_scale).backward()
+        return loss
+
+    with autocast_context(device, amp):
+        # Forward: scores for each candidate
+        scores = model(
+            sequence=sequence,
+            attention_mask=attention_mask,
+            taste=taste,
+            candidate_items=candidate_items,
+        )  # [B, K]
+
+    # loss in fp32 even when the forward ran in bf16
+    loss = compute_loss(scores.float(), candidate_items, targets, log_q)
+    (loss * loss_scale).backward()
+    return loss
+
+
+def distill_loss(student, teacher, sequence, attention_mask, taste, candidate_items, targets, log_q=None, amp: bool = False):
+    """
+    DISTILL_ALPHA * next-item loss + (1 - DISTILL_ALPHA) * T^2 * KL between
+    the teacher's and the student's softmax over the teacher's top
+    DISTILL_TOP_K items (found over the full catalogue, MLP teachers via
+    their retrieve-then-rerank path) plus the usual sampled candidates,
+    which stand in for the rest of the catalogue: without them the student
+    only learns the order inside the top-K, not to rank it above the tail.
+    One student forward scores all of them.
+    """
+    B = sequence.size(0)
+    T = DISTILL_TEMPERATURE
+
+    # usual candidates ([K] shared or [B, K] per row) + the teacher's top [B, K_t]
+    hard = candidate_items if candidate_items.dim() == 2 else candidate_items.unsqueeze(0).expand(B, -1)
+
+    with torch.no_grad(), autocast_context(sequence.device, amp):
+        teacher_emb = teacher.encode_user(sequence, attention_mask, taste)          # [B, D_t]
+        item_idx = torch.arange(1, teacher.num_items, device=sequence.device)
+        full = teacher_emb @ teacher.item_embedding.weight[1:].T                    # [B, N]
+        top_scores, teacher_items = select_top_k(teacher, teacher_emb, full, item_idx, DISTILL_TOP_K)
+        if teacher.scorer is None:
+            hard_teacher = full.gather(1, hard - 1)                                 # column j is item j + 1
+        else:
+            hard_teacher = teacher.mlp_scores(teacher_emb, teacher.item_embedding(hard))
+        teacher_scores = torch.cat([hard_teacher, top_scores], dim=1).float()       # [B, K + K_t]
+
+    with autocast_context(sequence.device, amp):
+        student_scores = student(
+            sequence=sequence,
+            attention_mask=attention_mask,
+            taste=taste,
+            candidate_items=torch.cat([hard, teacher_items], dim=1),
+        ).float()                                                                     # [B, K + K_t]
+
+    hard_loss = compute_loss(student_scores[:, :hard.size(1)], candidate_items, targets, log_q)
+    kl = F.kl_div(
+        F.log_softmax(student_scores / T, dim=1),
+        F.log_softmax(teacher_scores / T, dim=1),
+        log_target=True,
+        reduction="batchmean",
+    )
+    return DISTILL_ALPHA * hard_loss + (1 - DISTILL_ALPHA) * T * T * kl
+
+
+# -----------------------------
+# Training loop
+# -----------------------------
+def model_config(pad_idx: int, num_items: int, student: bool = False) -> dict:
+    sizes = STUDENT_CONFIG if student else {"d_model": 128, "n_heads": 4, "n_layers": 2}
+    return {
+        **sizes,
+        "max_seq_len": MAX_SEQ_LEN,
+        "pad_idx": pad_idx,
+        "num_items": num_items,
+        "use_mlp_scorer": USE_MLP_SCORER,
+    }
+
+
+def train(
+    fast: bool = False,
+    compile_model: bool = False,
+    accum_steps: int = GRAD_ACCUM_STEPS,
+    resume: bool = True,
+    distill_from: Optional[Path] = None,
+):
+    rank, world_size = setup_distributed()
+    distributed = world_size > 1
+
+    # gloo all-reduces CPU tensors; distributed runs train on CPU
+    device = torch.device("cpu") if distributed else get_device()
+    log(f"Using device: {device}" + (f" x {world_size} processes ({DIST_BACKEND}, {torch.get_num_threads()} threads each)" if distributed else ""))
+    seed_everything(SEED)   # same init everywhere; DDP also broadcasts rank 0's weights
 
     # Load vocab
     vocab = json.loads(VOCAB_PATH.read_text())
-    movie_to_idx = vocab["movie_id_to_index"]
-    pad_idx = vocab["pad_index"]
-    num_items = max(movie_to_idx.values()) + 1  # since we started at 1
-
-    # Dataset + DataLoader
-    dataset = MovieLensDataset(
-        jsonl_path=str(TRAIN_JSONL_PATH),
-        vocab_path=str(VOCAB_PATH),
-        max_seq_len=MAX_SEQ_LEN,
-    )
+    vocab_arrays = Vocab.from_dict(vocab)   # saved next to each checkpoint for inference
+    pad_idx = vocab_arrays.pad_index
+    num_items = vocab_arrays.num_items  # since we started at 1
+
+    # Dataset + DataLoader (packed memmap format, JSONL as fallback)
+    if (PACKED_DIR / "meta.json").exists():
+        dataset = MovieLensPackedDataset(str(PACKED_DIR), max_seq_len=MAX_SEQ_LEN, max_taste_len=MAX_TASTE_LEN)
+    else:
+        dataset = MovieLensDataset(
+            jsonl_path=str(TRAIN_JSONL_PATH),
+            vocab_path=str(VOCAB_PATH),
+            max_seq_len=MAX_SEQ_LEN,
+            max_taste_len=MAX_TASTE_LEN,
+        )
+    log(f"Loaded {len(dataset)} samples ({type(dataset).__name__})")
+
+    sampling_probs = None
+    log_q = None
+    if NEG_SAMPLING == "sampled_softmax":
+        sampling_probs = popularity_sampling_probs(dataset.target_counts(num_items))
+        log_q = sampling_probs.clamp(min=1e-12).log().to(device)
 
     collate_fn = make_collate_fn(
         pad_idx=pad_idx,
         num_items=num_items,
         num_negatives=NUM_NEGATIVES,
+        neg_sampling=NEG_SAMPLING,
+        sampling_probs=sampling_probs,
     )
 
-    dataloader = DataLoader(
-        dataset,
-        batch_size=BATCH_SIZE,
-        shuffle=True,
-        collate_fn=collate_fn,
-        num_workers=0,    # bump later if needed
-    )
+    # Teacher (distillation only): frozen, never wrapped in DDP
+    teacher = None
+    if distill_from is not None:
+        teacher, _, _ = load_model(device, checkpoint_path=distill_from)
+        teacher.requires_grad_(False)
+        if teacher.num_items != num_items:
+            raise ValueError(f"{distill_from} has {teacher.num_items} items, the vocab has {num_items}")
+        log(f"Distilling from {distill_from} (top {DISTILL_TOP_K}, T={DISTILL_TEMPERATURE}, alpha={DISTILL_ALPHA})")
+    step_ckpt_dir = STEP_CKPT_DIR if teacher is None else STUDENT_STEP_CKPT_DIR
 
     # Model
+    config = model_config(pad_idx, num_items, student=teacher is not None)
     model = TransformerRecModel(
         num_items=num_items,
-        d_model=128,
-        n_heads=4,
-        n_layers=2,
+        d_model=config["d_model"],
+        n_heads=config["n_heads"],
+        n_layers=config["n_layers"],
         max_seq_len=MAX_SEQ_LEN,
         pad_idx=pad_idx,
+        use_mlp_scorer=config["use_mlp_scorer"],
     ).to(device)
 
-    optimizer = torch.optim.Adam(model.parameters(), lr=LR)
+    optimizer = make_optimizer(model, device, fast)
+    scheduler = make_scheduler(optimizer)
+
+    # Resume from the newest step checkpoint (every rank reads the same file)
+    start_epoch, start_batch, global_step, total_loss = 1, 0, 0, 0.0
+    resume_path = latest_step_checkpoint(step_ckpt_dir) if resume else None
+    if resume_path is not None:
+        state = load_step_checkpoint(resume_path)
+        if state["config"] != config:
+            raise ValueError(f"{resume_path} was trained with {state['config']}, not {config}")
+        model.load_state_dict(state["model_state_dict"])
+        optimizer.load_state_dict(state["optimizer_state_dict"])
+        if scheduler is not None and state["scheduler_state_dict"] is not None:
+            scheduler.load_state_dict(state["scheduler_state_dict"])
+        restore_rng_state(state["rng"])
+        start_epoch, start_batch = state["epoch"], state["batch_in_epoch"]
+        global_step, total_loss = state["global_step"], state["total_loss"]
+        log(f"Resumed from {resume_path}: epoch {start_epoch}, batch {start_batch}, step {global_step}")
+
+    # each rank gets a disjoint 1/world_size shard, reshuffled every epoch;
+    # the order depends only on (SEED, epoch) so a resume can skip ahead
+    sampler = ResumableSampler(dataset, num_replicas=world_size, rank=rank, seed=SEED)
+    # offset the loader seed so ranks draw different negatives (and a resumed
+    # run doesn't replay the negatives of the steps it already trained on)
+    dataloader = make_dataloader(dataset, collate_fn, device, seed=SEED + rank + global_step, sampler=sampler)
+    log(f"DataLoader: {NUM_WORKERS} workers, prefetch {PREFETCH_FACTOR}")
+
+    checkpointer = AsyncCheckpointer(step_ckpt_dir, keep_last=KEEP_STEP_CKPTS) if is_main_process() and CKPT_EVERY_STEPS > 0 else None
+
+    # DDP all-reduces gradients during backward; compile the wrapper, but
+    # always save/load the plain module's state_dict
+    ddp_model = DistributedDataParallel(model) if distributed else None
+    step_model = ddp_model or model
+    if compile_model:
+        step_model = torch.compile(step_model, dynamic=True)
+    if fast or compile_model or accum_steps > 1:
+        log(
+            f"Fast mode: amp={'bf16' if fast and device.type in ('cpu', 'cuda') else 'off'}, "
+            f"optimizer={'fused/foreach' if fast else 'default'}, compile={compile_model}, "
+            f"accum_steps={accum_steps} (effective batch {BATCH_SIZE * accum_steps * world_size})"
+        )
 
-    global_step = 0
+    last_ckpt_step = global_step
 
     model.train()
-    for epoch in range(1, NUM_EPOCHS + 1):
-        total_loss = 0.0
+    for epoch in range(start_epoch, NUM_EPOCHS + 1):
+        sampler.set_epoch(epoch)
+        batch_in_epoch = start_batch if epoch == start_epoch else 0
+        sampler.set_start_index(batch_in_epoch * BATCH_SIZE)
+        # micro-batches since the last optimizer step; restarts every epoch (and
+        # a resume always starts on a step boundary), so accumulation windows
+        # don't drift out of phase after a partial epoch-end step
+        micro_step = 0
+        data_time = 0.0      # waiting on the DataLoader
+        compute_time = 0.0   # forward + backward + step
+        t_ready = time.perf_counter()
         for batch in dataloader:
-            sequence = batch["sequence"].to(device)          # [B, L]
-            attention_mask = batch["attention_mask"].to(device)  # [B, L]
-            taste = batch["taste"].to(device)                # [B, T]
-            candidate_items = batch["candidate_items"].to(device)  # [B, K]
-
-            # Forward: scores for each candidate
-            scores = model(
-                sequence=sequence,
-                attention_mask=attention_mask,
-                taste=taste,
-                candidate_items=candidate_items,
-            )  # [B, K]
-
-            # Labels: index 0 is always the positive (true) item
-            labels = torch.zeros(scores.size(0), dtype=torch.long, device=device)
-
-            loss = F.cross_entropy(scores, labels)
-
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
+            t_batch = time.perf_counter()
+            data_time += t_batch - t_ready
 
-            total_loss += loss.item()
             global_step += 1
-
-            if global_step % 100 == 0:
+            batch_in_epoch += 1
+            micro_step += 1
+            sync_step = micro_step == accum_steps
+
+            # skip the gradient all-reduce on micro-batches that don't step
+            no_sync = ddp_model.no_sync() if ddp_model is not None and not sync_step else contextlib.nullcontext()
+            with no_sync:
+                loss = train_step(step_model, batch, device, log_q, amp=fast, loss_scale=1.0 / accum_steps, teacher=teacher)
+
+            if sync_step:
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+                if scheduler is not None:
+                    scheduler.step()
+                micro_step = 0
+
+            total_loss += loss.item()   # syncs the device, so compute_time is real
+
+            # step checkpoint, only on an optimizer-step boundary (no half-accumulated grads)
+            if checkpointer is not None and sync_step and global_step - last_ckpt_step >= CKPT_EVERY_STEPS:
+                checkpointer.save(
+                    {
+                        "model_state_dict": model.state_dict(),
+                        "optimizer_state_dict": optimizer.state_dict(),
+                        "scheduler_state_dict": scheduler.state_dict() if scheduler is not None else None,
+                        "rng": capture_rng_state(),
+                        "epoch": epoch,
+                        "batch_in_epoch": batch_in_epoch,
+                        "global_step": global_step,
+                        "total_loss": total_loss,
+                        "vocab_path": str(VOCAB_PATH),   # referenced, not embedded
+                        "config": config,
+                        "train_args": {
+                            "batch_size": BATCH_SIZE,
+                            "accum_steps": accum_steps,
+                            "world_size": world_size,
+                            "neg_sampling": NEG_SAMPLING,
+                            "max_taste_len": MAX_TASTE_LEN,
+                            "fast": fast,
+                            "distill_from": str(distill_from) if distill_from else None,
+                        },
+                    },
+                    global_step,
+                )
+                last_ckpt_step = global_step
+
+            t_ready = time.perf_counter()
+            compute_time += t_ready - t_batch
+
+            if global_step % LOG_EVERY == 0:
                 avg_loss = total_loss / global_step
-                print(f"Epoch {epoch} | Step {global_step} | Loss: {loss.item():.4f} | Avg: {avg_loss:.4f}")
-
-        # Save checkpoint after each epoch
-        ckpt_path = CHECKPOINT_DIR / f"transformer_epoch{epoch}.pt"
+                data_share = data_time / max(data_time + compute_time, 1e-9)
+                log(
+                    f"Epoch {epoch} | Step {global_step} | Loss: {loss.item():.4f} | Avg: {avg_loss:.4f} | "
+                    f"data {data_time * 1000 / LOG_EVERY:.1f}ms/step, "
+                    f"compute {compute_time * 1000 / LOG_EVERY:.1f}ms/step "
+                    f"({data_share:.0%} waiting on data)"
+                )
+                data_time = compute_time = 0.0
+
+        # don't carry a partial accumulation into the next epoch
+        # (gradients from no_sync micro-batches are still local; reduce them).
+        # Each micro-batch was scaled by 1/accum_steps: rescale the
+        # micro_step of them to a mean, like a full step
+        if micro_step > 0:
+            for p in model.parameters():
+                if p.grad is not None:
+                    if distributed:
+                        dist.all_reduce(p.grad)
+                        p.grad /= world_size
+                    p.grad *= accum_steps / micro_step
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+            if scheduler is not None:
+                scheduler.step()
+            micro_step = 0
+
+        # Save checkpoint after each epoch (rank 0 writes, the others wait)
+        if not is_main_process():
+            dist.barrier()
+            continue
+        ckpt_path = CHECKPOINT_DIR / f"{'student' if teacher is not None else 'transformer'}_epoch{epoch}.pt"
         torch.save(
             {
                 "model_state_dict": model.state_dict(),
                 "vocab": vocab,
-                "config": {
-                    "d_model": 128,
-                    "n_heads": 4,
-                    "n_layers": 2,
-                    "max_seq_len": MAX_SEQ_LEN,
-                    "pad_idx": pad_idx,
-                    "num_items": num_items,
-                },
+                "config": config,
+                **({"distilled_from": str(distill_from)} if teacher is not None else {}),
             },
             ckpt_path
         )
+        vocab_arrays.save(vocab_path_for(ckpt_path))
         print(f"Saved checkpoint: {ckpt_path}")
+        if distributed:
+            dist.barrier()
+
+    if checkpointer is not None:
+        checkpointer.wait()
+    if distributed:
+        dist.destroy_process_group()
 
 
 if __name__ == "__main__":
-    train()
+    parser = argparse.ArgumentParser(description="Train the transformer recommender")
+    parser.add_argument("--fast", action="store_true", help="bf16 autocast + fused/foreach Adam")
+    parser.add_argument("--compile", action="store_true", help="torch.compile the model")
+    parser.add_argument("--accum-steps", type=int, default=GRAD_ACCUM_STEPS,
+                        help="micro-batches per optimizer step")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="ignore step checkpoints in model_checkpoints/steps and start fresh")
+    parser.add_argument("--distill-from", type=Path, default=None,
+                        help="train a STUDENT_CONFIG-sized model to match this checkpoint's top-K rankings")
+    args = parser.parse_args()
+    train(
+        fast=args.fast,
+        compile_model=args.compile,
+        accum_steps=args.accum_steps,
+        resume=not args.no_resume,
+        distill_from=args.distill_from,
+    )
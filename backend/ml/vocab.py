@@ -0,0 +1,127 @@
+# backend/ml/vocab.py
+
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+
+class Vocab:
+    """
+    Array-backed movie id <-> vocab index mapping.
+
+    index_to_id: dense int64 array, index_to_id[i] = movie id of index i
+                 (index pad_index holds -1)
+    forward mapping: sorted ids + np.searchsorted, so whole batches of ids
+                 convert in one vectorized call (no str() / dict lookups)
+
+    Indices need not be assigned in id order (ml/incremental.py appends new
+    movies at the end), so the sorted view keeps its own index column.
+    """
+
+    def __init__(self, index_to_id: np.ndarray, pad_index: int = 0):
+        self.index_to_id = np.asarray(index_to_id, dtype=np.int64)
+        self.pad_index = pad_index
+
+        real = np.flatnonzero(self.index_to_id >= 0)
+        order = np.argsort(self.index_to_id[real], kind="stable")
+        self.sorted_ids = self.index_to_id[real][order]
+        self.sorted_index = real[order]
+
+    # -----------------------------
+    # Construction / persistence
+    # -----------------------------
+    @classmethod
+    def from_dict(cls, vocab: Dict) -> "Vocab":
+        """From the JSON vocab (movie_id_to_index with string keys)."""
+        movie_to_idx = vocab["movie_id_to_index"]
+        pad_index = vocab.get("pad_index", 0)
+        num_items = max(movie_to_idx.values(), default=pad_index) + 1
+
+        index_to_id = np.full(num_items, -1, dtype=np.int64)
+        ids = np.fromiter((int(k) for k in movie_to_idx.keys()), dtype=np.int64, count=len(movie_to_idx))
+        idxs = np.fromiter(movie_to_idx.values(), dtype=np.int64, count=len(movie_to_idx))
+        index_to_id[idxs] = ids
+        return cls(index_to_id, pad_index)
+
+    @classmethod
+    def load(cls, path: Path) -> "Vocab":
+        data = np.load(path)
+        return cls(data["index_to_id"], int(data["pad_index"]))
+
+    def save(self, path: Path):
+        # np.savez appends .npz unless the name already ends with it
+        np.savez(path, index_to_id=self.index_to_id, pad_index=np.int64(self.pad_index))
+
+    def to_dict(self) -> Dict:
+        real = np.flatnonzero(self.index_to_id >= 0)
+        ids = self.index_to_id[real].tolist()
+        idxs = real.tolist()
+        return {
+            "movie_id_to_index": {str(m): i for m, i in zip(ids, idxs)},
+            "index_to_movie_id": {str(i): m for m, i in zip(ids, idxs)},
+            "pad_index": self.pad_index,
+        }
+
+    # -----------------------------
+    # Lookups
+    # -----------------------------
+    @property
+    def num_items(self) -> int:
+        """Embedding table size (max index + 1, including padding)."""
+        return len(self.index_to_id)
+
+    def __len__(self) -> int:
+        return len(self.sorted_ids)
+
+    def _positions(self, ids: np.ndarray):
+        pos = np.searchsorted(self.sorted_ids, ids)
+        pos = np.minimum(pos, max(len(self.sorted_ids) - 1, 0))
+        found = self.sorted_ids[pos] == ids if len(self.sorted_ids) else np.zeros(len(ids), dtype=bool)
+        return pos, found
+
+    def to_indices(self, movie_ids: Iterable, drop_unknown: bool = True) -> np.ndarray:
+        """
+        Movie ids (ints or numeric strings) -> int64 vocab indices.
+        Unknown ids are dropped, or mapped to pad_index with drop_unknown=False.
+        """
+        ids = _as_int_ids(movie_ids)
+        if len(ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        pos, found = self._positions(ids)
+        out = np.where(found, self.sorted_index[pos], self.pad_index)
+        return out[found] if drop_unknown else out
+
+    def to_ids(self, indices) -> np.ndarray:
+        """Vocab indices (array, tensor or list) -> int64 movie ids."""
+        return self.index_to_id[np.asarray(indices, dtype=np.int64)]
+
+    def index_of(self, movie_id) -> Optional[int]:
+        idx = self.to_indices([movie_id])
+        return int(idx[0]) if len(idx) else None
+
+    def __contains__(self, movie_id) -> bool:
+        return self.index_of(movie_id) is not None
+
+
+def _as_int_ids(movie_ids: Iterable) -> np.ndarray:
+    """Parse ids in one call; only fall back per item when some aren't numeric."""
+    if isinstance(movie_ids, np.ndarray) and movie_ids.dtype.kind in "iu":
+        return movie_ids.astype(np.int64, copy=False)
+    movie_ids = list(movie_ids)
+    try:
+        return np.asarray(movie_ids, dtype=np.int64)
+    except (TypeError, ValueError):
+        parsed = []
+        for m in movie_ids:
+            try:
+                parsed.append(int(m))
+            except (TypeError, ValueError):
+                parsed.append(-1)   # never matches a real id
+        return np.asarray(parsed, dtype=np.int64)
+
+
+def vocab_path_for(checkpoint_path: Path) -> Path:
+    """The binary vocab stored next to a checkpoint: transformer_epoch1.pt -> transformer_epoch1.vocab.npz"""
+    checkpoint_path = Path(checkpoint_path)
+    return checkpoint_path.with_name(checkpoint_path.stem + ".vocab.npz")
@@ -0,0 +1,75 @@
+# backend/tests/conftest.py
+#
+#   cd backend
+#   python -m pytest tests
+#
+# Everything runs on CPU against a tiny checkpoint written to a temp dir:
+# no trained model, data files, Postgres or Redis needed.
+
+import sys
+from pathlib import Path
+
+import pytest
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))   # imports are relative to backend/
+
+from ml.model import TransformerRecModel
+
+
+NUM_MOVIES = 60
+MOVIE_IDS = [10 * i + 1 for i in range(NUM_MOVIES)]   # movie ids != vocab indices
+GENRES = ["Drama", "Comedy", "Horror", "Sci-Fi"]
+CONFIG = {"d_model": 16, "n_heads": 2, "n_layers": 1, "max_seq_len": 50, "pad_idx": 0}
+
+
+def write_checkpoint(path: Path, use_mlp_scorer: bool = False, seed: int = 0) -> Path:
+    """A randomly initialized checkpoint in the train.py format."""
+    torch.manual_seed(seed)
+    config = {**CONFIG, "num_items": NUM_MOVIES + 1, "use_mlp_scorer": use_mlp_scorer}
+    model = TransformerRecModel(
+        num_items=config["num_items"],
+        d_model=config["d_model"],
+        n_heads=config["n_heads"],
+        n_layers=config["n_layers"],
+        max_seq_len=config["max_seq_len"],
+        pad_idx=config["pad_idx"],
+        use_mlp_scorer=use_mlp_scorer,
+    )
+    vocab = {
+        "movie_id_to_index": {str(m): i + 1 for i, m in enumerate(MOVIE_IDS)},
+        "index_to_movie_id": {str(i + 1): m for i, m in enumerate(MOVIE_IDS)},
+        "pad_index": 0,
+    }
+    torch.save({"model_state_dict": model.state_dict(), "vocab": vocab, "config": config}, path)
+    return path
+
+
+@pytest.fixture
+def checkpoint_path(tmp_path):
+    return write_checkpoint(tmp_path / "transformer_test.pt")
+
+
+@pytest.fixture
+def mlp_checkpoint_path(tmp_path):
+    return write_checkpoint(tmp_path / "transformer_mlp.pt", use_mlp_scorer=True)
+
+
+@pytest.fixture
+def loaded(checkpoint_path):
+    """(model, vocab, device) as the app serves it."""
+    from ml.inference import load_model
+    return load_model(torch.device("cpu"), checkpoint_path)
+
+
+@pytest.fixture
+def movies_csv(tmp_path):
+    """movies.csv for the checkpoint's movies; every third one has no year, the last has no genres."""
+    lines = ["movieId,title,genres"]
+    for i, movie_id in enumerate(MOVIE_IDS):
+        year = "" if i % 3 == 0 else f" ({1950 + i})"
+        genres = "(no genres listed)" if i == NUM_MOVIES - 1 else f"{GENRES[i % 4]}|{GENRES[(i + 1) % 4]}"
+        lines.append(f'{movie_id},"Film {movie_id}{year}",{genres}')
+    path = tmp_path / "movies.csv"
+    path.write_text("\n".join(lines) + "\n")
+    return path
@@ -0,0 +1,42 @@
+# backend/tests/test_batch.py
+
+import ml.inference as inference
+from api.batch import recommend_users
+from conftest import MOVIE_IDS
+
+
+def test_users_without_known_movies_fail_alone(loaded):
+    model, vocab, device = loaded
+    histories = {
+        "ok": [str(m) for m in MOVIE_IDS[:5]],
+        "unknown_only": ["999999", "888888"],
+        "empty": [],
+        "not_numeric": ["abc"],
+        "partly_unknown": [str(MOVIE_IDS[9]), "999999"],
+    }
+
+    results, failed = recommend_users(model, vocab, device, histories, top_k=5)
+
+    assert sorted(failed) == ["empty", "not_numeric", "unknown_only"]
+    assert sorted(results) == ["ok", "partly_unknown"]
+    assert all(len(recs) == 5 for recs in results.values())
+
+
+def test_failing_batch_is_retried_per_user(loaded, monkeypatch):
+    model, vocab, device = loaded
+    bad_movie = MOVIE_IDS[3]
+    real = inference.recommend_batch
+
+    def flaky(model, vocab, device, user_histories, top_k=20, **kwargs):
+        if any(str(bad_movie) in h for h in user_histories):
+            raise RuntimeError("bad history")
+        return real(model, vocab, device, user_histories, top_k=top_k, **kwargs)
+
+    monkeypatch.setattr(inference, "recommend_batch", flaky)
+    histories = {"a": [str(MOVIE_IDS[0])], "bad": [str(bad_movie)], "b": [str(MOVIE_IDS[1]), str(MOVIE_IDS[2])]}
+
+    results, failed = recommend_users(model, vocab, device, histories, top_k=3)
+
+    assert failed == ["bad"]
+    assert sorted(results) == ["a", "b"]
+    assert results["a"] == real(model, vocab, device, [histories["a"]], top_k=3)[0]
@@ -0,0 +1,162 @@
+# backend/tests/test_incremental.py
+
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import ml.incremental as incremental
+from ml.incremental import DB_USER_ID_OFFSET, merge_user_sequences, positive_db_events, update_packed
+from ml.preprocess import group_user_sequences, hold_out_last, save_user_sequences
+
+
+def events(seed, n, users, start_ts):
+    rng = np.random.default_rng(seed)
+    return (
+        rng.choice(users, n).astype(np.int32),
+        rng.integers(1, 40, n).astype(np.int32),
+        (start_ts + rng.permutation(n)).astype(np.int64),
+    )
+
+
+OLD = events(0, 300, np.arange(1, 30), 0)
+NEW = events(1, 120, np.r_[np.arange(1, 30, 3), [100, 101]], 10_000)   # newer; two new users
+
+
+def combined():
+    return tuple(np.r_[a, b] for a, b in zip(OLD, NEW))
+
+
+@pytest.mark.parametrize("holdout", [False, True])
+def test_merge_equals_preprocessing_everything(holdout):
+    user_ids, offsets, items = group_user_sequences(*OLD)
+    all_ids, all_offsets, all_items = group_user_sequences(*combined())
+    targets = all_targets = None
+    if holdout:
+        items, offsets, targets = hold_out_last(items, offsets)
+        all_items, all_offsets, all_targets = hold_out_last(all_items, all_offsets)
+
+    # only users preprocessing would keep (update_packed holds the rest in pending)
+    take = np.isin(NEW[0], all_ids)
+    merged_items, merged_offsets, merged_ids, old_len, merged_targets = merge_user_sequences(
+        items, offsets, user_ids, NEW[0][take], NEW[1][take], NEW[2][take], targets
+    )
+
+    assert merged_ids.tolist() == all_ids.tolist()
+    assert merged_offsets.tolist() == all_offsets.tolist()
+    assert merged_items.tolist() == all_items.tolist()
+    if holdout:
+        assert merged_targets.tolist() == all_targets.tolist()
+    assert old_len[np.isin(merged_ids, [100, 101])].tolist() == [0, 0]
+
+
+@pytest.fixture
+def packed(tmp_path, monkeypatch):
+    """A packed dir with OLD (movie ids used as vocab indices) and its vocab.json."""
+    user_ids, offsets, items = group_user_sequences(*OLD)
+    packed_dir = tmp_path / "packed"
+    save_user_sequences(packed_dir, items, offsets, user_ids, max_seq_len=5, pad_index=0)
+
+    vocab = {
+        "movie_id_to_index": {str(m): m for m in range(1, 40)},
+        "index_to_movie_id": {str(m): m for m in range(1, 40)},
+        "pad_index": 0,
+    }
+    vocab_path = tmp_path / "vocab.json"
+    vocab_path.write_text(json.dumps(vocab))
+    monkeypatch.setattr(incremental, "VOCAB_PATH", vocab_path)
+    return packed_dir, vocab_path
+
+
+def test_update_packed(packed):
+    packed_dir, vocab_path = packed
+    vocab = json.loads(vocab_path.read_text())
+    users = np.array([1, 1, 200, 201, 201, 201], dtype=np.int32)
+    movies = np.array([5, 777, 6, 7, 778, 9], dtype=np.int32)
+    new_samples, n_new = update_packed(packed_dir, vocab, users, movies, np.arange(10_000, 10_006), {"db_watermark": "x"})
+
+    assert n_new == 2
+    assert json.loads(vocab_path.read_text()) == vocab
+    assert vocab["movie_id_to_index"]["777"] == 40 and vocab["movie_id_to_index"]["778"] == 41
+
+    user_ids = np.load(packed_dir / "user_ids.npy")
+    assert 201 in user_ids and 200 not in user_ids   # 200 waits for MIN_HISTORY_LEN events
+    pending = np.load(packed_dir / "pending.npz")
+    assert pending["users"].tolist() == [200]
+    assert json.loads((packed_dir / incremental.STATE_FILE).read_text()) == {"db_watermark": "x"}
+    assert len(new_samples) > 0
+    assert not list(packed_dir.parent.glob("packed.*"))
+
+
+def test_crash_before_swap_leaves_consistent_data(packed, monkeypatch):
+    packed_dir, vocab_path = packed
+    old_items = np.load(packed_dir / "items.npy")
+    vocab = json.loads(vocab_path.read_text())
+
+    def crash(self, target):
+        raise OSError("killed")
+
+    monkeypatch.setattr(Path, "rename", crash)
+    with pytest.raises(OSError):
+        update_packed(packed_dir, vocab, np.array([1, 1], np.int32), np.array([5, 777], np.int32), np.array([10_000, 10_001]), {})
+
+    # the old packed data is untouched and still maps into the (grown) vocab
+    saved = json.loads(vocab_path.read_text())
+    assert "777" in saved["movie_id_to_index"]
+    assert np.array_equal(np.load(packed_dir / "items.npy"), old_items)
+    assert old_items.max() <= max(saved["movie_id_to_index"].values())
+
+
+def test_duplicates_are_merged_once(packed):
+    packed_dir, vocab_path = packed
+    vocab = json.loads(vocab_path.read_text())
+    user_ids, offsets = np.load(packed_dir / "user_ids.npy"), np.load(packed_dir / "user_offsets.npy")
+    stored = np.load(packed_dir / "items.npy")[offsets[0]:offsets[1]].tolist()
+    fresh = next(m for m in range(1, 40) if m not in stored)
+    user = int(user_ids[0])
+
+    users = np.full(4, user, dtype=np.int32)
+    movies = np.array([fresh, stored[0], fresh, 777], dtype=np.int32)   # a repeat, an old item, a new movie
+    update_packed(packed_dir, vocab, users, movies, np.array([10_000, 10_001, 10_002, 10_003]), {})
+
+    offsets = np.load(packed_dir / "user_offsets.npy")
+    items = np.load(packed_dir / "items.npy")[offsets[0]:offsets[1]].tolist()
+    assert items == stored + [fresh, vocab["movie_id_to_index"]["777"]]
+
+
+def row(event_id, event_type, watched_at=None, rating=None, movie_id=10, created_at=datetime(2024, 1, 2)):
+    return (event_id, 7, movie_id, event_type, rating, watched_at, created_at)
+
+
+def test_positive_db_events():
+    rows = [
+        row(1, "watched", watched_at=datetime(2024, 1, 1)),
+        row(2, "watched"),                                   # past watch: taste only
+        row(3, "rated", rating=4.5, movie_id=11),
+        row(4, "rated", rating=2.0, movie_id=12),
+        row(5, "watched", watched_at=datetime(2024, 1, 3), movie_id=13),   # seen last run
+    ]
+    users, movies, timestamps = positive_db_events(rows, seen_event_ids=[5])
+
+    assert users.tolist() == [7 + DB_USER_ID_OFFSET] * 2
+    assert movies.tolist() == [10, 11]
+    assert timestamps.tolist() == [int(datetime(2024, 1, 1).timestamp()), int(datetime(2024, 1, 2).timestamp())]
+
+
+def test_state_saved_when_nothing_to_merge(packed, monkeypatch):
+    packed_dir, _ = packed
+
+    async def no_positives(watermark, seen):
+        empty = np.empty(0, dtype=np.int32)
+        return empty, empty, np.empty(0, dtype=np.int64), "2024-01-02T00:00:00", [41, 42]
+
+    monkeypatch.setattr(incremental, "PACKED_DIR", packed_dir)
+    monkeypatch.setattr(incremental, "load_db_events", no_positives)
+    monkeypatch.setattr(sys, "argv", ["incremental", "--from-db"])
+    incremental.main()
+
+    state = incremental.load_state(packed_dir)
+    assert state["db_watermark"] == "2024-01-02T00:00:00" and state["db_seen_event_ids"] == [41, 42]
@@ -0,0 +1,191 @@
+# backend/tests/test_inference.py
+
+import os
+from pathlib import Path
+
+import torch
+
+from conftest import MOVIE_IDS
+from ml.inference import (
+    MAX_SEQ_LEN,
+    compute_user_embedding,
+    encode_users_batch,
+    length_bucket,
+    load_model,
+    recommend,
+    resolve_checkpoint,
+    recommend_batch,
+    select_top_k,
+    taste_aggregate,
+)
+
+
+ATOL = 1e-5
+
+
+def history(n, offset=0):
+    """n known movie ids, oldest first."""
+    return [MOVIE_IDS[(offset + 7 * i) % len(MOVIE_IDS)] for i in range(n)]
+
+
+# -----------------------------
+# Taste aggregate (cached vs uncached)
+# -----------------------------
+def test_taste_aggregate_matches_uncached_embedding(loaded):
+    model, vocab, device = loaded
+    h = history(MAX_SEQ_LEN + 1 + 40)
+    taste_ids = h[: -(MAX_SEQ_LEN + 1)]
+
+    taste_sum, count = taste_aggregate(model, vocab, device, taste_ids)
+    assert count == len(taste_ids)
+
+    cached = compute_user_embedding(model, vocab, device, h, taste_sum=taste_sum, taste_count=count)
+    uncached = compute_user_embedding(model, vocab, device, h)
+    torch.testing.assert_close(cached, uncached, atol=ATOL, rtol=0)
+
+
+def test_taste_aggregates_add_up(loaded):
+    model, vocab, device = loaded
+    a, b = history(30), history(25, offset=3) + ["999999"]   # unknown ids don't count
+
+    sum_a, n_a = taste_aggregate(model, vocab, device, a)
+    sum_b, n_b = taste_aggregate(model, vocab, device, b)
+    sum_ab, n_ab = taste_aggregate(model, vocab, device, a + b)
+
+    assert sum_ab.dtype == torch.float64
+    assert (n_a, n_b, n_ab) == (30, 25, 55)
+    torch.testing.assert_close(sum_a + sum_b, sum_ab)
+
+
+# -----------------------------
+# Unpadded and length-bucketed encoding
+# -----------------------------
+def test_unpadded_encoding_equals_padded(loaded):
+    model, vocab, device = loaded
+    pad = vocab.pad_index
+    seqs = [vocab.to_indices(history(n)).tolist() for n in (1, 5, 17, MAX_SEQ_LEN)]
+    taste = torch.tensor([vocab.to_indices(history(6, offset=9)).tolist() + [pad, pad]])
+
+    with torch.no_grad():
+        for seq in seqs:
+            padded = torch.tensor([[pad] * (MAX_SEQ_LEN - len(seq)) + seq])
+            mask = (padded != pad).long()
+            full = model.encode_user(padded, mask, taste=taste)
+            short = model.encode_user(torch.tensor([seq]), None, taste=taste)
+            torch.testing.assert_close(short, full, atol=ATOL, rtol=0)
+
+
+def test_length_bucket():
+    assert [length_bucket(n) for n in (1, 4, 5, 16, 17, 33, MAX_SEQ_LEN)] == [4, 4, 8, 16, 32, MAX_SEQ_LEN, MAX_SEQ_LEN]
+
+
+HISTORIES = [
+    history(1),
+    history(2, offset=1),
+    history(4, offset=2),            # bucket boundary
+    history(9, offset=3),
+    history(9, offset=4),            # same bucket, same length
+    history(33, offset=5),
+    history(MAX_SEQ_LEN + 1),        # full window, no taste
+    history(MAX_SEQ_LEN + 30, offset=6),   # window + taste
+    history(3) + ["999999", "x"],    # unknown ids dropped
+]
+
+
+def test_batch_encoding_equals_single(loaded):
+    model, vocab, device = loaded
+    batch = encode_users_batch(model, vocab, device, HISTORIES, batch_size=2)   # several chunks per bucket
+
+    assert batch.shape == (len(HISTORIES), model.d_model)
+    for i, h in enumerate(HISTORIES):
+        torch.testing.assert_close(batch[i], compute_user_embedding(model, vocab, device, h), atol=ATOL, rtol=0)
+
+
+def assert_same_recs(single, batch):
+    assert [r["movie_id"] for r in single] == [r["movie_id"] for r in batch]
+    torch.testing.assert_close(
+        torch.tensor([r["score"] for r in single]), torch.tensor([r["score"] for r in batch]), atol=1e-4, rtol=0
+    )
+
+
+def test_recommend_batch_equals_recommend(loaded):
+    model, vocab, device = loaded
+    for single_h, recs in zip(HISTORIES, recommend_batch(model, vocab, device, HISTORIES, top_k=10)):
+        assert_same_recs(recommend(model, vocab, device, single_h, top_k=10), recs)
+
+
+def test_recommend_batch_equals_recommend_mlp_scorer(mlp_checkpoint_path):
+    model, vocab, device = load_model(torch.device("cpu"), mlp_checkpoint_path)
+    assert model.scorer is not None
+    for single_h, recs in zip(HISTORIES, recommend_batch(model, vocab, device, HISTORIES, top_k=10)):
+        assert_same_recs(recommend(model, vocab, device, single_h, top_k=10), recs)
+
+
+# -----------------------------
+# MLP scorer: retrieve, then rerank
+# -----------------------------
+def test_rerank_over_whole_catalogue_is_the_full_mlp_ranking(mlp_checkpoint_path):
+    model, vocab, device = load_model(torch.device("cpu"), mlp_checkpoint_path)
+    user_emb = encode_users_batch(model, vocab, device, HISTORIES[:3])
+    item_idx = torch.arange(1, vocab.num_items)
+    item_emb = model.item_embedding(item_idx)
+    scores = user_emb @ item_emb.T
+
+    with torch.no_grad():
+        top_scores, top_idx = select_top_k(model, user_emb, scores, item_idx, 10, retrieval_k=len(item_idx))
+        full = model.mlp_scores(user_emb, item_emb)
+        expected_scores, expected_pos = torch.topk(full, 10, dim=1)
+
+    assert top_idx.tolist() == item_idx[expected_pos].tolist()
+    torch.testing.assert_close(top_scores, expected_scores)
+
+
+def test_rerank_keeps_filtered_items_out(mlp_checkpoint_path):
+    model, vocab, device = load_model(torch.device("cpu"), mlp_checkpoint_path)
+    user_emb = encode_users_batch(model, vocab, device, HISTORIES[:1])
+    item_idx = torch.arange(1, vocab.num_items)
+    scores = user_emb @ model.item_embedding(item_idx).T
+    scores[:, 5:] = float("-inf")   # only 5 items pass the filter
+
+    with torch.no_grad():
+        top_scores, top_idx = select_top_k(model, user_emb, scores, item_idx, 8, retrieval_k=3)
+
+    assert set(top_idx[0, :5].tolist()) == set(range(1, 6))
+    assert torch.isinf(top_scores[0, 5:]).all()
+
+
+# -----------------------------
+# Memory-mapped checkpoint
+# -----------------------------
+def test_mmap_load_equals_regular_load(checkpoint_path):
+    regular, vocab, device = load_model(torch.device("cpu"), checkpoint_path, mmap=False)
+    mapped, mapped_vocab, _ = load_model(torch.device("cpu"), checkpoint_path, mmap=True)
+
+    assert mapped_vocab.index_to_id.tolist() == vocab.index_to_id.tolist()
+    assert mapped.version == regular.version
+    for (name, a), (_, b) in zip(regular.state_dict().items(), mapped.state_dict().items()):
+        assert a.device == b.device, name
+        assert torch.equal(a, b), name
+    assert not any(p.requires_grad for p in mapped.parameters())
+
+    assert recommend_batch(mapped, vocab, device, HISTORIES, top_k=10) == recommend_batch(regular, vocab, device, HISTORIES, top_k=10)
+    torch.testing.assert_close(
+        compute_user_embedding(mapped, vocab, device, HISTORIES[-2]),
+        compute_user_embedding(regular, vocab, device, HISTORIES[-2]),
+    )
+
+
+# -----------------------------
+# Which checkpoint is served
+# -----------------------------
+def test_latest_checkpoint_is_resolved(tmp_path, monkeypatch):
+    import ml.inference as inference
+
+    for age, name in enumerate(["transformer_incremental_2.pt", "transformer_epoch3.pt", "student_epoch1.pt"]):
+        (tmp_path / name).touch()
+        os.utime(tmp_path / name, (1000 - age, 1000 - age))   # first is newest transformer_*
+    monkeypatch.setattr(inference, "CHECKPOINT_DIR", tmp_path)
+
+    monkeypatch.setattr(inference, "CHECKPOINT_PATH", Path("latest"))
+    assert resolve_checkpoint() == tmp_path / "transformer_incremental_2.pt"
+    assert resolve_checkpoint(tmp_path / "transformer_epoch3.pt") == tmp_path / "transformer_epoch3.pt"
@@ -0,0 +1,27 @@
+# backend/tests/test_instrumentation.py
+
+from collections import defaultdict
+
+from fastapi.testclient import TestClient
+
+import main
+from api import movies
+from db import instrumentation
+
+
+def test_failing_requests_are_recorded(monkeypatch):
+    monkeypatch.setattr(instrumentation, "_route_metrics", defaultdict(instrumentation.RouteDBMetrics))
+
+    def broken(movie_id):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(movies, "get_movie_title", broken)
+
+    client = TestClient(main.app, raise_server_exceptions=False)
+    assert client.get("/movies/1").status_code == 500
+    assert client.get("/health/live").status_code == 200
+
+    routes = client.get("/metrics/db").json()["routes"]
+    assert routes["/movies/{movie_id}"]["requests"] == 1
+    assert routes["/movies/{movie_id}"]["errors"] == 1
+    assert routes["/health/live"]["errors"] == 0
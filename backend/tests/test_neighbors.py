@@ -0,0 +1,96 @@
+# backend/tests/test_neighbors.py
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from ml.neighbors import (
+    NeighborTable,
+    build_neighbors,
+    ensure_neighbors,
+    neighbors_paths_for,
+    similar_live,
+    similar_multi,
+)
+
+
+def brute_force(model, pad_idx, idx):
+    """Cosine similarity of item idx to every item, self and padding excluded."""
+    emb = F.normalize(model.item_embedding.weight.detach(), dim=1)
+    sims = emb @ emb[idx]
+    sims[[idx, pad_idx]] = float("-inf")
+    return sims
+
+
+def test_table_matches_brute_force(loaded):
+    model, vocab, _ = loaded
+    pad = vocab.pad_index
+    table = build_neighbors(model, pad, depth=10, block_size=7)   # blocks don't divide num_items
+
+    assert table.indices.shape == (vocab.num_items, 10)
+    assert table.indices.dtype == np.int32 and table.scores.dtype == np.float16
+    for idx in range(1, vocab.num_items):
+        expected_scores, expected_idx = torch.topk(brute_force(model, pad, idx), 10)
+        assert table.indices[idx].tolist() == expected_idx.tolist()
+        np.testing.assert_allclose(table.scores[idx], expected_scores.numpy(), atol=2e-3)
+        assert idx not in table.indices[idx] and pad not in table.indices[idx]
+
+
+def test_depth_is_capped_by_the_catalogue(loaded):
+    model, vocab, _ = loaded
+    table = build_neighbors(model, vocab.pad_index, depth=10_000)
+    assert table.depth == vocab.num_items - 2
+
+
+def test_live_matches_table(loaded):
+    model, vocab, _ = loaded
+    table = build_neighbors(model, vocab.pad_index, depth=10)
+    for idx in (1, 17, vocab.num_items - 1):
+        live_scores, live_idx = similar_live(model, vocab.pad_index, idx, 10)
+        table_idx, table_scores = table.lookup(idx, 10)
+        assert live_idx.tolist() == table_idx.tolist()
+        np.testing.assert_allclose(table_scores, live_scores.numpy(), atol=2e-3)
+
+
+def test_saved_per_checkpoint_version(loaded):
+    model, vocab, _ = loaded
+    path = model.checkpoint_path
+    assert NeighborTable.load(path, model.version) is None
+
+    built = ensure_neighbors(model, vocab, path, depth=10)
+    assert all(p.exists() for p in neighbors_paths_for(path, model.version))
+    assert not list(path.parent.glob("*.tmp"))
+
+    loaded_table = NeighborTable.load(path, model.version)
+    assert isinstance(loaded_table.indices, np.memmap)
+    assert np.array_equal(loaded_table.indices, built.indices)
+    assert np.array_equal(loaded_table.scores, built.scores)
+    assert NeighborTable.load(path, "another-version") is None
+
+
+def test_multi_seed_per_seed_and_aggregated(loaded):
+    model, vocab, _ = loaded
+    pad, seeds, history = vocab.pad_index, [3, 8, 21], [5, 9]
+
+    per_seed_scores, per_seed_idx = similar_multi(model, pad, seeds, 6, exclude_idx=history)
+    assert per_seed_idx.shape == (3, 6)
+    for row, seed in zip(per_seed_idx.tolist(), seeds):
+        assert not set(row) & set(seeds + history + [pad])
+
+    emb = F.normalize(model.item_embedding.weight.detach(), dim=1)
+    sims = emb[seeds] @ emb.T   # [S, N]
+    for aggregate, combine in (("mean", lambda s: s.mean(dim=0)), ("max", lambda s: s.amax(dim=0))):
+        agg_scores, agg_idx = similar_multi(model, pad, seeds, 6, exclude_idx=history, aggregate=aggregate)
+        expected = combine(sims)
+        expected[seeds + history + [pad]] = float("-inf")
+        expected_scores, expected_idx = torch.topk(expected, 6)
+        assert agg_idx.shape == (1, 6)
+        assert agg_idx[0].tolist() == expected_idx.tolist()
+        torch.testing.assert_close(agg_scores[0], expected_scores, atol=1e-5, rtol=0)
+
+
+def test_multi_seed_top_k_beyond_the_catalogue(loaded):
+    model, vocab, _ = loaded
+    scores, idx = similar_multi(model, vocab.pad_index, [1, 2], 10_000, exclude_idx=[3], aggregate="max")
+    assert idx.shape == (1, vocab.num_items - 4)   # minus seeds, excluded, padding
+    assert torch.isfinite(scores).all()
@@ -0,0 +1,43 @@
+# backend/tests/test_preprocess.py
+
+import numpy as np
+import pytest
+
+from ml.preprocess import group_user_sequences, hold_out_last, load_positive_ratings, pack_shards, spill_positive_ratings
+
+
+@pytest.fixture
+def ratings_csv(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 2000
+    rows = np.c_[rng.integers(1, 120, n), rng.integers(1, 300, n), rng.integers(1, 11, n) / 2, rng.integers(0, 500, n)]
+    path = tmp_path / "ratings.csv"
+    with path.open("w") as f:
+        f.write("userId,movieId,rating,timestamp\n")
+        f.writelines(f"{u:.0f},{m:.0f},{r:.1f},{t:.0f}\n" for u, m, r, t in rows)   # timestamps repeat
+    return path
+
+
+@pytest.mark.parametrize("holdout", [False, True])
+@pytest.mark.parametrize("n_shards", [1, 7])
+def test_sharded_packing_equals_one_global_group(ratings_csv, tmp_path, holdout, n_shards):
+    users, movies, timestamps = load_positive_ratings(ratings_csv, range_bytes=4096)
+    user_ids, offsets, grouped, dropped = group_user_sequences(users, movies, timestamps, return_dropped=True)
+    unique_ids = np.unique(grouped)
+    items = np.searchsorted(unique_ids, grouped).astype(np.int32) + 1
+    targets = None
+    if holdout:
+        items, offsets, targets = hold_out_last(items, offsets)
+
+    spill_dir = tmp_path / "spill"
+    assert spill_positive_ratings(ratings_csv, spill_dir, n_shards, range_bytes=4096) == len(users)
+    s_ids, s_offsets, s_items, s_targets, s_unique, s_dropped = pack_shards(spill_dir, n_shards, holdout)
+
+    assert s_ids.tolist() == user_ids.tolist()
+    assert s_offsets.tolist() == offsets.tolist()
+    assert s_items.tolist() == items.tolist()
+    assert s_unique.tolist() == unique_ids.tolist()
+    if holdout:
+        assert s_targets.tolist() == targets.tolist()
+    for a, b in zip(s_dropped, dropped):
+        assert a.tolist() == b.tolist()
@@ -0,0 +1,194 @@
+# backend/tests/test_serving.py
+#
+# Model-backed routes before and after the background load. The TestClient
+# is not entered as a context manager, so the lifespan loader never starts
+# and each test sets the serving state itself.
+
+import pytest
+import torch
+from fastapi.testclient import TestClient
+
+import main
+from api import health
+from conftest import MOVIE_IDS, NUM_MOVIES
+from db.database import get_db
+from ml import serving
+
+
+class PosterDB:
+    """Stands in for the session /recommend/filtered reads poster_url with."""
+
+    def __init__(self, posters):
+        self.posters = posters
+
+    async def execute(self, statement):
+        posters = self.posters
+
+        class Result:
+            def all(self):
+                return list(posters.items())
+
+        return Result()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(serving, "_status", {name: "pending" for name in serving.COMPONENTS})
+    monkeypatch.setattr(serving, "_values", {})
+    monkeypatch.setattr(serving, "_errors", {})
+    monkeypatch.setattr(serving, "_seconds", {})
+
+    async def no_redis():
+        return "unavailable"
+
+    monkeypatch.setattr(health, "cache_status", no_redis)
+    monkeypatch.setitem(main.app.dependency_overrides, get_db, lambda: PosterDB({MOVIE_IDS[0]: "http://posters/1.jpg"}))
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def ready(client, monkeypatch, loaded, movies_csv):
+    """The state load_all leaves behind: model and catalog ready, no neighbour table."""
+    import ml.inference as inference
+    import ml.neighbors as neighbors
+    from ml.item_metadata import load_item_metadata
+
+    monkeypatch.setattr(inference, "_loaded", loaded)   # serving's model is get_model()'s
+    monkeypatch.setattr(neighbors, "_table", None)
+    monkeypatch.setattr(neighbors, "BUILD_ON_LOAD", False)
+
+    model, vocab, device = loaded
+    serving._values.update(model=loaded, catalog=load_item_metadata(vocab, device, csv_path=movies_csv))
+    serving._status.update(model="ready", catalog="ready", neighbors="ready")
+    return client
+
+
+MOVIE = str(MOVIE_IDS[4])
+
+MODEL_ROUTES = [
+    ("get", "/genres", None),
+    ("get", "/genres/Drama/movies", None),
+    ("post", "/similar", {"movie_id": MOVIE, "top_k": 5}),
+    ("post", "/similar/multi", {"seed_movie_ids": [MOVIE, str(MOVIE_IDS[7])], "top_k": 5, "aggregate": "mean"}),
+    ("post", "/recommend/filtered", {"user_id": 1, "history": [MOVIE], "genres": ["Drama"], "final_k": 5}),
+    ("post", "/batch/recommend", {"user_histories": {"u1": [MOVIE]}, "top_k": 5}),
+]
+
+
+# -----------------------------
+# Before the model is loaded
+# -----------------------------
+@pytest.mark.parametrize("method, path, body", MODEL_ROUTES)
+def test_model_routes_503_while_loading(client, method, path, body):
+    response = client.request(method, path, json=body)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    assert "not ready" in response.json()["detail"]
+
+
+def test_catalog_routes_503_until_catalog_loaded(client, loaded):
+    serving._values["model"] = loaded
+    serving._status["model"] = "ready"   # catalog still loading
+    assert client.get("/genres").status_code == 503
+    assert client.get("/genres/Drama/movies").status_code == 503
+
+
+def test_probes_while_loading(client):
+    assert client.get("/").status_code == 200
+    assert client.get("/health/live").status_code == 200
+
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    body = response.json()
+    assert body["ready"] is False
+    assert body["components"]["model"]["status"] == "pending"
+
+
+# -----------------------------
+# After
+# -----------------------------
+@pytest.mark.parametrize("method, path, body", MODEL_ROUTES)
+def test_model_routes_once_ready(ready, method, path, body):
+    assert ready.request(method, path, json=body).status_code == 200
+
+
+def test_genres(ready):
+    genres = {g["name"]: g["count"] for g in ready.get("/genres").json()["genres"]}
+    assert sorted(genres) == ["Comedy", "Drama", "Horror", "Sci-Fi"]
+    assert sum(genres.values()) == 2 * (NUM_MOVIES - 1)   # two genres each, one movie without
+
+    page = ready.get("/genres/drama/movies", params={"offset": 2, "limit": 3}).json()
+    assert page["total"] == genres["Drama"]
+    assert page["offset"] == 2 and len(page["movies"]) == 3
+    assert all(m["movie_id"] in MOVIE_IDS for m in page["movies"])
+
+    assert ready.get("/genres/Western/movies").status_code == 404
+
+
+def test_filtered_keeps_the_old_contract(ready):
+    body = {"user_id": 1, "history": [MOVIE], "top_k": 50, "genres": ["Drama", "Horror"], "final_k": 100}
+    recs = ready.post("/recommend/filtered", json=body).json()["recommendations"]   # top_k accepted, ignored
+
+    assert len(recs) == NUM_MOVIES - 1   # every movie with a genre (each has one of these two)
+    posters = {r["movie_id"]: r["poster_url"] for r in recs}
+    assert posters.pop(MOVIE_IDS[0]) == "http://posters/1.jpg"
+    assert set(posters.values()) == {None}
+
+
+def test_similar(ready):
+    similar = ready.post("/similar", json={"movie_id": MOVIE, "top_k": 5}).json()["similar"]
+    assert len(similar) == 5 and all(s["movie_id"] != int(MOVIE) for s in similar)
+    assert ready.post("/similar", json={"movie_id": "999999"}).status_code == 404
+    for top_k in (0, -1):
+        assert ready.post("/similar", json={"movie_id": MOVIE, "top_k": top_k}).status_code == 422
+        assert ready.post("/similar/multi", json={"seed_movie_ids": [MOVIE], "top_k": top_k}).status_code == 422
+
+
+def test_ready_probe(ready):
+    response = ready.get("/health/ready")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["ready"] is True
+    assert body["components"]["neighbors"]["table"] is False   # /similar scans live
+    assert body["components"]["cache"]["status"] == "unavailable"
+
+
+# -----------------------------
+# Background loader
+# -----------------------------
+@pytest.fixture
+def fresh_loader(client, monkeypatch, checkpoint_path, movies_csv):
+    import ml.inference as inference
+    import ml.item_metadata as item_metadata
+    import ml.neighbors as neighbors
+
+    monkeypatch.setattr(inference, "CHECKPOINT_PATH", checkpoint_path)
+    monkeypatch.setattr(inference, "_loaded", None)
+    monkeypatch.setattr(item_metadata, "MOVIES_CSV_PATH", movies_csv)
+    monkeypatch.setattr(neighbors, "_table", None)
+    monkeypatch.setattr(neighbors, "BUILD_ON_LOAD", False)
+    monkeypatch.setattr(torch.backends.mps, "is_available", lambda: False)
+    monkeypatch.setattr(torch.cuda, "is_available", lambda: False)
+    return client
+
+
+def test_load_all(fresh_loader):
+    serving.load_all()
+
+    assert serving.ready()
+    assert all(serving.is_ready(name) for name in serving.COMPONENTS)
+    assert serving.neighbors() is None   # not built on load
+    assert fresh_loader.get("/genres").status_code == 200
+
+
+def test_load_all_failure(fresh_loader, monkeypatch, tmp_path):
+    import ml.inference as inference
+
+    monkeypatch.setattr(inference, "CHECKPOINT_PATH", tmp_path / "missing.pt")
+    serving.load_all()
+
+    status = serving.status()
+    assert status["model"]["status"] == "failed" and "missing.pt" in status["model"]["error"]
+    assert status["catalog"] == {"status": "failed", "error": "model not loaded"}
+    assert fresh_loader.get("/health/ready").status_code == 503
+    assert fresh_loader.get("/genres").status_code == 503
@@ -0,0 +1,44 @@
+# backend/tests/test_user_state.py
+
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+from db.user_state import STATE_WINDOW, advance_state, build_state
+
+
+T0 = datetime(2024, 1, 1)
+
+
+def watches(movie_ids, start=0):
+    return [(m, T0 + timedelta(minutes=start + i)) for i, m in enumerate(movie_ids)]
+
+
+def test_build_state_splits_like_inference():
+    events = watches(range(100, 100 + STATE_WINDOW + 5)) + [(7, None), (8, None)]
+    recent, taste, last_watched_at = build_state(events[::-1])   # any input order
+
+    assert recent == list(range(105, 100 + STATE_WINDOW + 5))
+    assert taste == [100, 101, 102, 103, 104, 8, 7]
+    assert last_watched_at == events[STATE_WINDOW + 4][1]
+
+
+def test_build_state_without_timed_watches():
+    recent, taste, last_watched_at = build_state([(1, None), (2, None)])
+    assert (recent, taste, last_watched_at) == ([], [1, 2], None)
+
+
+@pytest.mark.parametrize("n_old, n_new", [(0, 3), (10, 5), (STATE_WINDOW, 1), (STATE_WINDOW + 7, STATE_WINDOW + 2)])
+def test_advance_state_equals_rebuild(n_old, n_new):
+    old = watches(range(n_old)) + [(900, None)]
+    new = watches(range(1000, 1000 + n_new), start=n_old) + [(901, None)]
+
+    recent, taste, _ = build_state(old)
+    recent, taste, moved = advance_state(recent, taste, new)
+    full_recent, full_taste, _ = build_state(old + new)
+
+    assert recent == full_recent
+    assert Counter(taste) == Counter(full_taste)   # taste is a multiset; arrival order differs
+    assert 901 in moved
+    assert len(moved) == max(0, n_old + n_new - STATE_WINDOW) - max(0, n_old - STATE_WINDOW) + 1
@@ -0,0 +1,70 @@
+# backend/tests/test_vocab.py
+
+import numpy as np
+import pytest
+import torch
+
+from ml.vocab import Vocab, vocab_path_for
+
+
+@pytest.fixture
+def vocab():
+    # indices not in id order, as after ml/incremental.py appended movies
+    return Vocab.from_dict({
+        "movie_id_to_index": {"5": 3, "100": 1, "7": 2, "2": 4},
+        "index_to_movie_id": {"3": 5, "1": 100, "2": 7, "4": 2},
+        "pad_index": 0,
+    })
+
+
+def test_to_indices_matches_dict_lookup(vocab):
+    assert vocab.to_indices([7, 2, 100, 5]).tolist() == [2, 4, 1, 3]
+    assert vocab.to_indices(["7", "2"]).tolist() == [2, 4]
+    assert vocab.to_indices(np.array([5, 100], dtype=np.int32)).tolist() == [3, 1]
+
+
+def test_unknown_ids(vocab):
+    ids = [7, 999, "abc", None, 0, 2]
+    assert vocab.to_indices(ids).tolist() == [2, 4]
+    assert vocab.to_indices(ids, drop_unknown=False).tolist() == [2, 0, 0, 0, 0, 4]
+    assert vocab.to_indices([]).tolist() == []
+    assert vocab.index_of("999") is None
+    assert "7" in vocab and 999 not in vocab
+
+
+def test_to_ids_round_trip(vocab):
+    ids = [2, 100, 5, 7]
+    assert vocab.to_ids(vocab.to_indices(ids)).tolist() == ids
+    assert vocab.to_ids(torch.tensor([1, 4])).tolist() == [100, 2]
+    assert vocab.to_ids([0]).tolist() == [-1]   # padding
+
+
+def test_sizes(vocab):
+    assert vocab.num_items == 5   # max index + 1, padding included
+    assert len(vocab) == 4
+
+
+def test_dict_and_npz_round_trip(vocab, tmp_path):
+    again = Vocab.from_dict(vocab.to_dict())
+    assert again.index_to_id.tolist() == vocab.index_to_id.tolist()
+
+    path = vocab_path_for(tmp_path / "transformer_epoch1.pt")
+    assert path.name == "transformer_epoch1.vocab.npz"
+    vocab.save(path)
+    loaded = Vocab.load(path)
+    assert loaded.index_to_id.tolist() == vocab.index_to_id.tolist()
+    assert loaded.pad_index == vocab.pad_index
+    assert loaded.to_indices([2, 7]).tolist() == [4, 2]
+
+
+def test_checkpoint_vocab_is_written_on_first_load(checkpoint_path):
+    from ml.inference import load_vocab
+
+    ckpt = torch.load(checkpoint_path)
+    assert not vocab_path_for(checkpoint_path).exists()
+    from_dict = load_vocab(checkpoint_path, ckpt)
+    assert vocab_path_for(checkpoint_path).exists()
+
+    from_npz = load_vocab(checkpoint_path, ckpt)
+    assert from_npz.index_to_id.tolist() == from_dict.index_to_id.tolist()
+    assert from_npz.to_indices([1, 11, 591]).tolist() == [1, 2, 60]
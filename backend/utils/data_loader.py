@@ -1,4 +1,3 @@
-import pandas as pd
 from pathlib import Path
 
 _movie_titles = {}
@@ -9,6 +8,8 @@ def load_movie_titles():
         return _movie_titles
         
     try:
+        import pandas as pd   # only when titles are first needed, not at app import
+
         movies_path = Path(__file__).parent.parent / "data" / "movielens_raw" / "movies.csv"
         df = pd.read_csv(movies_path)
         # Ensure movie IDs are strings
@@ -23,3 +24,8 @@ def load_movie_titles():
 def get_movie_title(movie_id: str) -> str:
     titles = load_movie_titles()
     return titles.get(str(movie_id), f"Movie {movie_id}")
+
+def loaded_movie_title(movie_id) -> str:
+    """Like get_movie_title, but never reads movies.csv (safe in async handlers):
+    "Movie <id>" until the serving loader has loaded the titles."""
+    return _movie_titles.get(str(movie_id), f"Movie {movie_id}")